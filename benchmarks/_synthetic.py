@@ -0,0 +1,48 @@
+"""Shared helpers for the offline benchmarks.
+
+Benchmarks run on synthetic images so they can be repeated without a BIDS dataset.
+"""
+
+import os
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+
+IMAGE_SUFFIXES = (".nii", ".nii.gz", ".nii.zst")
+
+
+def make_synthetic_image(
+    out_path: os.PathLike, shape=(64, 64, 36, 200), seed: int = 0, dtype=np.float32
+):
+    """Write a random 4D image with a sinusoidal signal, returning its path."""
+    rng = np.random.default_rng(seed)
+    timepoints = np.arange(shape[-1])
+    signal = 1000 + 50 * np.sin(2 * np.pi * 0.05 * timepoints)
+    data = (signal + rng.normal(0, 10, shape)).astype(dtype)
+
+    nib.save(nib.Nifti1Image(data, np.eye(4)), out_path)
+    return Path(out_path)
+
+
+def make_synthetic_mask(out_path: os.PathLike, shape=(64, 64, 36)):
+    """Write an ellipsoid brain-like mask covering roughly half of the volume."""
+    grid = np.meshgrid(*[np.linspace(-1, 1, n) for n in shape], indexing="ij")
+    mask = (sum(axis**2 for axis in grid) <= 1).astype(np.uint8)
+
+    nib.save(nib.Nifti1Image(mask, np.eye(4)), out_path)
+    return Path(out_path)
+
+
+def image_bytes(directory: os.PathLike):
+    """Total size of the image files written below a directory."""
+    return sum(
+        path.stat().st_size
+        for path in Path(directory).rglob("*")
+        if path.is_file() and path.name.endswith(IMAGE_SUFFIXES)
+    )
+
+
+def parse_shape(shape: str):
+    """Parse a shape given as 'X,Y,Z,T'."""
+    return tuple(int(dim) for dim in shape.split(","))
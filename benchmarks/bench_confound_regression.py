@@ -0,0 +1,124 @@
+"""Compare the confound regression implementations on one synthetic image.
+
+numpy_ols always runs; fsl_glm and 3dTproject run when they are on the PATH. For
+each, reports the wall-clock time and the largest in-mask difference from the
+numpy_ols residuals. The design includes a constant column, which 3dTproject gets
+from -polort 0 instead, so all three fit the same model.
+
+Usage:
+    python benchmarks/bench_confound_regression.py --shape 64,64,36,200 --confounds 24
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+from nipype import config, logging
+from nipype.interfaces.afni import TProject
+from nipype.interfaces.fsl import GLM
+
+from clpipe.postprocutils.image_workflows import (
+    build_confound_regression_numpy_ols_workflow,
+)
+
+from _synthetic import make_synthetic_image, make_synthetic_mask, parse_shape
+
+
+def run_numpy_ols(in_file, confounds_file, mask_file, work_dir):
+    out_file = work_dir / "numpy_ols.nii"
+    wf = build_confound_regression_numpy_ols_workflow(
+        in_file=in_file,
+        out_file=out_file,
+        confounds_file=confounds_file,
+        mask_file=mask_file,
+        base_dir=work_dir,
+    )
+    wf.run()
+
+    return out_file
+
+
+def run_fsl_glm(in_file, design_file, mask_file, work_dir):
+    out_file = work_dir / "fsl_glm.nii.gz"
+    GLM(
+        in_file=str(in_file),
+        design=str(design_file),
+        mask=str(mask_file),
+        out_res_name=str(out_file),
+    ).run(cwd=str(work_dir))
+
+    return out_file
+
+
+def run_3dtproject(in_file, ort_file, mask_file, work_dir):
+    out_file = work_dir / "3dTproject.nii.gz"
+    TProject(
+        in_file=str(in_file),
+        ort=str(ort_file),
+        mask=str(mask_file),
+        polort=0,
+        out_file=str(out_file),
+    ).run(cwd=str(work_dir))
+
+    return out_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shape", default="64,64,36,200", help="X,Y,Z,T")
+    parser.add_argument("--confounds", type=int, default=24)
+    args = parser.parse_args()
+    config.set("logging", "workflow_level", "WARNING")
+    config.set("logging", "interface_level", "WARNING")
+    logging.update_logging(config)
+    shape = parse_shape(args.shape)
+
+    rng = np.random.default_rng(0)
+    confounds = rng.normal(size=(shape[-1], args.confounds))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        in_file = make_synthetic_image(tmp / "image.nii.gz", shape)
+        mask_file = make_synthetic_mask(tmp / "mask.nii.gz", shape[:-1])
+
+        design = np.column_stack([confounds, np.ones(shape[-1])])
+        confounds_file = tmp / "confounds.tsv"
+        pd.DataFrame(design).to_csv(confounds_file, sep="\t", index=False)
+        design_file = tmp / "design.txt"
+        np.savetxt(design_file, design)
+        ort_file = tmp / "ort.1D"
+        np.savetxt(ort_file, confounds)
+
+        runs = [("numpy_ols", run_numpy_ols, confounds_file)]
+        if shutil.which("fsl_glm"):
+            runs.append(("fsl_glm", run_fsl_glm, design_file))
+        if shutil.which("3dTproject"):
+            runs.append(("3dTproject", run_3dtproject, ort_file))
+
+        mask = nib.load(mask_file).get_fdata() > 0
+        reference = None
+
+        print(f"voxels in mask: {mask.sum()}, confounds: {design.shape[1]}")
+        print(f"{'implementation':<16}{'seconds':>10}{'max abs diff':>16}")
+        for name, run, design_input in runs:
+            work_dir = tmp / name
+            work_dir.mkdir()
+
+            start = time.perf_counter()
+            out_file = run(in_file, design_input, mask_file, work_dir)
+            seconds = time.perf_counter() - start
+
+            residuals = nib.load(out_file).get_fdata()[mask]
+            if reference is None:
+                reference = residuals
+            difference = np.abs(residuals - reference).max()
+            print(f"{name:<16}{seconds:>10.2f}{difference:>16.3g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Compare chained and fused execution of the NumPy-based postprocessing steps.
+
+For each mode, reports the wall-clock time to process one synthetic image and the
+bytes of image files written to the working directory.
+
+Usage:
+    python benchmarks/bench_fused_postprocessing.py --shape 64,64,36,200
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from nipype import config, logging
+
+from clpipe.config.options import PostProcessingOptions
+from clpipe.postprocutils.image_workflows import build_image_postprocessing_workflow
+
+from _synthetic import image_bytes, make_synthetic_image, make_synthetic_mask, parse_shape
+
+
+def run_mode(processing_options, in_file, mask_file, scrub_vector, work_dir, fused):
+    processing_options.fused_execution = fused
+    wf = build_image_postprocessing_workflow(
+        processing_options,
+        in_file=in_file,
+        export_path=work_dir / "out.nii",
+        name="fused" if fused else "chained",
+        tr=2,
+        mask_file=mask_file,
+        scrub_vector=scrub_vector,
+        base_dir=work_dir,
+    )
+
+    start = time.perf_counter()
+    wf.run()
+    seconds = time.perf_counter() - start
+
+    return seconds, image_bytes(work_dir / wf.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shape", default="64,64,36,200", help="X,Y,Z,T")
+    args = parser.parse_args()
+    config.set("logging", "workflow_level", "WARNING")
+    config.set("logging", "interface_level", "WARNING")
+    logging.update_logging(config)
+    shape = parse_shape(args.shape)
+
+    processing_options = PostProcessingOptions()
+    processing_options.processing_steps = [
+        "TemporalFiltering",
+        "TrimTimepoints",
+        "ScrubTimepoints",
+    ]
+    # fslmaths is needed to run ApplyMask in chained mode
+    if shutil.which("fslmaths"):
+        processing_options.processing_steps.append("ApplyMask")
+    step_options = processing_options.processing_step_options
+    step_options.temporal_filtering.implementation = "Butterworth"
+    step_options.trim_timepoints.from_beginning = 2
+
+    scrub_vector = [0] * (shape[-1] - 2)
+    scrub_vector[len(scrub_vector) // 2] = 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        in_file = make_synthetic_image(tmp / "image.nii.gz", shape)
+        mask_file = make_synthetic_mask(tmp / "mask.nii.gz", shape[:-1])
+
+        print(f"steps: {', '.join(processing_options.processing_steps)}")
+        print(f"{'mode':<10}{'seconds':>10}{'MB written':>14}")
+        for fused in (False, True):
+            work_dir = tmp / ("fused" if fused else "chained")
+            seconds, written = run_mode(
+                processing_options, in_file, mask_file, scrub_vector, work_dir, fused
+            )
+            mode = "fused" if fused else "chained"
+            print(f"{mode:<10}{seconds:>10.2f}{written / 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
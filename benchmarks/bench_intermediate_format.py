@@ -0,0 +1,86 @@
+"""Compare intermediate file formats for the postprocessing working directory.
+
+For each format setting, reports the seconds spent in each step and the bytes of
+image files written to the working directory for one synthetic image.
+
+Usage:
+    python benchmarks/bench_intermediate_format.py --shape 64,64,36,200
+"""
+
+import argparse
+import importlib.util
+import shutil
+import tempfile
+from pathlib import Path
+
+from nipype import config, logging
+
+from clpipe.config.options import PostProcessingOptions
+from clpipe.postprocutils.image_workflows import build_image_postprocessing_workflow
+
+from _synthetic import image_bytes, make_synthetic_image, parse_shape
+
+# (intermediate_format, compression level)
+SETTINGS = [("", 1), ("nii", 1), ("nii.gz", 1), ("nii.gz", 6), ("nii.zst", 3)]
+
+
+def run_setting(processing_options, in_file, work_dir):
+    wf = build_image_postprocessing_workflow(
+        processing_options,
+        in_file=in_file,
+        export_path=work_dir / "out.nii.gz",
+        tr=2,
+        base_dir=work_dir,
+    )
+    execution_graph = wf.run()
+
+    step_seconds = {}
+    for node in execution_graph.nodes():
+        step = node.fullname.split(".")[1] if "." in node.fullname else node.name
+        step_seconds[step] = step_seconds.get(step, 0) + node.result.runtime.duration
+
+    return step_seconds, image_bytes(work_dir / wf.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shape", default="64,64,36,200", help="X,Y,Z,T")
+    args = parser.parse_args()
+    config.set("logging", "workflow_level", "WARNING")
+    config.set("logging", "interface_level", "WARNING")
+    logging.update_logging(config)
+    shape = parse_shape(args.shape)
+
+    processing_options = PostProcessingOptions()
+    processing_options.processing_steps = ["TemporalFiltering", "TrimTimepoints"]
+    # Include an FSL step when FSL is available
+    if shutil.which("fslmaths"):
+        processing_options.processing_steps.insert(0, "IntensityNormalization")
+    step_options = processing_options.processing_step_options
+    step_options.temporal_filtering.implementation = "Butterworth"
+    step_options.trim_timepoints.from_beginning = 2
+
+    settings = SETTINGS
+    if importlib.util.find_spec("pyzstd") is None:
+        settings = [setting for setting in SETTINGS if setting[0] != "nii.zst"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        in_file = make_synthetic_image(tmp / "image.nii.gz", shape)
+
+        for intermediate_format, level in settings:
+            processing_options.intermediate_format = intermediate_format
+            processing_options.intermediate_compression_level = level
+            label = f"{intermediate_format or 'default'}@{level}"
+
+            step_seconds, written = run_setting(
+                processing_options, in_file, tmp / label
+            )
+            timings = ", ".join(
+                f"{step} {seconds:.2f}s" for step, seconds in step_seconds.items()
+            )
+            print(f"{label:<12}{written / 1e6:>8.1f} MB  {timings}")
+
+
+if __name__ == "__main__":
+    main()
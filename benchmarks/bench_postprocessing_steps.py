@@ -0,0 +1,278 @@
+"""Time each implementation of the postprocessing steps on synthetic images of
+several sizes, saving results that can be compared between releases.
+
+Implementations needing FSL or AFNI run when their command is on the PATH, and
+are skipped otherwise. Each case is timed --repeats times, in a fresh working
+directory, and its median is reported. Given a baseline from an earlier run with
+--compare, each case's ratio to the baseline is shown, and the script exits with
+status 1 if any case is slower than --tolerance times its baseline.
+
+Usage:
+    python benchmarks/bench_postprocessing_steps.py --output results.json
+    python benchmarks/bench_postprocessing_steps.py --sizes 32,32,20,100 \
+        --compare results.json
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from nipype import config, logging
+
+from clpipe.config.options import PostProcessingOptions
+from clpipe.config.package import VERSION
+from clpipe.postprocutils.image_workflows import build_image_postprocessing_workflow
+from clpipe.postprocutils.spec_interpolate import spec_inter
+from clpipe.postprocutils.utils import MaskedMatrix
+
+from _synthetic import make_synthetic_image, make_synthetic_mask, parse_shape
+from bench_confound_regression import run_3dtproject, run_fsl_glm, run_numpy_ols
+
+DEFAULT_SIZES = ["32,32,20,100", "64,64,36,200"]
+TR = 2.0
+CONFOUND_COUNT = 24
+
+
+def run_step(step, implementation):
+    """Make a case running one step of the image workflow."""
+
+    def run(inputs, work_dir):
+        processing_options = PostProcessingOptions()
+        processing_options.processing_steps = [step]
+        step_options = processing_options.processing_step_options
+        if step == "TemporalFiltering":
+            step_options.temporal_filtering.implementation = implementation
+        elif step == "SpatialSmoothing":
+            step_options.spatial_smoothing.implementation = implementation
+        elif step == "ScrubTimepoints":
+            step_options.scrub_timepoints.insert_na = implementation == "insert_na"
+
+        build_image_postprocessing_workflow(
+            processing_options,
+            in_file=inputs["in_file"],
+            export_path=work_dir / "out.nii.gz",
+            name=step,
+            tr=TR,
+            mask_file=inputs["mask_file"],
+            scrub_vector=inputs["scrub_vector"],
+            base_dir=work_dir,
+        ).run()
+
+    return run
+
+
+def run_regression(function, design_input):
+    """Make a case running a confound regression implementation."""
+
+    def run(inputs, work_dir):
+        function(inputs["in_file"], inputs[design_input], inputs["mask_file"], work_dir)
+
+    return run
+
+
+def run_interpolated_scrub(inputs, work_dir):
+    """Replace scrubbed timepoints with their spectral interpolation, then remove
+    them, as when filtering scrubbed data."""
+    data = MaskedMatrix.from_image(
+        inputs["in_file"], inputs["mask_file"], dtype=np.float32
+    ).data
+    interpolated = spec_inter(data, TR, 8, inputs["scrub_vector"], 1, 5000)
+    np.delete(interpolated, np.flatnonzero(inputs["scrub_vector"]), axis=0)
+
+
+CASES = [
+    ("TemporalFiltering", "Butterworth", None),
+    ("TemporalFiltering", "fslmaths", "fslmaths"),
+    ("TemporalFiltering", "afni_3dTproject", "3dTproject"),
+    ("ConfoundRegression", "numpy_ols", None),
+    ("ConfoundRegression", "fsl_glm", "fsl_glm"),
+    ("ConfoundRegression", "afni_3dTproject", "3dTproject"),
+    ("SpatialSmoothing", "SUSAN", "susan"),
+    ("ScrubTimepoints", "insert_na", None),
+    ("ScrubTimepoints", "remove", None),
+    ("ScrubTimepoints", "spectral_interpolation", None),
+]
+"""Each case's step, implementation and the command it needs, if any"""
+
+CASE_RUNNERS = {
+    ("ConfoundRegression", "numpy_ols"): run_regression(
+        run_numpy_ols, "confounds_file"
+    ),
+    ("ConfoundRegression", "fsl_glm"): run_regression(run_fsl_glm, "design_file"),
+    ("ConfoundRegression", "afni_3dTproject"): run_regression(
+        run_3dtproject, "ort_file"
+    ),
+    ("ScrubTimepoints", "spectral_interpolation"): run_interpolated_scrub,
+}
+
+
+def make_inputs(directory: Path, shape):
+    """Write a synthetic image, mask and confounds, in each format the
+    implementations need."""
+    directory.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    confounds = rng.normal(size=(shape[-1], CONFOUND_COUNT))
+    design = np.column_stack([confounds, np.ones(shape[-1])])
+
+    confounds_file = directory / "confounds.tsv"
+    pd.DataFrame(design).to_csv(confounds_file, sep="\t", index=False)
+    design_file = directory / "design.txt"
+    np.savetxt(design_file, design)
+    ort_file = directory / "ort.1D"
+    np.savetxt(ort_file, confounds)
+
+    scrub_vector = [0] * shape[-1]
+    for index in (2, shape[-1] // 2, shape[-1] // 2 + 1):
+        scrub_vector[index] = 1
+
+    return {
+        "in_file": make_synthetic_image(directory / "image.nii.gz", shape),
+        "mask_file": make_synthetic_mask(directory / "mask.nii.gz", shape[:-1]),
+        "confounds_file": confounds_file,
+        "design_file": design_file,
+        "ort_file": ort_file,
+        "scrub_vector": scrub_vector,
+    }
+
+
+def time_case(run, inputs, work_dir: Path, repeats: int):
+    times = []
+    for repeat in range(repeats):
+        repeat_dir = work_dir / str(repeat)
+        repeat_dir.mkdir(parents=True)
+
+        start = time.perf_counter()
+        run(inputs, repeat_dir)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def get_metadata():
+    """Describe the run, so results are only compared knowingly across machines."""
+    try:
+        commit = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+
+    return {
+        "clpipe_version": VERSION,
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "node": platform.node(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print each case's ratio to the baseline, returning the regressed cases."""
+    baseline_seconds = {
+        (result["step"], result["implementation"], result["shape"]): result["seconds"]
+        for result in baseline["results"]
+    }
+    print(
+        f"\nbaseline: clpipe {baseline['metadata']['clpipe_version']} "
+        f"({baseline['metadata']['commit']})"
+    )
+    print(f"{'step':<20}{'implementation':<24}{'shape':<16}{'ratio':>8}")
+
+    regressions = []
+    for result in results:
+        key = (result["step"], result["implementation"], result["shape"])
+        if key not in baseline_seconds:
+            continue
+        ratio = result["seconds"] / baseline_seconds[key]
+        flag = "  SLOWER" if ratio > tolerance else ""
+        print(f"{key[0]:<20}{key[1]:<24}{key[2]:<16}{ratio:>8.2f}{flag}")
+        if ratio > tolerance:
+            regressions.append(result)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", nargs="+", default=DEFAULT_SIZES, help="X,Y,Z,T for each size"
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--steps", nargs="+", default=None, help="Only run cases for these steps"
+    )
+    parser.add_argument("--output", default=None, help="Save results as JSON")
+    parser.add_argument("--compare", default=None, help="A baseline results JSON")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.25,
+        help="Slowdown from the baseline that counts as a regression",
+    )
+    args = parser.parse_args()
+    config.set("logging", "workflow_level", "WARNING")
+    config.set("logging", "interface_level", "WARNING")
+    logging.update_logging(config)
+
+    results = []
+    print(f"{'step':<20}{'implementation':<24}{'shape':<16}{'seconds':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for size in args.sizes:
+            shape = parse_shape(size)
+            inputs = make_inputs(tmp / size / "inputs", shape)
+
+            for step, implementation, command in CASES:
+                if args.steps and step not in args.steps:
+                    continue
+                if command and not shutil.which(command):
+                    print(f"{step:<20}{implementation:<24}{size:<16}{'skipped':>10}")
+                    continue
+
+                run = CASE_RUNNERS.get(
+                    (step, implementation), run_step(step, implementation)
+                )
+                times = time_case(
+                    run, inputs, tmp / size / f"{step}_{implementation}", args.repeats
+                )
+                seconds = statistics.median(times)
+                print(f"{step:<20}{implementation:<24}{size:<16}{seconds:>10.2f}")
+                results.append(
+                    {
+                        "step": step,
+                        "implementation": implementation,
+                        "shape": size,
+                        "seconds": seconds,
+                        "min_seconds": min(times),
+                        "repeats": len(times),
+                    }
+                )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": get_metadata(), "results": results}, f, indent=4)
+        print(f"\nresults saved to: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Compare the vectorized spectral interpolation with the loop-based version it
+replaced, checking that both give the same output.
+
+Runs on the sample image and mask in tests/data, or on a synthetic image when
+--shape is given. Reports the seconds each takes and the largest difference.
+The loop-based version allocates a frequency by voxel by timepoint array per bin,
+so keep --bin-size small for long synthetic series.
+
+Usage:
+    python benchmarks/bench_spec_interpolate.py
+    python benchmarks/bench_spec_interpolate.py --shape 40,40,30,150 --bin-size 200
+"""
+
+import argparse
+import logging
+import math
+import tempfile
+import time
+from pathlib import Path
+
+import numpy
+
+from clpipe.postprocutils.spec_interpolate import spec_inter
+from clpipe.postprocutils.utils import MaskedMatrix
+
+from _synthetic import make_synthetic_image, make_synthetic_mask, parse_shape
+
+TEST_DATA = Path(__file__).resolve().parent.parent / "tests" / "data"
+
+
+def spec_inter_loop(arr, tr, ofreq, scrub_mask, hifreq, binSize):
+    """The loop-based implementation, kept as the reference."""
+    scrub_mask = numpy.asarray(scrub_mask)
+    goodtpindex = numpy.asarray([[i for i, e in enumerate(scrub_mask) if e == 0]])
+    badtpindex = numpy.asarray([[i for i, e in enumerate(scrub_mask) if e == 1]])
+    tobs_good = (goodtpindex + 1) * tr
+    timespan = tobs_good.max() - tobs_good.min()
+    tpobs_all = numpy.arange(tr, tr * float(scrub_mask.shape[0] + 1), tr)
+    freq = numpy.arange(
+        1 / (timespan * ofreq),
+        hifreq * tobs_good.shape[1] / (2 * timespan) + 1 / (timespan * ofreq),
+        1 / (timespan * ofreq),
+    )[numpy.newaxis]
+    freqang = 2.0 * math.pi * freq
+    offsets = numpy.arctan2(
+        numpy.sin(numpy.matmul(numpy.transpose(2 * freqang), tobs_good)).sum(1),
+        numpy.cos(numpy.matmul(numpy.transpose(2 * freqang), tobs_good)).sum(1),
+    ) / (2 * freqang)
+    costerm = numpy.cos(
+        numpy.matmul(numpy.transpose(freqang), tobs_good) - (offsets * freqang).T
+    )
+    sinterm = numpy.sin(
+        numpy.matmul(numpy.transpose(freqang), tobs_good) - (offsets * freqang).T
+    )
+    totbins = math.ceil(float(arr.shape[1]) / float(binSize))
+    binnedRecon = []
+    for bin in range(0, totbins):
+        logging.debug("Bin " + str(bin) + " out of " + str(totbins))
+        binVox = numpy.arange(bin * binSize, (bin + 1) * binSize, 1)
+        binVox = numpy.delete(
+            binVox, [i for i, e in enumerate(binVox) if e >= arr.shape[1]]
+        )
+        gooddata = arr[goodtpindex.T, binVox]
+        cosMultTemp = [
+            numpy.matmul(costerm[:, i][numpy.newaxis].T, gooddata[i, :][numpy.newaxis])
+            for i in range(0, tobs_good.shape[1])
+        ]
+        cosmult = numpy.dstack(cosMultTemp)
+        num = cosmult.sum(axis=2)
+        dem = (numpy.power(costerm, 2)).sum(axis=1)[numpy.newaxis].T
+        cosine = num / dem
+        sinMultTemp = [
+            numpy.matmul(sinterm[:, i][numpy.newaxis].T, gooddata[i, :][numpy.newaxis])
+            for i in range(0, tobs_good.shape[1])
+        ]
+        sinmult = numpy.dstack(sinMultTemp)
+        num = sinmult.sum(axis=2)
+        dem = (numpy.power(sinterm, 2)).sum(axis=1)[numpy.newaxis].T
+        sine = num / dem
+        freqRep = numpy.dstack([freqang * tp for tp in tpobs_all])[0, :, :].T
+        sin_t = numpy.sin(freqRep)
+        cos_t = numpy.cos(freqRep)
+        S = numpy.matmul(sin_t, sine)
+        C = numpy.matmul(cos_t, cosine)
+        temp = C + S
+        binnedRecon.append(temp)
+    recon = numpy.hstack(binnedRecon)
+    recon_std = numpy.std(recon, 0, ddof=1)
+    data_std = numpy.std(arr[goodtpindex, :], 1, ddof=1)
+    data_std[data_std == 0] = -1
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        cor_factor = recon_std / data_std
+        recon = recon / cor_factor
+    numpy.nan_to_num(recon, copy=False)
+    corr_arr = numpy.copy(arr)
+    if badtpindex.shape[1] != 0:
+        corr_arr[badtpindex, :] = recon[badtpindex, :]
+    return corr_arr
+
+
+def run(name, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    print(f"{name:<14}{seconds:>10.2f}")
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shape", default=None, help="X,Y,Z,T")
+    parser.add_argument("--bin-size", type=int, default=5000)
+    parser.add_argument("--ofreq", type=int, default=8)
+    parser.add_argument("--hifreq", type=float, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.shape:
+            shape = parse_shape(args.shape)
+            in_file = make_synthetic_image(Path(tmp) / "image.nii.gz", shape)
+            mask_file = make_synthetic_mask(Path(tmp) / "mask.nii.gz", shape[:-1])
+        else:
+            in_file = TEST_DATA / "sample_raw.nii.gz"
+            mask_file = TEST_DATA / "sample_raw_mask.nii.gz"
+        data = MaskedMatrix.from_image(in_file, mask_file, dtype=numpy.float32).data
+
+    timepoints = data.shape[0]
+    scrub_mask = [0] * timepoints
+    for index in (2, timepoints // 2, timepoints // 2 + 1):
+        scrub_mask[index] = 1
+
+    print(f"timepoints: {timepoints}, voxels: {data.shape[1]}")
+    print(f"{'version':<14}{'seconds':>10}")
+    arguments = (data, 2.0, args.ofreq, scrub_mask, args.hifreq, args.bin_size)
+    reference = run("loop", spec_inter_loop, *arguments)
+    vectorized = run("vectorized", spec_inter, *arguments)
+
+    print(f"max abs difference: {numpy.abs(reference - vectorized).max():.3g}")
+    print(f"identical: {numpy.array_equal(reference, vectorized)}")
+
+
+if __name__ == "__main__":
+    main()
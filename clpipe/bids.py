@@ -13,6 +13,7 @@ from .errors import (
     SubjectNotFoundError,
 )
 import json
+import time
 import warnings
 import os
 
@@ -25,6 +26,15 @@ HTML = re.compile(r".*html.*")
 SVG = re.compile(r".*svg.*")
 DEFAULT_IGNORE = [ANAT, FMAP, DESG, HTML, SVG]
 
+BIDS_INDEX_NAME = "bids_index"
+"""This is the location of the pybids-generated index"""
+
+REFRESH_FULL = "full"
+REFRESH_INCREMENTAL = "incremental"
+INDEX_STATE_FILE_NAME = "clpipe_index_state.json"
+"""Saved in the index folder, records the subject folder mtimes last indexed"""
+
+
 def get_bids(
     bids_dir: os.PathLike,
     validate=False,
@@ -35,51 +45,82 @@ def get_bids(
     ignore=DEFAULT_IGNORE,
     logger=None,
 ) -> BIDSLayout:
+    """Open the BIDS index at database_path, building it first if needed.
+
+    refresh may be False, to reuse an existing index, "full" (or True) to rebuild
+    it from scratch, or "incremental" to re-index only the subjects whose folders
+    have changed since they were last indexed. If the incremental refresh can't
+    run on the installed pybids, everything is re-indexed instead.
+    """
     try:
         database_path = Path(database_path)
+        incremental = refresh == REFRESH_INCREMENTAL
 
         # Use an existing pybids database,
         #   and user did not request an index refresh
-        if database_path.exists() and not refresh:
+        if database_path.exists() and (not refresh or incremental):
             if logger:
                 logger.debug(f"Using existing BIDS index: {database_path}")
-            return BIDSLayout(database_path=database_path)
-        # Index from scratch (slow)
-        else:
-            indexer = BIDSLayoutIndexer(
-                validate=validate, index_metadata=index_metadata, ignore=ignore
-            )
-            if logger:
-                logger.info(f"Indexing BIDS directory: {bids_dir}")
-                logger.info("This can take a few minutes...")
-
-            if fmriprep_dir:
-                # When setting derivative dir in this version of pybids, don't use
-                #   the BIDSLayoutIndexer, pass through Layout instead - indexer
-                #   ignores derivatives due to bug.
-                # Ignore user warning about not using BIDSLayoutIndexer
-                with warnings.catch_warnings():
-                    warnings.filterwarnings("ignore", category=UserWarning)
-
-                    layout = BIDSLayout(
-                        bids_dir,
-                        database_path=database_path,
-                        derivatives=fmriprep_dir,
-                        reset_database=refresh,
-                        indexer=indexer,
-                        index_metadata=index_metadata,
-                        ignore=ignore,
+            layout = BIDSLayout(database_path=database_path)
+            if not incremental:
+                return layout
+            try:
+                refresh_index_incremental(
+                    layout, database_path, ignore=ignore, logger=logger
+                )
+                return layout
+            # The incremental refresh relies on pybids internals, which other
+            #   versions of pybids may not have
+            except (AttributeError, ImportError) as error:
+                if logger:
+                    logger.warning(
+                        f"Incremental index refresh failed ({error!r}). "
+                        "Re-indexing everything instead."
                     )
-            else:
+                refresh = REFRESH_FULL
+
+        # Index from scratch (slow)
+        start = time.perf_counter()
+        refresh = bool(refresh)
+        indexer = BIDSLayoutIndexer(
+            validate=validate, index_metadata=index_metadata, ignore=ignore
+        )
+        if logger:
+            logger.info(f"Indexing BIDS directory: {bids_dir}")
+            logger.info("This can take a few minutes...")
+
+        if fmriprep_dir:
+            # When setting derivative dir in this version of pybids, don't use
+            #   the BIDSLayoutIndexer, pass through Layout instead - indexer
+            #   ignores derivatives due to bug.
+            # Ignore user warning about not using BIDSLayoutIndexer
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", category=UserWarning)
+
                 layout = BIDSLayout(
                     bids_dir,
                     database_path=database_path,
+                    derivatives=fmriprep_dir,
                     reset_database=refresh,
                     indexer=indexer,
                     index_metadata=index_metadata,
                     ignore=ignore,
                 )
-            return layout
+        else:
+            layout = BIDSLayout(
+                bids_dir,
+                database_path=database_path,
+                reset_database=refresh,
+                indexer=indexer,
+                index_metadata=index_metadata,
+                ignore=ignore,
+            )
+        if logger:
+            logger.info(f"Indexed BIDS directory in {time.perf_counter() - start:.1f}s")
+
+        # Record what was indexed, for later incremental refreshes
+        _write_index_state(database_path, _get_index_state(layout))
+        return layout
 
     except FileNotFoundError as fne:
         if logger:
@@ -87,6 +128,152 @@ def get_bids(
         raise fne
 
 
+def refresh_index_incremental(
+    layout: BIDSLayout,
+    database_path: os.PathLike,
+    ignore=DEFAULT_IGNORE,
+    logger=None,
+):
+    """Bring an existing index up to date without re-indexing everything.
+
+    Subject folders whose modification times differ from those recorded at the
+    last index are compared with the files the index holds for them. Files no
+    longer on disk are removed, and new files are indexed. Metadata and files
+    outside of subject folders are not refreshed.
+    """
+    start = time.perf_counter()
+    previous_state = _read_index_state(database_path)
+    state = {}
+
+    for sub_layout in [layout] + list(layout.derivatives.values()):
+        root = str(sub_layout._root)
+        scan_start = time.perf_counter()
+        subject_mtimes = _get_subject_mtimes(sub_layout._root)
+        previous_mtimes = previous_state.get(root, {})
+        changed = [
+            subject_dir
+            for subject_dir in set(subject_mtimes) | set(previous_mtimes)
+            if subject_mtimes.get(subject_dir) != previous_mtimes.get(subject_dir)
+        ]
+        if logger:
+            logger.info(
+                f"Found {len(changed)} changed subject folder(s) of "
+                f"{len(subject_mtimes)} in {root} "
+                f"({time.perf_counter() - scan_start:.1f}s)"
+            )
+
+        if changed:
+            update_start = time.perf_counter()
+            added, removed = _reindex_subject_dirs(sub_layout, changed, ignore)
+            if logger:
+                logger.info(
+                    f"Indexed {added} new file(s) and removed {removed} "
+                    f"({time.perf_counter() - update_start:.1f}s)"
+                )
+
+        state[root] = subject_mtimes
+
+    _write_index_state(database_path, state)
+    if logger:
+        logger.info(f"Refreshed BIDS index in {time.perf_counter() - start:.1f}s")
+
+
+def _get_subject_mtimes(root: os.PathLike) -> dict:
+    """Map each subject folder to the latest mtime of the folders within it, which
+    changes when files are added to or removed from the subject."""
+    subject_mtimes = {}
+    for subject_dir in Path(root).glob("sub-*"):
+        if not subject_dir.is_dir():
+            continue
+        subject_mtimes[str(subject_dir)] = max(
+            os.stat(dir_path).st_mtime_ns for dir_path, _, _ in os.walk(subject_dir)
+        )
+
+    return subject_mtimes
+
+
+def _reindex_subject_dirs(layout: BIDSLayout, subject_dirs: list, ignore):
+    """Sync the index's files for the given subject folders with the disk. Returns
+    the number of files added and removed."""
+    from bids.layout.index import _regexfy
+    from bids.layout.models import BIDSFile, FileAssociation, Tag
+    from bids.layout.validation import validate_indexing_args
+
+    # Set up the indexer as BIDSLayoutIndexer.__call__ does, without indexing
+    indexer = BIDSLayoutIndexer(validate=False, ignore=ignore)
+    indexer._layout = layout
+    indexer._config = list(layout.config.values())
+    ignore, force = validate_indexing_args(ignore, None, layout._root)
+    indexer._include_patterns = [
+        _regexfy(patt, root=layout._root) for patt in force or []
+    ]
+    indexer._exclude_patterns = [
+        _regexfy(patt, root=layout._root) for patt in ignore or []
+    ]
+    config_entities = {}
+    for config in indexer._config:
+        config_entities.update(config.entities)
+
+    session = layout.connection_manager.session
+    added, removed = 0, 0
+    for subject_dir in subject_dirs:
+        on_disk = set()
+        for dir_path, _, file_names in os.walk(subject_dir):
+            on_disk.update(
+                str(Path(dir_path) / file_name)
+                for file_name in file_names
+                if file_name != indexer.config_filename
+            )
+        indexed = {
+            path
+            for (path,) in session.query(BIDSFile.path).filter(
+                BIDSFile.path.startswith(subject_dir + os.sep)
+            )
+        }
+
+        stale = list(indexed - on_disk)
+        if stale:
+            session.query(Tag).filter(Tag.file_path.in_(stale)).delete(
+                synchronize_session=False
+            )
+            session.query(FileAssociation).filter(
+                FileAssociation.src.in_(stale) | FileAssociation.dst.in_(stale)
+            ).delete(synchronize_session=False)
+            session.query(BIDSFile).filter(BIDSFile.path.in_(stale)).delete(
+                synchronize_session=False
+            )
+            removed += len(stale)
+
+        for path in sorted(on_disk - indexed):
+            if indexer._validate_file(Path(path)):
+                indexer._index_file(Path(path), config_entities)
+                added += 1
+
+        session.commit()
+
+    return added, removed
+
+
+def _get_index_state(layout: BIDSLayout) -> dict:
+    return {
+        str(sub_layout._root): _get_subject_mtimes(sub_layout._root)
+        for sub_layout in [layout] + list(layout.derivatives.values())
+    }
+
+
+def _read_index_state(database_path: os.PathLike) -> dict:
+    state_file = Path(database_path) / INDEX_STATE_FILE_NAME
+    if not state_file.exists():
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def _write_index_state(database_path: os.PathLike, state: dict):
+    with open(Path(database_path) / INDEX_STATE_FILE_NAME, "w") as f:
+        json.dump(state, f, indent=4)
+
+
 def get_subjects(bids_dir: BIDSLayout, subjects):
     # If no subjects were provided, use all subjects in the fmriprep directory
     if subjects is None or len(subjects) == 0:
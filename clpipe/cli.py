@@ -149,6 +149,7 @@ def _add_commands():
     cli.add_command(templateflow_setup_cli, help_priority=17, hidden=True)
     cli.add_command(fmriprep_process_cli, help_priority=20)
     cli.add_command(postprocess_cli, help_priority=35)
+    cli.add_command(pipeline_cli, help_priority=37)
     cli.add_command(flywheel_sync_cli, help_priority=55)
     cli.add_command(config_cli, help_priority=95)
 
@@ -167,8 +168,10 @@ def _add_commands():
 
     roi_cli.add_command(get_available_atlases_cli, help_priority=1)
     roi_cli.add_command(fmri_roi_extraction_cli, help_priority=2)
+    roi_cli.add_command(consolidate_roi_timeseries_cli, help_priority=3)
 
     reports_cli.add_command(get_fmriprep_reports_cli)
+    reports_cli.add_command(get_postprocess_profile_cli)
 
     config_cli.add_command(get_config_cli)
     config_cli.add_command(update_config_cli)
@@ -433,6 +436,37 @@ def get_fmriprep_reports_cli(config_file, output_name, clear_temp, debug):
     get_reports(config_file, output_name, debug, clear_temp=clear_temp)
 
 
+@click.command("postprocess-profile", no_args_is_help=True)
+@click.option(
+    "-config_file", "-c", type=CLICK_FILE_TYPE_EXISTS, required=True, help=CONFIG_HELP
+)
+@click.option(
+    "-processing_stream",
+    "-p",
+    default=DEFAULT_PROCESSING_STREAM,
+    required=False,
+    help=PROCESSING_STREAM_HELP,
+)
+@click.option(
+    "-output_file", "-o", type=CLICK_FILE_TYPE, default=None, help=PROFILE_OUTPUT_FILE_HELP
+)
+@click.option("-debug", "-d", is_flag=True, help=DEBUG_HELP)
+def get_postprocess_profile_cli(config_file, processing_stream, output_file, debug):
+    """
+    Summarize postprocessing node profiles across images.
+
+    Images are profiled when the Profile postprocessing option is set.
+    """
+    from .get_reports import get_postprocess_profile_report
+
+    get_postprocess_profile_report(
+        config_file,
+        processing_stream=processing_stream,
+        output_file=output_file,
+        debug=debug,
+    )
+
+
 @click.command("fmri-process-check", no_args_is_help=True)
 @click.option(
     "-config_file",
@@ -490,13 +524,17 @@ def get_fmri_process_check_cli(config_file, output_file=None, debug=False):
 @click.option(
     "-refresh_index",
     "-r",
-    is_flag=True,
-    default=False,
+    is_flag=False,
+    flag_value="full",
+    default=None,
+    type=click.Choice(["full", "incremental"]),
     required=False,
     help=REFRESH_INDEX_HELP,
 )
 @click.option("-batch/-no-batch", is_flag=True, default=True, help=BATCH_HELP)
-@click.option("-cache/-no-cache", is_flag=True, default=True)
+@click.option("-n_jobs", type=click.IntRange(min=1), default=1, help=N_JOBS_HELP)
+@click.option("-memory_budget", default=None, required=False, help=MEMORY_BUDGET_HELP)
+@click.option("-cache/-no-cache", is_flag=True, default=True, help=CACHE_HELP)
 @click.option("-submit", "-s", is_flag=True, default=False, help=SUBMIT_HELP)
 @click.option("-debug", "-d", is_flag=True, default=False, help=DEBUG_HELP)
 def postprocess_cli(
@@ -512,6 +550,8 @@ def postprocess_cli(
     refresh_index,
     debug,
     cache,
+    n_jobs,
+    memory_budget,
 ):
     """Additional processing for GLM or connectivity analysis.
 
@@ -535,6 +575,49 @@ def postprocess_cli(
         refresh_index=refresh_index,
         debug=debug,
         cache=cache,
+        n_jobs=n_jobs,
+        memory_budget=memory_budget,
+    )
+
+
+@click.command(PIPELINE_COMMAND_NAME, no_args_is_help=True)
+@click.argument("subjects", nargs=-1, required=True)
+@click.option(
+    "-config_file", "-c", type=CLICK_FILE_TYPE_EXISTS, required=True, help=CONFIG_HELP
+)
+@click.option(
+    "-stage",
+    "stages",
+    multiple=True,
+    type=click.Choice(["convert2bids", "preprocess", "postprocess", "roi_extract"]),
+    help=PIPELINE_STAGES_HELP,
+)
+@click.option(
+    "-processing_stream",
+    "-p",
+    default=DEFAULT_PROCESSING_STREAM,
+    required=False,
+    help=PROCESSING_STREAM_HELP,
+)
+@click.option("-submit", "-s", is_flag=True, default=False, help=SUBMIT_HELP)
+@click.option("-debug", "-d", is_flag=True, default=False, help=DEBUG_HELP)
+def pipeline_cli(subjects, config_file, stages, processing_stream, submit, debug):
+    """Queue each subject's full pipeline as dependent batch jobs.
+
+    Each stage's jobs wait on the subject's jobs from the stage before:
+    convert2bids -> preprocess -> postprocess -> roi_extract.
+
+    > clpipe pipeline 123 124 -c config.json -stage preprocess -stage postprocess
+    """
+    from .pipeline import queue_pipeline
+
+    queue_pipeline(
+        subjects=subjects,
+        config_file=config_file,
+        stages=stages or None,
+        processing_stream=processing_stream,
+        submit=submit,
+        debug=debug,
     )
 
 
@@ -544,6 +627,9 @@ def postprocess_cli(
 @click.argument("subject_out_dir", type=CLICK_DIR_TYPE)
 @click.argument("subject_working_dir", type=CLICK_DIR_TYPE)
 @click.argument("subject_log_dir", type=CLICK_DIR_TYPE)
+@click.option(
+    "-manifest_file", type=CLICK_FILE_TYPE_EXISTS, default=None, help=MANIFEST_HELP
+)
 @click.option("-debug", is_flag=True, default=False, help=DEBUG_HELP)
 def postprocess_image_cli(
     run_config_file,
@@ -551,6 +637,7 @@ def postprocess_image_cli(
     subject_out_dir,
     subject_working_dir,
     subject_log_dir,
+    manifest_file,
     debug,
 ):
     """Used to distribute postprocessing jobs for individual images.
@@ -565,9 +652,28 @@ def postprocess_image_cli(
         subject_working_dir,
         subject_log_dir,
         debug=debug,
+        manifest_file=manifest_file,
     )
 
 
+@click.command()
+@click.argument("manifest_file", type=CLICK_FILE_TYPE_EXISTS)
+@click.argument("output_dir", type=CLICK_DIR_TYPE)
+@click.option(
+    "-n_workers", type=click.IntRange(min=1), default=1, help=BUNDLE_WORKERS_HELP
+)
+@click.option("-debug", is_flag=True, default=False, help=DEBUG_HELP)
+def run_job_bundle_cli(manifest_file, output_dir, n_workers, debug):
+    """Used to run a bundle of batch jobs within one allocation.
+    Not intended for direct use by user - this is submitted by clpipe's batch job
+    manager."""
+    from .job_manager import run_job_bundle
+
+    processes = run_job_bundle(manifest_file, output_dir, n_workers, debug=debug)
+    if any(process.returncode != 0 for process in processes):
+        sys.exit(1)
+
+
 @click.command(GLM_PREPARE_COMMAND_NAME, no_args_is_help=True)
 @click.argument("level")
 @click.argument("model")
@@ -876,6 +982,27 @@ def fsl_onset_extract_cli(config_file, glm_config_file, debug):
 @click.option(
     "-overwrite", is_flag=True, default=False, help="Overwrite existing ROI timeseries?"
 )
+@click.option(
+    "-job_grouping",
+    type=click.Choice(["atlas", "subject", "image"]),
+    default=None,
+    help=ROI_JOB_GROUPING_HELP,
+)
+@click.option(
+    "-image_file",
+    "image_files",
+    multiple=True,
+    help=ROI_IMAGE_FILE_HELP,
+)
+@click.option(
+    "-manifest_file",
+    type=CLICK_FILE_TYPE_EXISTS,
+    default=None,
+    help=ROI_MANIFEST_HELP,
+)
+@click.option(
+    "-index_dir", type=CLICK_DIR_TYPE, default=None, required=False, help=ROI_INDEX_HELP
+)
 @click.option(
     "-log_output_dir",
     type=click.Path(dir_okay=True, file_okay=False),
@@ -918,6 +1045,10 @@ def fmri_roi_extraction_cli(
     overlap_ok,
     debug,
     overwrite,
+    job_grouping,
+    image_files,
+    manifest_file,
+    index_dir,
 ):
     """Extract ROIs with a given atlas."""
     from .roi_extractor import fmri_roi_extraction
@@ -940,6 +1071,30 @@ def fmri_roi_extraction_cli(
         overlap_ok=overlap_ok,
         debug=debug,
         overwrite=overwrite,
+        job_grouping=job_grouping,
+        image_files=image_files,
+        manifest_file=manifest_file,
+        index_dir=index_dir,
+    )
+
+
+@click.command("consolidate", no_args_is_help=True)
+@click.argument("subjects", nargs=-1, required=False, default=None)
+@click.option(
+    "-config_file", "-c", type=CLICK_FILE_TYPE_EXISTS, required=True, help=CONFIG_HELP
+)
+@click.option("-atlas_name", help=CONSOLIDATE_ATLAS_HELP)
+@click.option("-debug", "-d", is_flag=True, help=DEBUG_HELP)
+def consolidate_roi_timeseries_cli(subjects, config_file, atlas_name, debug):
+    """Gather ROI timeseries into one store per atlas.
+
+    Given subjects replace their rows in each store. Without subjects, every
+    subject's timeseries are gathered.
+    """
+    from .roi_extractor import consolidate_roi_timeseries
+
+    consolidate_roi_timeseries(
+        subjects=subjects, config_file=config_file, atlas_name=atlas_name, debug=debug
     )
 
 
@@ -91,10 +91,61 @@ PROCESSING_STREAM_HELP = (
     "Specify a processing stream to use defined in your configuration file."
 )
 INDEX_HELP = "Give the path to an existing pybids index database."
+N_JOBS_HELP = "Without batch, the number of image jobs to run at once."
+MEMORY_BUDGET_HELP = (
+    "Without batch, the total memory running image jobs may use, such as 64G. "
+    "Each job is assumed to use the postprocessing batch memory usage."
+)
+MANIFEST_HELP = (
+    "The image's manifest of auxiliary files, written by postprocess. "
+    "Without it, the files are looked up in the BIDS index."
+)
+CACHE_HELP = (
+    "Skip images whose postprocessed output was made from the same input files "
+    "and processing options, as recorded in its provenance file."
+)
 REFRESH_INDEX_HELP = (
-    "Refresh the pybids index database to reflect new fmriprep artifacts."
+    "Refresh the pybids index database to reflect new fmriprep artifacts. "
+    "Given alone, the index is rebuilt in full. Use -refresh_index=incremental "
+    "to re-index only subjects whose folders have changed."
+)
+
+
+# Job bundle help
+BUNDLE_WORKERS_HELP = "The number of the bundle's jobs to run at once."
+
+
+# Pipeline help
+PIPELINE_COMMAND_NAME = "pipeline"
+PIPELINE_SUBJECTS_HELP = (
+    "The subjects to queue. Required, as later stages can't find subjects whose "
+    "data is not yet made."
 )
+PIPELINE_STAGES_HELP = (
+    "A stage to queue, one of convert2bids, preprocess, postprocess or "
+    "roi_extract. Give more than once for several stages. Default is all stages."
+)
+
 
+# ROI extraction help
+ROI_JOB_GROUPING_HELP = (
+    "Make a batch job per subject and atlas (atlas), per subject (subject) or per "
+    "image (image). Per subject or image, each image is loaded once for all "
+    "atlases. Defaults to the configured JobGrouping."
+)
+ROI_IMAGE_FILE_HELP = (
+    "Extract from only this image. Give more than once for several images. "
+    "Used internally."
+)
+ROI_MANIFEST_HELP = (
+    "The subject's images and masks, written when jobs are set up. "
+    "Used internally."
+)
+ROI_INDEX_HELP = (
+    "Give the path to an existing pybids index database, used to find masks. "
+    "Defaults to the index postprocessing built, if there is one."
+)
+CONSOLIDATE_ATLAS_HELP = "Only gather this atlas. Defaults to the configured atlases."
 
 # GLM Help
 L1_PREPARE_FSF_COMMAND_NAME = "l1_prepare_fsf"
@@ -114,6 +165,12 @@ LEVEL_HELP = "Level of your model, L1 or L2"
 MODEL_HELP = "Name of your model"
 TEST_ONE_HELP = "Only submit one job for testing purposes."
 
+# Reports Help
+PROFILE_OUTPUT_FILE_HELP = (
+    "Where to save the profile summary TSV. Defaults to the processing stream's "
+    "log folder."
+)
+
 # Other Help
 STATUS_COMMAND_NAME = "status"
 CACHE_FILE_HELP = "Path to your status cache file."
@@ -11,6 +11,9 @@ from ..utils import get_logger
 DEFAULT_CONFIG_FILE_NAME = "clpipe_config.json"
 DEFAULT_PROCESSING_STREAM = "default"
 DEFAULT_WORKING_DIRECTORY = "SET WORKING DIRECTORY"
+STEP_CACHE_DIR_NAME = "shared_step_cache"
+WEIGHTS_CACHE_DIR_NAME = "weights_cache"
+RESOURCE_HISTORY_FILE_NAME = "resource_history.tsv"
 LOGGER_NAME = "config"
 
 class ClpipeData:
@@ -252,6 +255,96 @@ class BatchManagerConfig(Option):
     )
     """Paths made available to the singularity container."""
 
+    array_command_active: bool = field(default=False, metadata={"required": False})
+    """A boolean indicating whether jobs are submitted together as job arrays,
+    with one scheduler call per array instead of one per job."""
+
+    array_command: str = field(
+        default="--array=1-{count}", metadata={"required": False}
+    )
+    """The command used to request an array of {count} tasks, numbered from 1."""
+
+    array_throttle_command: str = field(
+        default="%{throttle}", metadata={"required": False}
+    )
+    """Appended to the array command to limit how many tasks run at once."""
+
+    array_throttle: int = field(default=0, metadata={"required": False})
+    """The number of array tasks allowed to run at once. 0 for no limit."""
+
+    array_max_size: int = field(default=1000, metadata={"required": False})
+    """The most tasks per array. Larger job lists are split across arrays."""
+
+    array_task_id_variable: str = field(
+        default="SLURM_ARRAY_TASK_ID", metadata={"required": False}
+    )
+    """The environment variable holding an array task's number."""
+
+    array_output: str = field(
+        default="Output-array-%A_%a.out", metadata={"required": False}
+    )
+    """File name of the scheduler's output for each array task. Leave empty to
+    give the scheduler the output directory itself. Each job's own output is
+    written to a file named after the job."""
+
+    bundle_size: int = field(default=1, metadata={"required": False})
+    """The number of jobs to run in each allocation. Above 1, jobs are bundled,
+    running in the allocation through a pool of workers, each job with its own
+    output file and exit status."""
+
+    bundle_target_time: str = field(default="", metadata={"required": False})
+    """A target run time for each allocation, such as '2:0:0'. When set, the
+    bundle size is chosen to fit this many jobs of the requested job time."""
+
+    bundle_workers: int = field(default=0, metadata={"required": False})
+    """The number of jobs a bundle runs at once. The bundle's memory and threads
+    are this many times a single job's. 0 to run all of its jobs at once."""
+
+    dependency_command: str = field(
+        default="--dependency=afterany:{job_ids}", metadata={"required": False}
+    )
+    """The command used to hold a job until the jobs with the given IDs end."""
+
+    dependency_separator: str = field(default=":", metadata={"required": False})
+    """Separates the job IDs given to the dependency command."""
+
+    job_id_pattern: str = field(
+        default=r"Submitted batch job (\d+)", metadata={"required": False}
+    )
+    """A regular expression finding a new job's ID in the submission output, as
+    its first group."""
+
+    submit_concurrency: int = field(default=1, metadata={"required": False})
+    """The number of submission commands to run at once."""
+
+    submit_rate: float = field(default=0, metadata={"required": False})
+    """The most submissions to make per second, on average. 0 for no limit."""
+
+    submit_burst: int = field(default=1, metadata={"required": False})
+    """The number of submissions that may be made at once before the rate limit
+    applies."""
+
+    submit_retries: int = field(default=3, metadata={"required": False})
+    """How many times to retry a submission failing with a transient error."""
+
+    submit_retry_delay: float = field(default=2, metadata={"required": False})
+    """Seconds to wait before the first retry, doubling for each further retry."""
+
+    transient_error_pattern: str = field(
+        default=(
+            r"(?i)timed out|temporarily unavailable|try again|unable to contact"
+            r"|connection refused|too many"
+        ),
+        metadata={"required": False},
+    )
+    """A regular expression matching submission errors worth retrying."""
+
+    submission_ledger: str = field(
+        default="submission_ledger.tsv", metadata={"required": False}
+    )
+    """File, in the batch output directory, recording each submission's job
+    name, scheduler ID and return code. Blank to not record submissions."""
+
     @classmethod
     def from_default(cls, config_type="unc"):
         defaults = {
@@ -289,6 +382,13 @@ class BatchManagerConfig(Option):
                 "time_command_active": False,
                 "thread_command_active": False,
                 "singularity_bind_paths": "/mnt",
+                "array_command": "-t 1-{count}",
+                "array_throttle_command": " -tc {throttle}",
+                "array_task_id_variable": "SGE_TASK_ID",
+                "array_output": "",
+                "dependency_command": "-hold_jid {job_ids}",
+                "dependency_separator": ",",
+                "job_id_pattern": r"Your job(?:-array)? (\d+)",
             },
             "uva": {
                 "sub_options_equal": field(
@@ -600,7 +700,8 @@ class ConfoundRegression(Option):
     they will be applied first."""
 
     implementation: str = field(default="afni_3dTproject", metadata={"required": True})
-    """Currently limited to "afni_3dTproject"""
+    """Available implementations: "afni_3dTproject", "fsl_glm", "numpy_ols".
+    "numpy_ols" matches "fsl_glm" and can run in memory with fused execution."""
 
 
 @dataclass
@@ -699,6 +800,19 @@ class BatchOptions(Option):
     n_threads: str = field(default="1", metadata={"required": True})
     """How many threads to allocate per job."""
 
+    workflow_plugin: str = field(default="MultiProc", metadata={"required": False})
+    """The nipype plugin running each image's workflow: MultiProc, to run
+    independent nodes at once within the job's threads and memory, or Linear, to
+    run nodes one at a time."""
+
+    auto_resources: bool = field(default=False, metadata={"required": False})
+    """Set 'true' to size each image job's memory and time from its image's
+    dimensions and processing steps, learning from the resources of past jobs.
+    Memory is requested in the unit of memory_usage."""
+
+    resource_margin: float = field(default=1.2, metadata={"required": False})
+    """How much to scale estimated job resources by, to leave room for error."""
+
 
 @dataclass
 class PostProcessingOptions(Option):
@@ -763,9 +877,51 @@ class PostProcessingOptions(Option):
     )
     """Options for cluster resource usage."""
 
+    fused_execution: bool = field(default=False, metadata={"required": False})
+    """Set 'true' to run consecutive NumPy-based steps (Butterworth temporal filtering,
+    TrimTimepoints, ScrubTimepoints and ApplyMask) on a single in-memory image,
+    writing one intermediate file instead of one per step. FSL and AFNI based steps
+    still exchange files."""
+
+    intermediate_format: str = field(default="", metadata={"required": False})
+    """File format of the intermediate images written to the working directory:
+    'nii' (uncompressed), 'nii.gz' (gzip) or 'nii.zst' (zstd, requires the pyzstd
+    package). Steps run by FSL or AFNI cannot read zstd images, so they write and
+    receive 'nii' instead. Leave empty to keep each step's default format. The
+    exported image is always written as .nii.gz."""
+
+    intermediate_compression_level: int = field(
+        default=1, metadata={"required": False}
+    )
+    """Compression level for 'nii.gz' (1-9) or 'nii.zst' (1-22) intermediates
+    written by NumPy-based steps. FSL and AFNI use their own gzip level."""
+
+    chunk_memory_limit: str = field(default="", metadata={"required": False})
+    """Set a limit, such as '2G', on the image data held in memory by Butterworth
+    temporal filtering and ScrubTimepoints. They then process the image in float32
+    blocks, memory-mapping uncompressed inputs, instead of loading it whole as
+    float64. Leave empty to load whole images. Not used by fused steps."""
+
+    step_cache: bool = field(default=False, metadata={"required": False})
+    """Set 'true' to keep each step's output image in a cache shared by all
+    processing streams of this working directory. Outputs are stored by the
+    hash of the image's inputs and the steps run so far, so a stream starting
+    with the same steps as another, like TrimTimepoints then SpatialSmoothing,
+    reuses their output instead of recomputing it."""
+
+    profile: bool = field(default=False, metadata={"required": False})
+    """Set 'true' to record each processing node's wall time, CPU time, peak memory
+    and bytes read and written, saved per image in the subject's log folder.
+    Summarize them with 'clpipe reports postprocess-profile'."""
+
     log_directory: str = field(default="", metadata={"required": True})
     """Log output location. Not normally changed from default."""
 
+    @validates("intermediate_format")
+    def validate_intermediate_format(self, value):
+        if value not in ("", "nii", "nii.gz", "nii.zst"):
+            raise ValidationError("Must be one of 'nii', 'nii.gz' or 'nii.zst'")
+
     def populate_project_paths(self, project_directory: os.PathLike):
         self.target_directory = os.path.join(project_directory, "data_fmriprep")
         self.output_directory = os.path.join(project_directory, "data_postprocess")
@@ -775,6 +931,15 @@ class PostProcessingOptions(Option):
         """Get the working directory relative to the processing stream."""
         return os.path.join(self.working_directory, processing_stream)
 
+    def get_step_cache_dir(self):
+        """Get the step output cache directory, shared across processing streams."""
+        return os.path.join(self.working_directory, STEP_CACHE_DIR_NAME)
+
+    def get_resource_history_path(self):
+        """Get the record of resources used by image jobs, shared across processing
+        streams."""
+        return os.path.join(self.working_directory, RESOURCE_HISTORY_FILE_NAME)
+
     def get_stream_output_dir(self, processing_stream: str):
         """Get the output directory relative to the processing stream."""
         return os.path.join(self.output_directory, processing_stream)
@@ -890,11 +1055,36 @@ class ROIExtractOptions(Option):
     overlap_ok: bool = field(default=False, metadata={"required": True})
     """Are overlapping ROIs allowed?"""
 
+    job_grouping: str = field(default="atlas", metadata={"required": False})
+    """How to split extraction into batch jobs: 'atlas' for a job per subject and
+    atlas, 'subject' for a job per subject or 'image' for a job per image. Jobs per
+    subject or image load each image once and extract every atlas from it."""
+
+    weights_cache_directory: str = field(default="", metadata={"required": False})
+    """Where to cache each atlas's voxel weights, which are reused by images sharing
+    a grid and brain mask. Defaults to a 'weights_cache' folder in the output
+    directory."""
+
+    output_format: str = field(default="csv", metadata={"required": False})
+    """Format of each image's ROI timeseries: 'csv', 'parquet', 'feather' or 'npz'.
+    Parquet, Feather and NPZ files also hold the ROI labels and the image's BIDS
+    entities. Parquet and Feather need pyarrow."""
+
+    consolidate: bool = field(default=False, metadata={"required": False})
+    """Set 'true' to also gather each atlas's timeseries into one store in its
+    output folder, with a row per image timepoint, after extraction finishes.
+    Re-extracted subjects replace their earlier rows."""
+
     memory_usage: str = field(default="20G", metadata={"required": True})
     time_usage: str = field(default="2:0:0", metadata={"required": True})
     n_threads: str = field(default="1", metadata={"required": True})
     log_directory: str = field(default="", metadata={"required": True})
 
+    @validates("output_format")
+    def validate_output_format(self, value):
+        if value not in ("csv", "parquet", "feather", "npz"):
+            raise ValidationError("Must be one of 'csv', 'parquet', 'feather' or 'npz'")
+
     def populate_project_paths(self, project_directory: os.PathLike):
         self.target_directory = os.path.join(project_directory, "data_postproc")
         self.output_directory = os.path.join(project_directory, "data_ROI_ts")
@@ -902,6 +1092,13 @@ class ROIExtractOptions(Option):
             project_directory, "logs", "ROI_extraction_logs"
         )
 
+    def get_weights_cache_dir(self):
+        """Get the atlas weights cache directory, defaulting to the output
+        directory's cache folder."""
+        if self.weights_cache_directory:
+            return self.weights_cache_directory
+        return os.path.join(self.output_directory, WEIGHTS_CACHE_DIR_NAME)
+
 
 @dataclass
 class ProjectOptions(Option):
@@ -1171,6 +1368,15 @@ KEY_MAP = {
     "scrub_contiguous": "ScrubContiguous",
     "batch_options": "BatchOptions",
     "memory_usage": "MemoryUsage",
+    "workflow_plugin": "WorkflowPlugin",
+    "auto_resources": "AutoResources",
+    "resource_margin": "ResourceMargin",
+    "fused_execution": "FusedExecution",
+    "intermediate_format": "IntermediateFormat",
+    "intermediate_compression_level": "IntermediateCompressionLevel",
+    "chunk_memory_limit": "ChunkMemoryLimit",
+    "step_cache": "StepCache",
+    "profile": "Profile",
     "target_suffix": "TargetSuffix",
     "output_suffix": "OutputSuffix",
     "confound_suffix": "ConfoundSuffix",
@@ -1189,6 +1395,10 @@ KEY_MAP = {
     "require_mask": "RequireMask",
     "prop_voxels": "PropVoxels",
     "overlap_ok": "OverlapOk",
+    "job_grouping": "JobGrouping",
+    "weights_cache_directory": "WeightsCacheDirectory",
+    "output_format": "OutputFormat",
+    "consolidate": "Consolidate",
     "reho_extraction": "ReHoExtraction",
     "exclusion_file": "ExclusionFile",
     "mask_directory": "MaskDirectory",
@@ -1228,5 +1438,25 @@ BATCH_KEY_MAP = {
     "ThreadCommandActive": "thread_command_active",
     "JobIDCommandActive": "job_id_command_active",
     "OutputCommandActive": "output_command_active",
-    "SingularityBindPaths": "singularity_bind_paths"
+    "SingularityBindPaths": "singularity_bind_paths",
+    "ArrayCommandActive": "array_command_active",
+    "ArrayCommand": "array_command",
+    "ArrayThrottleCommand": "array_throttle_command",
+    "ArrayThrottle": "array_throttle",
+    "ArrayMaxSize": "array_max_size",
+    "ArrayTaskIDVariable": "array_task_id_variable",
+    "ArrayOutput": "array_output",
+    "BundleSize": "bundle_size",
+    "BundleTargetTime": "bundle_target_time",
+    "BundleWorkers": "bundle_workers",
+    "DependencyCommand": "dependency_command",
+    "DependencySeparator": "dependency_separator",
+    "JobIDPattern": "job_id_pattern",
+    "SubmitConcurrency": "submit_concurrency",
+    "SubmitRate": "submit_rate",
+    "SubmitBurst": "submit_burst",
+    "SubmitRetries": "submit_retries",
+    "SubmitRetryDelay": "submit_retry_delay",
+    "TransientErrorPattern": "transient_error_pattern",
+    "SubmissionLedger": "submission_ledger",
 }
\ No newline at end of file
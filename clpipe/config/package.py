@@ -29,7 +29,7 @@ INSTALL_REQUIRES = [
       'nilearn==0.9.0',
       'dcm2bids==2.1.9',
       'nipype==1.8.6',
-      'pybids>=0.15.6',
+      'pybids>=0.15.6,<0.16',
       'templateflow==23.0.0',
       "pydantic==1.10.7",
       "matplotlib==3.5.3",
@@ -54,6 +54,7 @@ ENTRY_POINTS = """
       fmri_postprocess=clpipe.cli:fmri_postprocess_cli
       fmri_postprocess2=clpipe.cli:fmri_postprocess2_cli
       postprocess_image=clpipe.cli:postprocess_image_cli
+      run_job_bundle=clpipe.cli:run_job_bundle_cli
       glm_l1_preparefsf=clpipe.cli:glm_l1_preparefsf_cli
       glm_l1_launch=clpipe.cli:glm_l1_launch_cli
       glm_l2_preparefsf=clpipe.cli:glm_l2_preparefsf_cli
@@ -45,7 +45,12 @@ def convert2bids(
     submit=False,
     debug=False,
     batch=False,
+    job_manager: JobManager = None,
 ):
+    """Convert DICOM files to BIDS format with dcm2bids or heudiconv.
+
+    If job_manager is given, the jobs are added to it for the caller to submit.
+    """
     config: ProjectOptions = ProjectOptions.load(config_file)
     config.convert2bids.load_cli_args(
         dicom_directory=dicom_dir,
@@ -59,14 +64,9 @@ def convert2bids(
 
     logger = get_logger(STEP_NAME, debug=debug, log_dir=config.get_logs_dir())
 
-    batch_manager = JobManagerFactory.get(
-        batch_config=config.batch_config_path,
-        output_directory=config.convert2bids.log_directory,
-        debug=debug,
-        mem_use=config.convert2bids.mem_usage,
-        time=config.convert2bids.time_usage,
-        threads=config.convert2bids.core_usage,
-    )
+    batch_manager = job_manager
+    if batch_manager is None:
+        batch_manager = get_batch_manager(config, debug=debug)
 
     logger.info(
         f"Starting BIDS conversion targeting: {config.convert2bids.dicom_directory}"
@@ -104,6 +104,7 @@ def convert2bids(
             status_cache=status_cache,
             logger=logger,
             batch_manager=batch_manager,
+            queue_only=job_manager is not None,
         )
 
     elif not dcm2bids:
@@ -123,6 +124,7 @@ def convert2bids(
             clear_cache=clear_cache,
             clear_outputs=clear_outputs,
             longitudinal=longitudinal,
+            queue_only=job_manager is not None,
         )
 
     else:
@@ -142,7 +144,10 @@ def dcm2bids_wrapper(
     overwrite: bool = None,
     status_cache: os.PathLike = None,
     submit: bool = None,
+    queue_only: bool = False,
 ):
+    """Create a dcm2bids job for each subject/session. With queue_only, the jobs are
+    left in batch_manager for the caller to submit."""
     sub_sess_list, folders = _get_sub_session_list(
         dicom_dir, dicom_dir_format, logger, subjects=subjects, session=session
     )
@@ -200,6 +205,9 @@ def dcm2bids_wrapper(
         if subject in subjects_need_processing:
             batch_manager.add_job(job_id, submission_string)
 
+    if queue_only:
+        return
+
     # batch_manager.compile_job_strings()
     if submit:
         if len(subjects_need_processing) > 0:
@@ -229,11 +237,13 @@ def heudiconv_wrapper(
     clear_cache: bool = False,
     clear_outputs: bool = False,
     submit: bool = False,
+    queue_only: bool = False,
 ):
     """
     This command uses heudiconv to convert dicoms into BIDS formatted NiFTI files.
     Users can specify any number of subjects, or leave subjects blank to convert all
-    subjects.
+    subjects. With queue_only, the jobs are left in batch_manager for the caller to
+    submit.
     """
 
     session_toggle = "{session}" in dicom_dir_format
@@ -301,6 +311,9 @@ def heudiconv_wrapper(
 
         batch_manager.add_job(job_id, job_str)
 
+    if queue_only:
+        return
+
     # batch_manager.compilejobstrings()
     if submit:
         batch_manager.submit_jobs()
@@ -308,6 +321,18 @@ def heudiconv_wrapper(
         batch_manager.print_jobs()
 
 
+def get_batch_manager(config: ProjectOptions, debug=False) -> JobManager:
+    """Get a job manager requesting the resources of conversion jobs."""
+    return JobManagerFactory.get(
+        batch_config=config.batch_config_path,
+        output_directory=config.convert2bids.log_directory,
+        debug=debug,
+        mem_use=config.convert2bids.mem_usage,
+        time=config.convert2bids.time_usage,
+        threads=config.convert2bids.core_usage,
+    )
+
+
 def _get_sub_session_list(
     dicom_dir, dicom_dir_format, logger, subjects=None, session=None
 ):
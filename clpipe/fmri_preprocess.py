@@ -2,7 +2,7 @@ import os
 import sys
 from pathlib import Path
 
-from .job_manager import JobManagerFactory, Job
+from .job_manager import JobManagerFactory, JobManager, Job
 from .config.options import ProjectOptions
 from .utils import get_logger
 from .status import needs_processing, write_record
@@ -39,11 +39,14 @@ def fmriprep_process(
     status_cache=None,
     submit=False,
     debug=False,
+    job_manager: JobManager = None,
 ):
     """
     This command runs a BIDS formatted dataset through fMRIprep.
     Specify subject IDs to run specific subjects. If left blank,
     runs all subjects.
+
+    If job_manager is given, the jobs are added to it for the caller to submit.
     """
     # os.makedirs(config.fmriprep.working_directory, exist_ok=True)
     config: ProjectOptions = ProjectOptions.load(config_file)
@@ -146,15 +149,9 @@ def fmriprep_process(
 
     logger.info(f"Targeting subject(s): {', '.join(sublist)}")
 
-    batch_manager = JobManagerFactory.get(
-        batch_config=config.batch_config_path,
-        output_directory=config.fmriprep.log_directory,
-        debug=debug,
-        mem_use=config.fmriprep.fmriprep_memory_usage,
-        time=config.fmriprep.fmriprep_time_usage,
-        threads=config.fmriprep.n_threads,
-        email=config.email_address
-    )
+    batch_manager = job_manager
+    if batch_manager is None:
+        batch_manager = get_batch_manager(config, debug=debug)
 
     thread_command_active = batch_manager.config.thread_command_active
     batch_commands = batch_manager.config.fmri_prep_batch_commands
@@ -192,6 +189,9 @@ def fmriprep_process(
 
         batch_manager.add_job("sub-" + sub + "_fmriprep", submission_string)
 
+    if job_manager:
+        return
+
     if submit:
         batch_manager.submit_jobs()
         if status_cache:
@@ -202,6 +202,19 @@ def fmriprep_process(
     sys.exit(0)
 
 
+def get_batch_manager(config: ProjectOptions, debug=False) -> JobManager:
+    """Get a job manager requesting the resources of fMRIPrep jobs."""
+    return JobManagerFactory.get(
+        batch_config=config.batch_config_path,
+        output_directory=config.fmriprep.log_directory,
+        debug=debug,
+        mem_use=config.fmriprep.fmriprep_memory_usage,
+        time=config.fmriprep.fmriprep_time_usage,
+        threads=config.fmriprep.n_threads,
+        email=config.email_address
+    )
+
+
 def setup_dirs(config: ProjectOptions):
     os.makedirs(config.fmriprep.output_directory, exist_ok=True)
     os.makedirs(config.fmriprep.log_directory, exist_ok=True)
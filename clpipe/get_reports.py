@@ -4,9 +4,13 @@ import glob
 import shutil
 from distutils.dir_util import copy_tree, remove_tree
 from tqdm import tqdm
+from .config.options import ProjectOptions, DEFAULT_PROCESSING_STREAM
 from .utils import add_file_handler, get_logger, resolve_fmriprep_dir
 
 STEP_NAME = "reports_fmriprep"
+PROFILE_STEP_NAME = "reports_postprocess_profile"
+PROFILE_SUMMARY_FILE_NAME = "postprocess_profile_summary.tsv"
+MAX_PROFILE_DISPLAY = 10
 
 
 def get_reports(config_file, output_name, debug, clear_temp=True):
@@ -90,3 +94,38 @@ def get_reports(config_file, output_name, debug, clear_temp=True):
         )
 
     logger.info(f"Job finished. ZIP file created at: {output_name}")
+
+
+def get_postprocess_profile_report(
+    config_file,
+    processing_stream=DEFAULT_PROCESSING_STREAM,
+    output_file=None,
+    debug=False,
+):
+    """Summarize the node profiles of a processing stream's postprocessed images,
+    saving the summary as a TSV."""
+    from .postprocutils.profiling import load_profiles, summarize_profiles
+
+    options = ProjectOptions.load(config_file)
+    logger = get_logger(PROFILE_STEP_NAME, debug=debug, log_dir=options.get_logs_dir())
+
+    log_dir = options.postprocessing.get_stream_log_dir(processing_stream)
+    profiles = load_profiles(log_dir)
+    if profiles.empty:
+        logger.warning(
+            f"No postprocessing profiles found in: {log_dir}. "
+            "Set Profile in your postprocessing options to record them."
+        )
+        return None
+
+    summary = summarize_profiles(profiles)
+    if output_file is None:
+        output_file = os.path.join(log_dir, PROFILE_SUMMARY_FILE_NAME)
+    summary.to_csv(output_file, sep="\t", index=False)
+
+    logger.info(
+        f"Summarized {profiles['image'].nunique()} image profile(s), slowest nodes "
+        f"first:\n{summary.head(MAX_PROFILE_DISPLAY).to_string(index=False)}"
+    )
+    logger.info(f"Profile summary saved to: {output_file}")
+    return summary
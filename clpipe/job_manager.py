@@ -1,10 +1,17 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+from math import ceil
 from pkg_resources import resource_stream
 import os
+import re
+import shlex
 import subprocess
 import sys
+import threading
+import time
 
-from .utils import get_logger
+from .utils import get_logger, parse_memory, parse_time, format_time
 from clpipe.config.options import BatchManagerConfig
 
 # TODO: We need to update the batch manager to be more flexible,
@@ -13,8 +20,22 @@ from clpipe.config.options import BatchManagerConfig
 
 LOGGER_NAME = "batch-manager"
 OUTPUT_FORMAT_STR = "Output-{jobid}-jobid-%j.out"
+LOCAL_OUTPUT_FORMAT_STR = "Output-{jobid}.out"
 JOB_ID_FORMAT_STR = "{jobid}"
 MAX_JOB_DISPLAY = 5
+ARRAY_DIR_NAME = "job_arrays"
+ARRAY_NAME_FORMAT_STR = "array-{timestamp}-{index}"
+ARRAY_SCRIPT_TEMPLATE = """#!/bin/bash
+# Runs line ${task_id_variable} of the manifest: a job name and command, tab separated
+IFS=$'\\t' read -r job_name job_command < <(sed -n "${{{task_id_variable}}}p" {manifest})
+exec > "{output_dir}/Output-${{job_name}}.out" 2>&1
+eval "$job_command"
+"""
+BUNDLE_DIR_NAME = "job_bundles"
+BUNDLE_NAME_FORMAT_STR = "bundle-{timestamp}-{index}"
+BUNDLE_COMMAND_FORMAT_STR = "run_job_bundle {manifest} {output_dir} -n_workers {workers}"
+BUNDLE_STATUS_SUFFIX = "_status.tsv"
+LEDGER_COLUMNS = ["submitted", "job_name", "scheduler_id", "return_code", "attempts"]
 
 
 class JobManager:
@@ -81,8 +102,46 @@ class BatchJobManager(JobManager):
         self.config.email = email if email else self.config.email_address_default
 
         self.header = self.create_submission_head()
+        self._rate_limiter = _TokenBucket(
+            self.config.submit_rate, self.config.submit_burst
+        )
+        self._ledger_lock = threading.Lock()
+        # Numbers arrays and bundles, keeping their names unique across levels
+        self._allocation_index = itertools.count()
 
     def create_submission_head(self):
+        head = self._create_head_options(
+            JOB_ID_FORMAT_STR, os.path.join(self.output_dir, OUTPUT_FORMAT_STR)
+        )
+        head.append(self.config.command_wrapper)
+
+        return " ".join(head)
+
+    def create_array_submission(
+        self, array_name, task_count, script_path, resources=None
+    ):
+        """Build the command submitting a script as an array of task_count tasks."""
+        output = self.output_dir
+        if self.config.array_output:
+            output = os.path.join(self.output_dir, self.config.array_output)
+        head = self._create_head_options(array_name, output, resources)
+
+        array_option = self.config.array_command.format(count=task_count)
+        if self.config.array_throttle:
+            array_option += self.config.array_throttle_command.format(
+                throttle=self.config.array_throttle
+            )
+        head.append(array_option)
+        head.append(script_path)
+
+        return " ".join(head)
+
+    def _create_head_options(self, job_id, output, resources=None):
+        """Build the submission options, with the memory, time and threads from
+        resources, if given, or from the config."""
+        if resources is None:
+            resources = self.get_job_resources()
+
         head = [self.config.submission_head]
         for e in self.config.submission_options:
             temp = e["command"] + " " + e["args"]
@@ -91,24 +150,20 @@ class BatchJobManager(JobManager):
             temp = e["command"] + "=" + e["args"]
             head.append(temp)
 
-        head.append(self.config.memory_command.format(mem=self.config.mem_use))
+        head.append(self.config.memory_command.format(mem=resources["mem_use"]))
         if self.config.time_command_active:
-            head.append(self.config.time_command.format(time=self.config.time))
+            head.append(self.config.time_command.format(time=resources["time"]))
         if self.config.thread_command_active:
             head.append(
                 self.config.n_threads_command.format(
-                    nthreads=self.config.threads
+                    nthreads=resources["threads"]
                 )
             )
         if self.config.job_id_command_active:
-            head.append(self.config.job_id_command.format(jobid=JOB_ID_FORMAT_STR))
+            head.append(self.config.job_id_command.format(jobid=job_id))
         if self.config.output_command_active:
             head.append(
-                self.config.output_command.format(
-                    output=os.path.abspath(
-                        os.path.join(self.output_dir, OUTPUT_FORMAT_STR)
-                    )
-                )
+                self.config.output_command.format(output=os.path.abspath(output))
             )
         if self.config.email:
             head.append(
@@ -116,13 +171,151 @@ class BatchJobManager(JobManager):
                     email=self.config.email
                 )
             )
-        head.append(self.config.command_wrapper)
 
-        return " ".join(head)
+        return head
+
+    def get_job_resources(self):
+        return {
+            "mem_use": self.config.mem_use,
+            "time": self.config.time,
+            "threads": self.config.threads,
+        }
+
+    def get_bundle_size(self):
+        """The number of jobs to run per allocation, fitting the bundle target time
+        if one is set."""
+        if self.config.bundle_target_time and self.config.time:
+            return max(
+                1,
+                parse_time(self.config.bundle_target_time)
+                // parse_time(self.config.time),
+            )
+        return max(1, self.config.bundle_size)
+
+    def get_max_resources(self, jobs):
+        """The largest memory and time requested by any of the jobs, for a bundle or
+        array running them all."""
+        resources = self.get_job_resources()
+        job_resources = [job.resources for job in jobs if job.resources]
+        if not job_resources:
+            return resources
+
+        resources["mem_use"] = max(
+            (job["mem_use"] for job in job_resources), key=parse_memory
+        )
+        if resources["time"]:
+            resources["time"] = max(
+                (job["time"] for job in job_resources), key=parse_time
+            )
+        return resources
+
+    def get_bundle_resources(self, bundle_size, workers, job_resources=None):
+        """Scale a single job's resources, job_resources if given, to a bundle
+        running bundle_size jobs, workers at a time."""
+        resources = dict(job_resources or self.get_job_resources())
+        resources["mem_use"] = _scale_quantity(resources["mem_use"], workers)
+        if resources["threads"]:
+            resources["threads"] = _scale_quantity(resources["threads"], workers)
+        if resources["time"]:
+            resources["time"] = format_time(
+                parse_time(resources["time"]) * ceil(bundle_size / workers)
+            )
+        return resources
+
+    def bundle_jobs(self, jobs, bundle_size):
+        """Group jobs into bundles, each run in one allocation by run_job_bundle.
+
+        Returns the bundles as jobs, and the resources each bundle needs.
+        """
+        workers = self.config.bundle_workers or bundle_size
+        workers = min(workers, bundle_size)
+        resources = self.get_bundle_resources(
+            bundle_size, workers, self.get_max_resources(jobs)
+        )
+        header = " ".join(
+            self._create_head_options(
+                JOB_ID_FORMAT_STR,
+                os.path.join(self.output_dir, OUTPUT_FORMAT_STR),
+                resources,
+            )
+            + [self.config.command_wrapper]
+        )
+
+        bundle_dir = os.path.join(self.output_dir, BUNDLE_DIR_NAME)
+        os.makedirs(bundle_dir, exist_ok=True)
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+
+        bundles = []
+        for start in range(0, len(jobs), bundle_size):
+            bundle_name = BUNDLE_NAME_FORMAT_STR.format(
+                timestamp=timestamp, index=next(self._allocation_index)
+            )
+            manifest_path = os.path.join(bundle_dir, f"{bundle_name}.tsv")
+            write_job_manifest(manifest_path, jobs[start : start + bundle_size])
+
+            command = BUNDLE_COMMAND_FORMAT_STR.format(
+                manifest=manifest_path, output_dir=self.output_dir, workers=workers
+            )
+            bundles.append(
+                Job(
+                    bundle_name,
+                    header.format(jobid=bundle_name, cmdwrap=command),
+                    command,
+                    dependencies=_combine_dependencies(
+                        jobs[start : start + bundle_size]
+                    ),
+                )
+            )
 
-    def add_job(self, job_name, job_string):
-        job_string = self.header.format(jobid=job_name, cmdwrap=job_string)
-        self.job_queue.append(Job(job_name, job_string))
+        return bundles, resources
+
+    def add_job(self, job_name, job_string, dependencies=None, resources=None):
+        """Queue a job. It will not start until the jobs in dependencies, submitted
+        before it, have finished.
+
+        The job requests the memory and time in resources, if given, instead of
+        the manager's.
+        """
+        command = job_string
+        header = self.header
+        if resources:
+            resources = {**self.get_job_resources(), **resources}
+            header = " ".join(
+                self._create_head_options(
+                    JOB_ID_FORMAT_STR,
+                    os.path.join(self.output_dir, OUTPUT_FORMAT_STR),
+                    resources,
+                )
+                + [self.config.command_wrapper]
+            )
+        job_string = header.format(jobid=job_name, cmdwrap=job_string)
+        job = Job(
+            job_name, job_string, command, dependencies=dependencies, resources=resources
+        )
+        self.job_queue.append(job)
+        return job
+
+    def write_array_files(self, array_name, jobs):
+        """Write the manifest of an array's jobs, one per task, and the script each
+        task runs to look up its job. Returns the script's path."""
+        array_dir = os.path.join(self.output_dir, ARRAY_DIR_NAME)
+        os.makedirs(array_dir, exist_ok=True)
+
+        manifest_path = os.path.join(array_dir, f"{array_name}.tsv")
+        write_job_manifest(manifest_path, jobs)
+
+        script_path = os.path.join(array_dir, f"{array_name}.sh")
+        with open(script_path, "w") as script:
+            script.write(
+                ARRAY_SCRIPT_TEMPLATE.format(
+                    task_id_variable=self.config.array_task_id_variable,
+                    manifest=shlex.quote(manifest_path),
+                    output_dir=self.output_dir,
+                )
+            )
+        os.chmod(script_path, 0o755)
+
+        return script_path
 
     def submit_jobs(self):
         self.logger.info(f"Submitting {len(self.job_queue)} job(s) in batch.")
@@ -130,29 +323,396 @@ class BatchJobManager(JobManager):
         self.logger.debug(f"Time usage: {self.config.time}")
         self.logger.debug(f"Number of threads: {self.config.threads}")
         self.logger.debug(f"Email: {self.config.email}")
-        for job in self.job_queue:
-            # os.system(job.job_string)
-            subprocess.run(job.job_string, shell=True)
+
+        # Jobs depending on queued jobs are kept out of the arrays and bundles of
+        # their parents, and are submitted after them, held on their scheduler IDs
+        for level in _group_by_dependency_level(self.job_queue):
+            self._submit_level(level)
+
+        submitted = list(self.job_queue)
         self.job_queue.clear()
+        return submitted
+
+    def _submit_level(self, level):
+        """Submit jobs not depending on each other, bundled or as arrays when
+        configured."""
+        jobs = level
+        resources = None
+        bundle_size = self.get_bundle_size()
+        if bundle_size > 1 and len(jobs) > 1:
+            jobs, resources = self.bundle_jobs(jobs, bundle_size)
+            self.logger.info(
+                f"Bundled jobs into {len(jobs)} allocation(s) of up to "
+                f"{bundle_size} job(s)."
+            )
+
+        if self.config.array_command_active and len(jobs) > 1:
+            self._submit_arrays(jobs, resources)
+        else:
+            self._submit_concurrently(jobs)
+
+        # Bundled jobs share the scheduler ID of their bundle
+        if jobs is not level:
+            for index, job in enumerate(level):
+                job.scheduler_id = jobs[index // bundle_size].scheduler_id
+
+    def _submit_concurrently(self, jobs):
+        """Submit jobs, running up to submit_concurrency submissions at once.
+
+        Jobs depending on other jobs in the list are submitted after them, so the
+        scheduler IDs they are held on are known.
+        """
+        pending = list(jobs)
+        workers = max(1, self.config.submit_concurrency)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending:
+                ready = [
+                    job
+                    for job in pending
+                    if not any(parent in pending for parent in job.dependencies)
+                ]
+                # Dependency cycles can't be ordered, so submit what remains
+                if not ready:
+                    ready = pending
+
+                scheduler_ids = executor.map(
+                    lambda job: self._submit(
+                        job.job_string, job.dependencies, job_name=job.job_name
+                    ),
+                    ready,
+                )
+                for job, scheduler_id in zip(ready, scheduler_ids):
+                    job.scheduler_id = scheduler_id
+                pending = [job for job in pending if job not in ready]
+
+    def _submit(self, submission, dependencies=None, job_name=None):
+        """Run a submission command, after adding the dependency option for any jobs
+        it depends on. Returns the scheduler's ID for the new job, if found in the
+        scheduler's output.
+
+        Submissions failing with an error matching transient_error_pattern are
+        retried, with exponential backoff. Each submission is recorded in the
+        submission ledger.
+        """
+        if dependencies:
+            parent_ids = list(
+                dict.fromkeys(str(parent.scheduler_id) for parent in dependencies)
+            )
+            if any(parent.scheduler_id is None for parent in dependencies):
+                self.logger.error(
+                    "Not submitting job, as a job it depends on has no scheduler "
+                    f"ID: {submission}"
+                )
+                self._record_submission(job_name, None, None, 0)
+                return None
+            dependency_option = self.config.dependency_command.format(
+                job_ids=self.config.dependency_separator.join(parent_ids)
+            )
+            head = self.config.submission_head
+            submission = f"{head} {dependency_option}{submission[len(head):]}"
+
+        retries = max(0, self.config.submit_retries)
+        for attempt in range(retries + 1):
+            self._rate_limiter.acquire()
+            process = subprocess.run(
+                submission, shell=True, capture_output=True, text=True
+            )
+            if (
+                process.returncode == 0
+                or attempt == retries
+                or not re.search(
+                    self.config.transient_error_pattern,
+                    process.stderr + process.stdout,
+                )
+            ):
+                break
+
+            delay = self.config.submit_retry_delay * 2**attempt
+            self.logger.warning(
+                f"Submission of {job_name} failed with code {process.returncode}, "
+                f"retrying in {delay:g}s: {process.stderr.strip()}"
+            )
+            time.sleep(delay)
+
+        scheduler_id = None
+        if process.stdout:
+            self.logger.info(process.stdout.strip())
+        if process.returncode != 0:
+            self.logger.error(
+                f"Submission failed with code {process.returncode}: "
+                f"{process.stderr.strip()}"
+            )
+        else:
+            match = re.search(self.config.job_id_pattern, process.stdout)
+            if match:
+                scheduler_id = match.group(1)
+            else:
+                self.logger.debug("No job ID found in the scheduler output.")
+
+        self._record_submission(
+            job_name, scheduler_id, process.returncode, attempt + 1
+        )
+        return scheduler_id
+
+    def _record_submission(self, job_name, scheduler_id, return_code, attempts):
+        """Append a row to the submission ledger, a TSV in the output directory."""
+        if not self.config.submission_ledger:
+            return
+        ledger_path = os.path.join(self.output_dir, self.config.submission_ledger)
+        row = [
+            time.strftime("%Y-%m-%dT%H:%M:%S"),
+            job_name,
+            scheduler_id,
+            return_code,
+            attempts,
+        ]
+
+        with self._ledger_lock:
+            write_header = not os.path.exists(ledger_path)
+            with open(ledger_path, "a") as ledger:
+                if write_header:
+                    ledger.write("\t".join(LEDGER_COLUMNS) + "\n")
+                ledger.write(
+                    "\t".join("" if value is None else str(value) for value in row)
+                    + "\n"
+                )
+
+    def _submit_arrays(self, jobs, resources=None):
+        """Submit jobs as arrays of up to array_max_size jobs. Without resources
+        given, jobs requesting different resources go in different arrays."""
+        max_size = self.config.array_max_size
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+
+        groups = {}
+        for job in jobs:
+            key = None if resources else tuple(sorted((job.resources or {}).items()))
+            groups.setdefault(key, []).append(job)
+
+        arrays = []
+        for group in groups.values():
+            group_resources = resources or self.get_max_resources(group)
+            for start in range(0, len(group), max_size):
+                arrays.append((group[start : start + max_size], group_resources))
+
+        for array_jobs, array_resources in arrays:
+            array_name = ARRAY_NAME_FORMAT_STR.format(
+                timestamp=timestamp, index=next(self._allocation_index)
+            )
+            script_path = self.write_array_files(array_name, array_jobs)
+
+            self.logger.info(
+                f"Submitting array {array_name} of {len(array_jobs)} job(s)."
+            )
+            scheduler_id = self._submit(
+                self.create_array_submission(
+                    array_name, len(array_jobs), script_path, array_resources
+                ),
+                _combine_dependencies(array_jobs),
+                job_name=array_name,
+            )
+            # Depending on an array waits for all of its tasks
+            for job in array_jobs:
+                job.scheduler_id = scheduler_id
 
 
 class LocalJobManager(JobManager):
-    def __init__(self, output_directory=None, debug=False):
+    """Runs jobs as local processes, up to n_jobs at a time.
+
+    If both a memory budget and a per-job memory use are given, fewer jobs are run
+    at once when needed to keep their total memory within the budget. Each job's
+    output is streamed to its own file in the output directory.
+    """
+
+    def __init__(
+        self,
+        output_directory=None,
+        debug=False,
+        n_jobs=1,
+        memory_budget=None,
+        mem_use=None,
+    ):
         super().__init__(output_directory, debug)
+        self.n_jobs = n_jobs if n_jobs else 1
+        self.memory_budget = memory_budget
+        self.mem_use = mem_use
 
-    def add_job(self, job_name, job_string):
+    def add_job(self, job_name, job_string, dependencies=None, resources=None):
+        """Queue a job. Dependencies are ignored, as local jobs can run at the same
+        time; queue dependent jobs for a later submit_jobs call instead. Resources
+        are ignored too, as local jobs share the memory budget."""
         job = Job(job_name, job_string)
         self.job_queue.append(job)
+        return job
+
+    def get_concurrency(self):
+        """The number of jobs to run at once, given n_jobs and the memory budget."""
+        concurrency = self.n_jobs
+        if self.memory_budget and self.mem_use:
+            jobs_in_budget = parse_memory(self.memory_budget) // parse_memory(
+                self.mem_use
+            )
+            if jobs_in_budget < concurrency:
+                self.logger.info(
+                    f"Memory budget of {self.memory_budget} allows {jobs_in_budget} "
+                    f"job(s) of {self.mem_use} at once."
+                )
+                concurrency = jobs_in_budget
+
+        return max(1, min(concurrency, len(self.job_queue)))
+
+    def get_log_path(self, job):
+        return os.path.join(
+            self.output_dir, LOCAL_OUTPUT_FORMAT_STR.format(jobid=job.job_name)
+        )
 
     def submit_jobs(self):
-        self.logger.info(f"Submitting {len(self.job_queue)} job(s) locally.")
-        processes = []
-        for job in self.job_queue:
-            process = subprocess.run(job.job_string, shell=True, capture_output=True)
-            processes.append(process)
+        concurrency = self.get_concurrency()
+        self.logger.info(
+            f"Submitting {len(self.job_queue)} job(s) locally, "
+            f"running up to {concurrency} at a time."
+        )
+
+        # Each job is its own process, so threads only need to wait on them
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            processes = list(executor.map(self._run_job, self.job_queue))
+
+        self._log_summary(processes)
         self.job_queue.clear()
         return processes
 
+    def _run_job(self, job):
+        log_path = self.get_log_path(job)
+        self.logger.debug(f"Running job {job.job_name}, logging to: {log_path}")
+
+        with open(log_path, "wb") as log_file:
+            process = subprocess.run(
+                job.job_string, shell=True, stdout=log_file, stderr=subprocess.STDOUT
+            )
+        with open(log_path, "rb") as log_file:
+            process.stdout = log_file.read()
+
+        return process
+
+    def _log_summary(self, processes):
+        failed = [
+            (job, process)
+            for job, process in zip(self.job_queue, processes)
+            if process.returncode != 0
+        ]
+        self.logger.info(
+            f"Local jobs finished: {len(processes) - len(failed)} succeeded, "
+            f"{len(failed)} failed."
+        )
+        for job, process in failed:
+            self.logger.error(
+                f"Job {job.job_name} exited with code {process.returncode}. "
+                f"See: {self.get_log_path(job)}"
+            )
+
+
+class _TokenBucket:
+    """Limits events to an average rate, allowing bursts of up to capacity events.
+    A rate of 0 sets no limit."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until an event is allowed."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _group_by_dependency_level(jobs):
+    """Split jobs into levels, each depending only on jobs in earlier levels."""
+    levels = []
+    pending = list(jobs)
+    while pending:
+        level = [
+            job
+            for job in pending
+            if not any(parent in pending for parent in job.dependencies)
+        ]
+        # Dependency cycles can't be ordered, so submit what remains together
+        if not level:
+            level = pending
+        levels.append(level)
+        pending = [job for job in pending if job not in level]
+    return levels
+
+
+def _combine_dependencies(jobs):
+    dependencies = []
+    for job in jobs:
+        for parent in job.dependencies:
+            if parent not in dependencies:
+                dependencies.append(parent)
+    return dependencies
+
+
+def _scale_quantity(quantity, factor):
+    """Multiply a resource value, such as '5000', '20G' or 4, keeping its unit."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(\D*)", str(quantity))
+    if not match:
+        raise ValueError(f"Cannot scale resource value: {quantity}")
+    value, unit = match.groups()
+    return f"{float(value) * factor:g}{unit}"
+
+
+def write_job_manifest(manifest_path, jobs):
+    """Save job names and commands, tab separated, one job per line."""
+    with open(manifest_path, "w") as manifest:
+        for job in jobs:
+            manifest.write(f"{job.job_name}\t{job.command}\n")
+
+
+def read_job_manifest(manifest_path):
+    with open(manifest_path) as manifest:
+        return [
+            Job(*line.rstrip("\n").split("\t", 1)) for line in manifest if line.strip()
+        ]
+
+
+def run_job_bundle(manifest_path, output_directory, n_workers=1, debug=False):
+    """Run a bundle's jobs inside its allocation, n_workers at a time.
+
+    Each job's output goes to its own file in output_directory, and the exit status
+    of every job is saved next to the manifest.
+
+    Returns:
+        list: The finished processes, in manifest order.
+    """
+    local_manager = LocalJobManager(output_directory, debug, n_jobs=n_workers)
+    jobs = read_job_manifest(manifest_path)
+    for job in jobs:
+        local_manager.add_job(job.job_name, job.command)
+
+    processes = local_manager.submit_jobs()
+
+    status_path = os.path.splitext(manifest_path)[0] + BUNDLE_STATUS_SUFFIX
+    with open(status_path, "w") as status_file:
+        status_file.write("job_name\texit_status\n")
+        for job, process in zip(jobs, processes):
+            status_file.write(f"{job.job_name}\t{process.returncode}\n")
+
+    return processes
+
 
 class JobManagerFactory:
     @classmethod
@@ -165,6 +725,8 @@ class JobManagerFactory:
         time=None,
         threads=None,
         email=None,
+        n_jobs=1,
+        memory_budget=None,
     ) -> JobManager:
         """
         Initializes a JobManager object.
@@ -172,6 +734,9 @@ class JobManagerFactory:
         Args:
             method (str): "batch / Local"
             The method to be used for running the job.
+            n_jobs (int): Local only - the number of jobs to run at once.
+            memory_budget (str): Local only - the total memory the running jobs
+                may use, such as "64G". Each job is assumed to use mem_use.
         """
         if batch_config:    # Instantiate Batch Manager
             if not isinstance(batch_config, BatchManagerConfig):
@@ -190,10 +755,18 @@ class JobManagerFactory:
                 batch_config, output_directory, debug, mem_use, time, threads, email
             )
         else:   # Instantiate Local Manager
-            return LocalJobManager()
+            return LocalJobManager(
+                output_directory, debug, n_jobs, memory_budget, mem_use
+            )
 
 
 class Job:
-    def __init__(self, job_name, job_string):
+    def __init__(
+        self, job_name, job_string, command=None, dependencies=None, resources=None
+    ):
         self.job_name = job_name
-        self.job_string = job_string
\ No newline at end of file
+        self.job_string = job_string
+        self.command = command if command else job_string
+        self.dependencies = dependencies if dependencies else []
+        self.resources = resources
+        self.scheduler_id = None
\ No newline at end of file
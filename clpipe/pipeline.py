@@ -0,0 +1,293 @@
+"""Queue the stages of the pipeline for a set of subjects in one go.
+
+Each stage's jobs are submitted held by the scheduler until the same subject's
+jobs from the previous stage have ended, so no one needs to watch for a stage to
+finish before submitting the next.
+"""
+
+import glob
+import os
+
+from .config.options import ProjectOptions, DEFAULT_PROCESSING_STREAM
+from .job_manager import JobManager, JobManagerFactory
+from .utils import get_logger, parse_time, format_time
+
+STEP_NAME = "pipeline"
+STAGE_CONVERSION = "convert2bids"
+STAGE_PREPROCESS = "preprocess"
+STAGE_POSTPROCESS = "postprocess"
+STAGE_ROI_EXTRACTION = "roi_extract"
+PIPELINE_STAGES = [
+    STAGE_CONVERSION,
+    STAGE_PREPROCESS,
+    STAGE_POSTPROCESS,
+    STAGE_ROI_EXTRACTION,
+]
+"""Stages in the order they run"""
+
+# Postprocessing finds its images once fMRIPrep is done, so its batch job runs the
+#   subject's image jobs locally, within its allocation
+POSTPROCESS_SUBJECT_STRING = (
+    "clpipe postprocess {subject} -config_file {config_file} "
+    "-processing_stream {processing_stream} -no-batch -submit"
+)
+# Refreshes the BIDS index once for every subject postprocessed, for subjects
+#   fMRIPrep has just processed. Without -submit, images are listed, not run.
+POSTPROCESS_INDEX_STRING = (
+    "clpipe postprocess {subjects} -config_file {config_file} "
+    "-processing_stream {processing_stream} -refresh_index=incremental "
+    "-no-batch -no-cache"
+)
+POSTPROCESS_INDEX_JOB_NAME = "postprocess_index"
+# A subject's raw BOLD runs, each postprocessed as one image
+BOLD_RUN_PATTERN = "sub-{subject}/**/func/*_bold.nii*"
+
+
+def queue_pipeline(
+    subjects,
+    config_file,
+    stages: list = None,
+    processing_stream: str = DEFAULT_PROCESSING_STREAM,
+    submit: bool = False,
+    debug: bool = False,
+):
+    """Queue the given stages for each subject as dependent batch jobs.
+
+    Subjects must be given, as later stages can't list subjects whose data
+    earlier stages have yet to make.
+
+    Returns:
+        dict: The jobs queued for each stage.
+    """
+    options: ProjectOptions = ProjectOptions.load(config_file)
+    logger = get_logger(STEP_NAME, debug=debug, log_dir=options.get_logs_dir())
+
+    if not subjects:
+        raise ValueError("Subjects must be given to queue the pipeline.")
+    if stages is None:
+        stages = PIPELINE_STAGES
+    unknown_stages = set(stages) - set(PIPELINE_STAGES)
+    if unknown_stages:
+        raise ValueError(f"Unknown pipeline stage(s): {', '.join(unknown_stages)}")
+    stages = [stage for stage in PIPELINE_STAGES if stage in stages]
+
+    logger.info(
+        f"Queueing stage(s) {' -> '.join(stages)} for subject(s): "
+        f"{', '.join(subjects)}"
+    )
+
+    # The jobs each subject's next stage waits on
+    parent_jobs = {subject: [] for subject in subjects}
+    queued_jobs = {}
+    for stage in stages:
+        job_manager = _get_stage_manager(stage, options, processing_stream, debug)
+
+        # Postprocessing jobs read one BIDS index, so a single job updates it once
+        #   every subject's earlier jobs have ended, rather than each racing to
+        stage_jobs = []
+        if stage == STAGE_POSTPROCESS:
+            stage_jobs.append(
+                _queue_postprocess_index(
+                    subjects, config_file, job_manager, processing_stream, parent_jobs
+                )
+            )
+
+        subject_jobs = {}
+        for subject in subjects:
+            queue_length = len(job_manager.job_queue)
+            _queue_stage(
+                stage,
+                subject,
+                config_file,
+                options,
+                job_manager,
+                processing_stream,
+                debug,
+                logger,
+            )
+            subject_jobs[subject] = job_manager.job_queue[queue_length:]
+            for job in subject_jobs[subject]:
+                job.dependencies = (
+                    list(parent_jobs[subject]) + stage_jobs + job.dependencies
+                )
+
+        # Subjects' extractions write to shared stores, so one job consolidates
+        # them all, after every subject's extraction
+        if stage == STAGE_ROI_EXTRACTION and options.roi_extraction.consolidate:
+            extraction_jobs = [job for jobs in subject_jobs.values() for job in jobs]
+            if extraction_jobs:
+                _queue_roi_consolidation(
+                    subjects, config_file, options, job_manager, extraction_jobs
+                )
+
+        queued_jobs[stage] = list(job_manager.job_queue)
+        logger.info(f"Stage {stage}: {len(job_manager.job_queue)} job(s)")
+        if submit:
+            job_manager.submit_jobs()
+        else:
+            job_manager.print_jobs()
+
+        # A stage with no jobs for a subject leaves it waiting on the stage before
+        for subject, jobs in subject_jobs.items():
+            if jobs:
+                parent_jobs[subject] = jobs
+
+    return queued_jobs
+
+
+def _get_stage_manager(
+    stage: str, options: ProjectOptions, processing_stream: str, debug: bool
+) -> JobManager:
+    if stage == STAGE_CONVERSION:
+        from .convert2bids import get_batch_manager
+    elif stage == STAGE_PREPROCESS:
+        from .fmri_preprocess import get_batch_manager
+    elif stage == STAGE_ROI_EXTRACTION:
+        from .roi_extractor import get_batch_manager
+    else:
+        postprocessing = _get_postprocessing(options, processing_stream)
+        return JobManagerFactory.get(
+            batch_config=options.batch_config_path,
+            output_directory=postprocessing.get_stream_log_dir(processing_stream),
+            debug=debug,
+            mem_use=postprocessing.batch_options.memory_usage,
+            time=postprocessing.batch_options.time_usage,
+            threads=postprocessing.batch_options.n_threads,
+            email=options.email_address,
+        )
+
+    return get_batch_manager(options, debug=debug)
+
+
+def _get_postprocessing(options: ProjectOptions, processing_stream: str):
+    from .postprocess import apply_stream
+
+    if processing_stream != DEFAULT_PROCESSING_STREAM:
+        return apply_stream(options, processing_stream)
+    return options.postprocessing
+
+
+def _count_bold_runs(bids_directory: str, subject: str) -> int:
+    return len(
+        glob.glob(
+            os.path.join(bids_directory, BOLD_RUN_PATTERN.format(subject=subject)),
+            recursive=True,
+        )
+    )
+
+
+def _get_postprocess_time(
+    subject: str, options: ProjectOptions, processing_stream: str, logger
+) -> str:
+    """The time for a subject's postprocessing job, which runs its images one after
+    another: the time per image, times the subject's BOLD runs.
+
+    Subjects yet to be converted are assumed to have as many runs as the most any
+    converted subject has.
+    """
+    postprocessing = _get_postprocessing(options, processing_stream)
+    time_usage = postprocessing.batch_options.time_usage
+    bids_directory = options.fmriprep.bids_directory
+
+    n_images = _count_bold_runs(bids_directory, subject)
+    if not n_images:
+        converted = glob.glob(os.path.join(bids_directory, "sub-*"))
+        n_images = max(
+            [
+                _count_bold_runs(bids_directory, os.path.basename(path)[4:])
+                for path in converted
+            ],
+            default=0,
+        )
+    if not n_images:
+        logger.warning(
+            f"No BOLD runs found for subject {subject}, so its postprocessing job "
+            f"requests the time of one image: {time_usage}"
+        )
+        return time_usage
+
+    return format_time(parse_time(time_usage) * n_images)
+
+
+def _queue_postprocess_index(
+    subjects, config_file, job_manager: JobManager, processing_stream, parent_jobs
+):
+    dependencies = []
+    for jobs in parent_jobs.values():
+        dependencies += [job for job in jobs if job not in dependencies]
+    return job_manager.add_job(
+        POSTPROCESS_INDEX_JOB_NAME,
+        POSTPROCESS_INDEX_STRING.format(
+            subjects=" ".join(subjects),
+            config_file=config_file,
+            processing_stream=processing_stream,
+        ),
+        dependencies=dependencies,
+    )
+
+
+def _queue_roi_consolidation(
+    subjects, config_file, options: ProjectOptions, job_manager, dependencies
+):
+    from .roi_extractor import queue_roi_consolidation
+
+    # Extraction jobs read the copy of the config saved to the output directory
+    config_path = os.path.join(
+        options.roi_extraction.output_directory, os.path.basename(config_file)
+    )
+    queue_roi_consolidation(job_manager, config_path, subjects, dependencies)
+
+
+def _queue_stage(
+    stage: str,
+    subject: str,
+    config_file,
+    options: ProjectOptions,
+    job_manager: JobManager,
+    processing_stream: str,
+    debug: bool,
+    logger,
+):
+    """Add a subject's jobs for a stage to job_manager."""
+    if stage == STAGE_CONVERSION:
+        from .convert2bids import convert2bids
+
+        convert2bids(
+            config_file=config_file,
+            subjects=[subject],
+            debug=debug,
+            job_manager=job_manager,
+        )
+    elif stage == STAGE_PREPROCESS:
+        from .fmri_preprocess import fmriprep_process
+
+        fmriprep_process(
+            config_file=config_file,
+            subjects=[subject],
+            debug=debug,
+            job_manager=job_manager,
+        )
+    elif stage == STAGE_POSTPROCESS:
+        job_manager.add_job(
+            f"postprocess_sub-{subject}",
+            POSTPROCESS_SUBJECT_STRING.format(
+                subject=subject,
+                config_file=config_file,
+                processing_stream=processing_stream,
+            ),
+            resources={
+                "time": _get_postprocess_time(
+                    subject, options, processing_stream, logger
+                )
+            },
+        )
+    elif stage == STAGE_ROI_EXTRACTION:
+        from .roi_extractor import fmri_roi_extraction
+
+        fmri_roi_extraction(
+            subjects=[subject],
+            config_file=config_file,
+            debug=debug,
+            job_manager=job_manager,
+            consolidate=False,
+        )
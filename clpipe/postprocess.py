@@ -12,6 +12,7 @@ import time
 from pathlib import Path
 
 from .bids import (
+    BIDS_INDEX_NAME,
     get_bids,
     get_confounds,
     get_images_to_process,
@@ -23,6 +24,7 @@ from .bids import (
     validate_subject_exists,
 )
 import nipype.pipeline.engine as pe
+from nibabel.filebasedimages import ImageFileError
 
 # This hides a pybids future warning
 with warnings.catch_warnings():
@@ -36,10 +38,31 @@ from .config.options import (
     DEFAULT_WORKING_DIRECTORY,
 )
 from .config.options import DEFAULT_PROCESSING_STREAM
-from .job_manager import JobManagerFactory
+from .job_manager import JobManagerFactory, JobManager, BatchJobManager
 from .postprocutils.global_workflows import build_postprocessing_wf
+from .postprocutils.cache import (
+    DIGEST_MEMO_FILE_NAME,
+    compute_cache_key,
+    get_input_digests,
+    is_cached,
+    load_digest_memo,
+    save_digest_memo,
+    write_provenance,
+)
+from .postprocutils.profiling import (
+    PROFILE_DIR_NAME,
+    NodeProfiler,
+    enable_resource_monitor,
+    write_profile,
+)
+from .postprocutils.resources import (
+    ProcessTreeMemoryMonitor,
+    estimate_job_resources,
+    get_peak_memory,
+    record_job_resources,
+)
 from .postprocutils.utils import draw_graph
-from .utils import get_logger, resolve_fmriprep_dir
+from .utils import get_logger, parse_memory, resolve_fmriprep_dir
 from .errors import *
 
 STEP_NAME = "postprocess"
@@ -48,14 +71,19 @@ IMAGE_TIME_DIMENSION_INDEX = 3
 IMAGE_SUBMISSION_STRING_TEMPLATE = (
     "postprocess_image {run_config_file} "
     "{image_file} {subject_out_dir} {subject_working_dir} {subject_log_dir} "
-    "{debug}"
+    "-manifest_file {manifest_file} {debug}"
 )
-BIDS_INDEX_NAME = "bids_index"
-"""This is the location of the pybids-generated index"""
 
 SUBJECT_LOG_DIR = "distributor"
 """Where to save batch files, within the postprocessing log folder, for subject-level batch logs"""
+LOCAL_LOG_DIR = "local_out"
+"""Where to save image job output, within the postprocessing log folder, when running locally"""
+BATCH_LOG_DIR = "slurm_out"
+"""Where to save batch job output, within the subject's log folder, or the stream's
+log folder when job arrays or bundles are shared by all subjects"""
 RUN_CONFIG_FILE_NAME = "run_config.json"
+MANIFEST_DIR_NAME = "manifests"
+"""Where per-image manifests are saved, next to the run config"""
 
 
 def postprocess_subjects(
@@ -72,10 +100,21 @@ def postprocess_subjects(
     refresh_index=False,
     debug=False,
     cache=True,
+    n_jobs=1,
+    memory_budget=None,
 ):
     """
     Parse configuration and sanitize inputs in preparation for
         subject job distribution.
+
+    Without batch, image jobs from all subjects are run locally, up to n_jobs at a
+        time and within memory_budget, if given.
+
+    refresh_index may be "full" to rebuild the BIDS index, or "incremental" to
+        update it for changed subjects only.
+
+    With cache, images already postprocessed from unchanged inputs and options are
+        skipped.
     """
 
     options: ProjectOptions = ProjectOptions.load(config_file)
@@ -124,7 +163,13 @@ def postprocess_subjects(
     stream_run_config_path = (
         Path(run_config.stream_working_directory) / RUN_CONFIG_FILE_NAME
     )
-    run_config.dump(stream_run_config_path)
+    # Subjects' jobs may run this at once, so the config is replaced in one step,
+    #   never left part-written for another job's images to read
+    temp_run_config_path = stream_run_config_path.with_name(
+        f".{RUN_CONFIG_FILE_NAME}.{os.getpid()}"
+    )
+    run_config.dump(temp_run_config_path)
+    os.replace(temp_run_config_path, stream_run_config_path)
 
     # Setup Logging
     logger = get_logger(STEP_NAME, debug=debug, log_dir=options.get_logs_dir())
@@ -166,6 +211,29 @@ def postprocess_subjects(
         )
         time.sleep(0.5)
 
+        # Share one local job manager across subjects, so their images can run
+        #   concurrently. Batch jobs share one manager when submitted as job
+        #   arrays or bundles, so all subjects' images go in the same arrays and
+        #   bundles.
+        shared_manager = None
+        if not batch:
+            shared_manager = JobManagerFactory.get(
+                output_directory=Path(run_config.stream_log_directory) / LOCAL_LOG_DIR,
+                debug=debug,
+                mem_use=run_config.options.batch_options.memory_usage,
+                n_jobs=n_jobs,
+                memory_budget=memory_budget,
+            )
+        else:
+            batch_manager = _get_batch_manager(
+                run_config, Path(run_config.stream_log_directory) / BATCH_LOG_DIR
+            )
+            if (
+                batch_manager.config.array_command_active
+                or batch_manager.get_bundle_size() > 1
+            ):
+                shared_manager = batch_manager
+
         for subject in subjects_to_process:
             postprocess_subject(
                 subject_id=subject,
@@ -175,8 +243,16 @@ def postprocess_subjects(
                 batch=batch,
                 submit=submit,
                 debug=debug,
+                job_manager=shared_manager,
+                cache=cache,
             )
 
+        if shared_manager:
+            if submit:
+                shared_manager.submit_jobs()
+            else:
+                shared_manager.print_jobs()
+
     except NoSubjectsFoundError as nsfe:
         logger.error(nsfe)
         sys.exit(1)
@@ -211,9 +287,20 @@ def postprocess_subject(
     batch: bool = False,
     submit: bool = False,
     debug=False,
+    job_manager: JobManager = None,
+    cache: bool = True,
 ):
     """
     Handle postprocessing for a single subject.
+
+    Image jobs are added to job_manager for the caller to submit, if given.
+        Otherwise they are submitted here.
+
+    With cache, images whose exported output was made from the same input contents
+        and processing options are not submitted again.
+
+    With batch and the AutoResources batch option, each image's job requests the
+        memory and time estimated for it.
     """
 
     sub_with_id = "sub-" + subject_id
@@ -232,17 +319,10 @@ def postprocess_subject(
     logger.info(f"Processing subject: {subject_id}")
 
     batch_manager = None
-    if batch:
-        subject_slurm_log_dir = subject_log_dir / "slurm_out"
+    if batch and job_manager is None:
+        subject_slurm_log_dir = subject_log_dir / BATCH_LOG_DIR
         subject_slurm_log_dir.mkdir(exist_ok=True)
-        batch_manager = JobManagerFactory.get(
-            batch_config=run_config.batch_config_file,
-            output_directory=subject_slurm_log_dir,
-            mem_use=run_config.options.batch_options.memory_usage,
-            threads=run_config.options.batch_options.n_threads,
-            time=run_config.options.batch_options.time_usage,
-            email=run_config.email_address
-        )
+        batch_manager = _get_batch_manager(run_config, subject_slurm_log_dir)
 
     try:
         logger.info(f"Checking for requested subject in fmriprep output")
@@ -289,9 +369,59 @@ def postprocess_subject(
             logger.info(f"Creating subject working directory: {subject_working_dir}")
             subject_working_dir.mkdir(parents=True, exist_ok=False)
 
+        # Resolve each image's auxiliary files once here, so image jobs don't
+        #   need to open the BIDS index
+        manifest_dir = Path(run_config_path).parent / MANIFEST_DIR_NAME / sub_with_id
+        digest_memo_file = Path(run_config_path).parent / DIGEST_MEMO_FILE_NAME
+        digest_memo = load_digest_memo(digest_memo_file)
+        manifest_files = {}
+        job_resources = {}
+        for image in list(images_to_process):
+            try:
+                manifest = build_image_manifest(
+                    bids, image, run_config.options.processing_steps, logger
+                )
+            except (MixingFileNotFoundError, NoiseFileNotFoundError) as aroma_error:
+                logger.error(aroma_error)
+                logger.error(f"Skipping image: {image.path}")
+                images_to_process.remove(image)
+                continue
+
+            # Inputs are only hashed to check the cache, as hashing large images
+            #   is slow. Image jobs reuse these digests for provenance.
+            if cache:
+                manifest["input_digests"] = get_input_digests(manifest, digest_memo)
+                manifest["cache_key"] = compute_cache_key(
+                    manifest["input_digests"], manifest["tr"], run_config.options
+                )
+                image_export_path = build_export_path(
+                    image.path,
+                    subject_id,
+                    run_config.target_directory,
+                    subject_out_dir,
+                )
+                if is_cached(image_export_path, manifest["cache_key"]):
+                    logger.info(
+                        f"Skipping image with unchanged inputs and options: "
+                        f"{image.path}"
+                    )
+                    images_to_process.remove(image)
+                    continue
+
+            if batch and run_config.options.batch_options.auto_resources:
+                manifest["resources"] = _estimate_image_resources(
+                    run_config, manifest["image_file"], logger
+                )
+                job_resources[Path(image.path).stem] = manifest["resources"]
+
+            manifest_files[image.path] = write_image_manifest(manifest, manifest_dir)
+        if cache:
+            save_digest_memo(digest_memo, digest_memo_file)
+
         submission_strings = _create_image_submission_strings(
             run_config_path,
             images_to_process,
+            manifest_files,
             subject_out_dir,
             subject_working_dir,
             subject_log_dir,
@@ -299,24 +429,27 @@ def postprocess_subject(
             logger,
         )
 
-        # Submit the jobs through batch manager
+        # Queue the jobs with the shared manager, or submit them for this subject
+        submit_here = job_manager is None
         if batch_manager:
             logger.info("Setting up batch manager with jobs to run.")
+            job_manager = batch_manager
+        elif submit_here:
+            job_manager = JobManagerFactory.get(
+                output_directory=subject_log_dir / LOCAL_LOG_DIR,
+                debug=debug,
+            )
 
-            for key in submission_strings.keys():
-                batch_manager.add_job(key, submission_strings[key])
+        for key in submission_strings.keys():
+            job_manager.add_job(
+                key, submission_strings[key], resources=job_resources.get(key)
+            )
 
+        if submit_here:
             if submit:
-                batch_manager.submit_jobs()
+                job_manager.submit_jobs()
             else:
-                batch_manager.print_jobs()
-        else:
-            if submit:
-                for key in submission_strings.keys():
-                    os.system(submission_strings[key])
-            else:
-                for key in submission_strings.keys():
-                    print(submission_strings[key])
+                job_manager.print_jobs()
 
     except SubjectNotFoundError as snfe:
         logger.error(snfe)
@@ -334,9 +467,13 @@ def postprocess_image(
     subject_log_dir: os.PathLike,
     confounds_only=False,
     debug=False,
+    manifest_file: os.PathLike = None,
 ):
     """
     Setup the workflows specified in the postprocessing configuration.
+
+    The image's auxiliary files are read from its manifest, if given. Otherwise,
+        they are looked up in the BIDS index.
     """
     image_path = Path(image_path)
     image_short_name = f"{str(Path(image_path).stem)}"
@@ -361,31 +498,21 @@ def postprocess_image(
     # Remove hyphens to allow use as a pipeline name
     pipeline_name = file_name_no_modality.replace("-", "_")
 
-    bids: BIDSLayout = get_bids(
-        run_config.bids_directory,
-        database_path=run_config.pybids_db_path,
-        fmriprep_dir=run_config.target_directory,
-    )
-    # Lookup the BIDSFile with the image path
-    bids_image: BIDSFile = bids.get_file(image_path)
-    # Fetch the image's entities
-    image_entities = bids_image.get_entities()
-    # Create a sub dict of the entities we will need to query on
-    query_params = {
-        k: image_entities[k]
-        for k in image_entities.keys()
-        & {"session", "subject", "task", "run", "acquisition", "space"}
-    }
-    # Create a specific dict for searching non-image files
-    non_image_query_params = query_params.copy()
-    non_image_query_params.pop("space")
-
-    mixing_file, noise_file = None, None
-    if "AROMARegression" in run_config.options.processing_steps:
+    if manifest_file:
+        logger.info(f"Reading image manifest: {manifest_file}")
+        manifest = load_image_manifest(manifest_file)
+    else:
+        bids: BIDSLayout = get_bids(
+            run_config.bids_directory,
+            database_path=run_config.pybids_db_path,
+            fmriprep_dir=run_config.target_directory,
+        )
+        # Lookup the BIDSFile with the image path
+        bids_image: BIDSFile = bids.get_file(image_path)
         try:
-            # TODO: update these for image entities
-            mixing_file = get_mixing_file(bids, non_image_query_params, logger)
-            noise_file = get_noise_file(bids, non_image_query_params, logger)
+            manifest = build_image_manifest(
+                bids, bids_image, run_config.options.processing_steps, logger
+            )
         except MixingFileNotFoundError as mfnfe:
             logger.error(mfnfe)
             # TODO: this should raise the error for the controller to handle
@@ -394,10 +521,11 @@ def postprocess_image(
             logger.error(nfnfe)
             sys.exit(1)
 
-    # Search for this subject's files necessary for processing
-    mask_image = get_mask(bids, query_params, logger)
-    tr = get_tr(bids, query_params, logger)
-    confounds_path = get_confounds(bids, non_image_query_params, logger)
+    mixing_file = manifest["mixing_file"]
+    noise_file = manifest["noise_file"]
+    mask_image = manifest["mask_file"]
+    tr = manifest["tr"]
+    confounds_path = manifest["confounds_file"]
 
     # Try and build an export path for postprocess confounds if the subject has
     #   confounds to work with
@@ -406,7 +534,7 @@ def postprocess_image(
         try:
             confounds_export_path = build_export_path(
                 confounds_path,
-                query_params["subject"],
+                manifest["subject"],
                 run_config.target_directory,
                 subject_out_dir,
             )
@@ -419,17 +547,23 @@ def postprocess_image(
     if not confounds_only:
         image_export_path = build_export_path(
             image_path,
-            query_params["subject"],
+            manifest["subject"],
             run_config.target_directory,
             subject_out_dir,
         )
 
+    input_digests = _get_image_input_digests(manifest, run_config.options)
+    step_cache_dir = None
+    if run_config.options.step_cache:
+        step_cache_dir = run_config.options.get_step_cache_dir()
+        logger.info(f"Using step output cache: {step_cache_dir}")
+
     # Build the global postprocessing workflow
     postproc_wf: pe.Workflow = build_postprocessing_wf(
         run_config.options,
         tr,
         name=pipeline_name,
-        image_file=bids_image,
+        image_file=manifest["image_file"],
         image_export_path=image_export_path,
         confounds_file=confounds_path,
         confounds_export_path=confounds_export_path,
@@ -437,6 +571,8 @@ def postprocess_image(
         mask_file=mask_image,
         mixing_file=mixing_file,
         noise_file=noise_file,
+        step_cache_dir=step_cache_dir,
+        input_digests=input_digests,
         base_dir=subject_working_dir,
         crashdump_dir=subject_working_dir,
     )
@@ -449,10 +585,189 @@ def postprocess_image(
             logger=logger,
         )
 
-    postproc_wf.run()
+    run_args = get_workflow_run_args(
+        run_config.options.batch_options, manifest.get("resources")
+    )
+    if run_config.options.profile:
+        # Node usage is measured from this process, so nodes must run one at a time
+        enable_resource_monitor()
+        profiler = NodeProfiler()
+        run_args = {"plugin": "Linear", "plugin_args": {"status_callback": profiler}}
+    logger.info(f"Running workflow with the {run_args['plugin']} plugin")
+
+    start_time = time.time()
+    # MultiProc runs nodes in parallel processes, whose memory adds up
+    memory_monitor = ProcessTreeMemoryMonitor()
+    try:
+        with memory_monitor:
+            postproc_wf.run(**run_args)
+    finally:
+        if run_config.options.profile:
+            profile_json, _ = write_profile(
+                profiler.records,
+                Path(subject_log_dir) / PROFILE_DIR_NAME,
+                file_name_no_extensions,
+            )
+            logger.info(f"Saved node profile: {profile_json}")
+
+    # Let later jobs learn how much memory and time this image took
+    if run_config.options.batch_options.auto_resources:
+        try:
+            record_job_resources(
+                run_config.options.get_resource_history_path(),
+                manifest["image_file"],
+                run_config.options.processing_steps,
+                time.time() - start_time,
+                peak_memory=max(memory_monitor.peak_memory, get_peak_memory()),
+            )
+        except OSError as e:
+            logger.warn(f"Could not record the job's resource use: {e}")
+
+    # Record the inputs and options of the exported image, letting later runs
+    #   skip it while they are unchanged. Without their digests, there is no cache
+    #   to record it for.
+    if image_export_path and input_digests:
+        cache_key = manifest.get("cache_key") or compute_cache_key(
+            input_digests, tr, run_config.options
+        )
+        write_provenance(
+            image_export_path, cache_key, manifest, input_digests, run_config.options
+        )
+
     sys.exit(0)
 
 
+def _get_image_input_digests(manifest: dict, options) -> dict:
+    """Get the digests of an image's inputs, if a cache needs them.
+
+    Digests made when the image was submitted with the result cache on are
+    reused. Otherwise, inputs are only hashed for the step cache.
+    """
+    if manifest.get("input_digests"):
+        return manifest["input_digests"]
+    if options.step_cache:
+        return get_input_digests(manifest)
+    return None
+
+
+def get_workflow_run_args(batch_options, resources: dict = None) -> dict:
+    """Choose the nipype plugin and its arguments for running an image's workflow.
+
+    MultiProc runs independent nodes at once, using up to the job's threads and
+    memory: its estimated memory from resources, if given, or the batch options'.
+    With a single thread, or the Linear plugin chosen, nodes run one at a time.
+    """
+    n_procs = int(batch_options.n_threads or 1)
+    if batch_options.workflow_plugin != "MultiProc" or n_procs < 2:
+        return {"plugin": "Linear", "plugin_args": {}}
+
+    memory = (resources or {}).get("mem_use") or batch_options.memory_usage
+    return {
+        "plugin": "MultiProc",
+        "plugin_args": {
+            "n_procs": n_procs,
+            "memory_gb": parse_memory(memory) / 1024**3,
+        },
+    }
+
+
+def _get_batch_manager(
+    run_config: PostProcessingRunConfig, output_directory: os.PathLike
+) -> BatchJobManager:
+    return JobManagerFactory.get(
+        batch_config=run_config.batch_config_file,
+        output_directory=output_directory,
+        mem_use=run_config.options.batch_options.memory_usage,
+        threads=run_config.options.batch_options.n_threads,
+        time=run_config.options.batch_options.time_usage,
+        email=run_config.email_address,
+    )
+
+
+def _estimate_image_resources(
+    run_config: PostProcessingRunConfig, image_file: os.PathLike, logger
+) -> dict:
+    """Estimate an image job's memory and time, or return None to use the batch
+    options' if the image can't be read."""
+    batch_options = run_config.options.batch_options
+    try:
+        resources = estimate_job_resources(
+            image_file,
+            run_config.options.processing_steps,
+            history_file=run_config.options.get_resource_history_path(),
+            margin=batch_options.resource_margin,
+            memory_like=batch_options.memory_usage,
+        )
+    except (OSError, ValueError, ImageFileError) as e:
+        logger.warn(f"Could not estimate resources for image {image_file}: {e}")
+        return None
+
+    logger.debug(
+        f"Estimated resources for image {image_file}: {resources['mem_use']} "
+        f"memory, {resources['time']} time"
+    )
+    return resources
+
+
+def build_image_manifest(
+    bids: BIDSLayout, image: BIDSFile, processing_steps: list, logger
+) -> dict:
+    """Resolve the auxiliary files and TR needed to postprocess an image.
+
+    Raises:
+        MixingFileNotFoundError: If AROMA regression is requested without a
+            MELODIC mixing file.
+        NoiseFileNotFoundError: If AROMA regression is requested without an AROMA
+            noise ICs file.
+    """
+    # Fetch the image's entities
+    image_entities = image.get_entities()
+    # Create a sub dict of the entities we will need to query on
+    query_params = {
+        k: image_entities[k]
+        for k in image_entities.keys()
+        & {"session", "subject", "task", "run", "acquisition", "space"}
+    }
+    # Create a specific dict for searching non-image files
+    non_image_query_params = query_params.copy()
+    non_image_query_params.pop("space")
+
+    mixing_file, noise_file = None, None
+    if "AROMARegression" in processing_steps:
+        # TODO: update these for image entities
+        mixing_file = get_mixing_file(bids, non_image_query_params, logger)
+        noise_file = get_noise_file(bids, non_image_query_params, logger)
+
+    return {
+        "image_file": image.path,
+        "subject": query_params["subject"],
+        "entities": query_params,
+        "tr": get_tr(bids, query_params, logger),
+        "mask_file": get_mask(bids, query_params, logger),
+        "confounds_file": get_confounds(bids, non_image_query_params, logger),
+        "mixing_file": mixing_file,
+        "noise_file": noise_file,
+    }
+
+
+def write_image_manifest(manifest: dict, manifest_dir: os.PathLike) -> Path:
+    """Save an image manifest as JSON, named after its image, returning its path."""
+    manifest_dir = Path(manifest_dir)
+    manifest_dir.mkdir(parents=True, exist_ok=True)
+
+    image_name = Path(manifest["image_file"]).name.split(".")[0]
+    manifest_file = manifest_dir / f"{image_name}.json"
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    return manifest_file
+
+
+def load_image_manifest(manifest_file: os.PathLike) -> dict:
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
 def build_export_path(
     image_path: os.PathLike,
     subject_id: str,
@@ -514,6 +829,7 @@ def _get_processing_streams(options: ProjectOptions):
 def _create_image_submission_strings(
     run_config_file,
     images_to_process,
+    manifest_files,
     subject_out_dir,
     subject_working_dir,
     subject_log_dir,
@@ -537,6 +853,7 @@ def _create_image_submission_strings(
             subject_out_dir=str(subject_out_dir),
             subject_working_dir=str(subject_working_dir),
             subject_log_dir=str(subject_log_dir),
+            manifest_file=str(manifest_files[image.path]),
             debug=debug_flag,
         )
         logger.debug(submission_strings[key])
@@ -0,0 +1,211 @@
+"""Content-addressed caching of postprocessing results.
+
+An image's cache key is a hash of the contents of its inputs (image, confounds,
+mask and AROMA files), its TR and the options of the steps that process it. A
+provenance record holding the key is saved next to each exported image, so
+images whose key matches their record can be skipped.
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from ..config.options import KEY_MAP, PostProcessingOptions
+from ..config.package import VERSION
+from .utils import strip_image_extension
+
+PROVENANCE_SUFFIX = "_provenance.json"
+DIGEST_MEMO_FILE_NAME = "file_digests.json"
+"""Saved in the stream working directory, maps input files to their digests"""
+HASH_CHUNK_SIZE = 1 << 20
+
+# Maps a processing step name, like "TemporalFiltering", to its options field
+STEP_OPTION_FIELDS = {value: key for key, value in KEY_MAP.items()}
+
+
+def hash_file(file_path: os.PathLike, digest_memo: dict = None) -> str:
+    """Compute the sha256 digest of a file's contents.
+
+    If a memo is given, a digest recorded for the file at its current size and
+    modification time is reused, and new digests are recorded in it.
+    """
+    file_path = str(file_path)
+    stat = os.stat(file_path)
+    signature = [stat.st_size, stat.st_mtime_ns]
+
+    if digest_memo is not None:
+        memo = digest_memo.get(file_path)
+        if memo and memo["signature"] == signature:
+            return memo["digest"]
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+
+    if digest_memo is not None:
+        digest_memo[file_path] = {"signature": signature, "digest": digest}
+
+    return digest
+
+
+def load_digest_memo(memo_file: os.PathLike) -> dict:
+    if not Path(memo_file).exists():
+        return {}
+    with open(memo_file) as f:
+        return json.load(f)
+
+
+def save_digest_memo(digest_memo: dict, memo_file: os.PathLike):
+    with open(memo_file, "w") as f:
+        json.dump(digest_memo, f)
+
+
+def normalize_processing_options(options: PostProcessingOptions) -> dict:
+    """Reduce postprocessing options to those that change the processed outputs:
+    the steps, in order, the options of those steps and the confound options.
+
+    Paths, batch resources and execution settings, such as fused execution, are
+    left out.
+    """
+    step_options = options.processing_step_options.to_dict()
+
+    return {
+        "processing_steps": list(options.processing_steps),
+        "processing_step_options": {
+            step: step_options[STEP_OPTION_FIELDS[step]]
+            for step in options.processing_steps
+            if STEP_OPTION_FIELDS.get(step) in step_options
+        },
+        "confound_options": options.confound_options.to_dict(),
+    }
+
+
+def get_input_digests(manifest: dict, digest_memo: dict = None) -> dict:
+    """Hash each input file listed in an image manifest."""
+    return {
+        role: hash_file(manifest[role], digest_memo) if manifest[role] else None
+        for role in (
+            "image_file",
+            "confounds_file",
+            "mask_file",
+            "mixing_file",
+            "noise_file",
+        )
+    }
+
+
+def compute_cache_key(
+    input_digests: dict, tr: float, options: PostProcessingOptions
+) -> str:
+    key_data = {
+        "inputs": input_digests,
+        "tr": tr,
+        "options": normalize_processing_options(options),
+        "clpipe_version": VERSION,
+    }
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def get_provenance_path(export_path: os.PathLike) -> Path:
+    export_path = Path(export_path)
+    return export_path.parent / (
+        strip_image_extension(export_path.name) + PROVENANCE_SUFFIX
+    )
+
+
+def write_provenance(
+    export_path: os.PathLike,
+    cache_key: str,
+    manifest: dict,
+    input_digests: dict,
+    options: PostProcessingOptions,
+) -> Path:
+    """Record how an exported image was made, next to the image."""
+    provenance = {
+        "cache_key": cache_key,
+        "output_file": str(export_path),
+        "inputs": {
+            role: {"path": manifest[role], "sha256": digest}
+            for role, digest in input_digests.items()
+        },
+        "tr": manifest["tr"],
+        "options": normalize_processing_options(options),
+        "clpipe_version": VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+    provenance_path = get_provenance_path(export_path)
+    with open(provenance_path, "w") as f:
+        json.dump(provenance, f, indent=4)
+
+    return provenance_path
+
+
+def is_cached(export_path: os.PathLike, cache_key: str) -> bool:
+    """Whether an exported image exists and was made with the given cache key."""
+    provenance_path = get_provenance_path(export_path)
+    if not Path(export_path).exists() or not provenance_path.exists():
+        return False
+
+    try:
+        with open(provenance_path) as f:
+            return json.load(f).get("cache_key") == cache_key
+    except json.JSONDecodeError:
+        return False
+
+
+def compute_step_cache_key(
+    input_digests: dict, tr: float, step_options: dict, output_format: str = None
+) -> str:
+    """Hash the inputs of an image and the steps run on it so far, identifying an
+    intermediate output that can be shared between processing streams."""
+    key_data = {
+        "inputs": input_digests,
+        "tr": tr,
+        "steps": step_options,
+        "output_format": output_format,
+        "clpipe_version": VERSION,
+    }
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def find_cached_step_output(step_cache_dir: os.PathLike, key: str) -> Path:
+    """Find a stored step output by its key, returning None if there is none."""
+    for extension in (".nii.gz", ".nii.zst", ".nii"):
+        cache_file = Path(step_cache_dir) / f"{key}{extension}"
+        if cache_file.exists():
+            return cache_file
+    return None
+
+
+def store_step_output(in_file, step_cache_dir, key):
+    """Copy a step's output image into the step cache under its key.
+
+    The copy is renamed into place, so concurrent jobs never read a partial file.
+    """
+    import os
+    import shutil
+    from pathlib import Path
+    from clpipe.postprocutils.utils import strip_image_extension
+
+    step_cache_dir = Path(step_cache_dir)
+    step_cache_dir.mkdir(parents=True, exist_ok=True)
+
+    file_name = Path(in_file).name
+    extension = file_name[len(strip_image_extension(file_name)) :]
+    cache_file = step_cache_dir / f"{key}{extension}"
+
+    if not cache_file.exists():
+        temp_file = step_cache_dir / f".{key}.{os.getpid()}{extension}"
+        shutil.copyfile(in_file, temp_file)
+        os.replace(temp_file, cache_file)
+
+    return str(cache_file)
@@ -3,7 +3,7 @@ import os
 from nipype.interfaces.utility import Function, IdentityInterface
 import nipype.pipeline.engine as pe
 
-from .utils import get_scrub_vector_node, logical_or_across_lists, expand_scrub_dict
+from .utils import get_scrub_vector_from_confounds_node
 from .image_workflows import (
     build_image_postprocessing_workflow,
     STEP_CONFOUND_REGRESSION,
@@ -26,6 +26,8 @@ def build_postprocessing_wf(
     mixing_file: os.PathLike = None,
     noise_file: os.PathLike = None,
     working_dir: os.PathLike = None,
+    step_cache_dir: os.PathLike = None,
+    input_digests: dict = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
@@ -36,6 +38,8 @@ def build_postprocessing_wf(
         confounds_wf (pe.Workflow, optional): A confound processing workflow. Defaults to None.
         name (str, optional): The name for the constructed workflow. Defaults to "Postprocessing_Pipeline".
         confound_regression (bool, optional): Should the processed confounds be passed to the image workflow for regression? Defaults to False.
+        step_cache_dir (os.PathLike, optional): A step output cache shared between processing streams. Used along with input_digests. Defaults to None.
+        input_digests (dict, optional): Content digests of the image's input files, used to key the step cache. Defaults to None.
 
     Returns:
         pe.Workflow: A complete postprocessing workflow.
@@ -92,6 +96,8 @@ def build_postprocessing_wf(
             mixing_file=mixing_file,
             noise_file=noise_file,
             tr=tr,
+            step_cache_dir=step_cache_dir,
+            input_digests=input_digests,
             base_dir=base_dir,
             crashdump_dir=crashdump_dir,
         )
@@ -162,62 +168,28 @@ def build_multiple_scrubbing_workflow(
     # Convert list of ScrubColumns to list of dicts
     scrub_configs = [scrub_config.to_dict() for scrub_config in scrub_configs]
 
-    # Feed the scrub config list of dicts into the mapper via the workflow inputnode
+    # Feed the scrub config list of dicts into the scrub node via the workflow inputnode
     input_node.inputs.scrub_configs = scrub_configs
-    input_node.inputs.tsv_file = confounds_file
+    input_node.inputs.confounds_file = confounds_file
 
-    # Expanding Dict using Wildcard node
-    expand_node = pe.Node(
-        Function(
-            input_names=["tsv_file", "scrub_configs"],
-            output_names=["scrub_configs"],
-            function=expand_scrub_dict,
-        ),
-        name="expand_node",
-    )
-
-    # Define the function node
-    scrub_target_node = pe.MapNode(
+    # Expand wildcards, build each column's vector and combine them in one node
+    scrub_vector_node = pe.Node(
         Function(
             input_names=["confounds_file", "scrub_configs"],
             output_names=["scrub_vector"],
-            function=get_scrub_vector_node,
-        ),
-        iterfield=["scrub_configs"],
-        name="get_scrub_vector_map_node",
-    )
-
-    # Create the logical_or_node
-    reduce_node = pe.Node(
-        Function(
-            input_names=["list_of_lists"],
-            output_names=["or_result"],
-            function=logical_or_across_lists,
+            function=get_scrub_vector_from_confounds_node,
         ),
-        name="reduce_node",
+        name="get_scrub_vector",
     )
 
-    # Create a new workflow to hold only the scrub_target_node
     mult_scrub_wf = pe.Workflow(name=name, base_dir=base_dir)
     if crashdump_dir is not None:
         mult_scrub_wf.config["execution"]["crashdump_dir"] = crashdump_dir
 
-    mult_scrub_wf.add_nodes(
-        [input_node, expand_node, scrub_target_node, reduce_node, output_node]
-    )
-
-    mult_scrub_wf.connect(input_node, "tsv_file", expand_node, "tsv_file")
-    mult_scrub_wf.connect(input_node, "scrub_configs", expand_node, "scrub_configs")
-    mult_scrub_wf.connect(
-        expand_node, "scrub_configs", scrub_target_node, "scrub_configs"
-    )
-    mult_scrub_wf.connect(
-        input_node, "confounds_file", scrub_target_node, "confounds_file"
-    )
-
     mult_scrub_wf.connect(
-        scrub_target_node, "scrub_vector", reduce_node, "list_of_lists"
+        input_node, "confounds_file", scrub_vector_node, "confounds_file"
     )
-    mult_scrub_wf.connect(reduce_node, "or_result", output_node, "out_file")
+    mult_scrub_wf.connect(input_node, "scrub_configs", scrub_vector_node, "scrub_configs")
+    mult_scrub_wf.connect(scrub_vector_node, "scrub_vector", output_node, "out_file")
 
     return mult_scrub_wf
@@ -20,6 +20,8 @@ from nipype.interfaces.fsl.maths import (
 )
 from nipype.interfaces.fsl.utils import ImageStats, FilterRegressor
 from nipype.interfaces.afni import TProject
+from nipype.interfaces.afni.base import AFNICommand
+from nipype.interfaces.fsl.base import FSLCommand
 from nipype.interfaces.fsl.model import GLM
 from nipype.interfaces.fsl import SUSAN, FLIRT
 from nipype.interfaces.utility import Function, IdentityInterface
@@ -33,14 +35,33 @@ from .nodes import (
     ButterworthFilter,
     RegressAromaR,
     ImageSlice,
+    FusedImageProcessing,
+    FUSED_BUTTERWORTH,
+    FUSED_TRIM,
+    FUSED_SCRUB,
+    FUSED_MASK,
+    FUSED_REGRESS,
+    RegressConfounds,
 )
 from .utils import (
     scrub_image,
     get_scrub_vector_node,
     vector_to_txt,
     logical_or_across_lists,
+    export_image,
+    FORMAT_NIFTI,
+    FORMAT_NIFTI_GZ,
+    FORMAT_NIFTI_ZST,
+    DEFAULT_REGRESSION_BLOCK_SIZE,
+)
+from .cache import (
+    compute_step_cache_key,
+    find_cached_step_output,
+    normalize_processing_options,
+    store_step_output,
 )
 from ..errors import ImplementationNotFoundError
+from ..utils import parse_memory
 from ..config.options import PostProcessingOptions
 
 # TODO: Set these values up as hierarchical, maybe with enums
@@ -63,6 +84,7 @@ IMPLEMENTATION_FSL_REGFILT_R = "fsl_regfilt_R"
 STEP_CONFOUND_REGRESSION = "ConfoundRegression"
 IMPLEMENTATION_FSL_GLM = "fsl_glm"
 IMPLEMENTATION_AFNI_3DTPROJECT = "afni_3dTproject"
+IMPLEMENTATION_NUMPY_OLS = "numpy_ols"
 
 STEP_APPLY_MASK = "ApplyMask"
 STEP_TRIM_TIMEPOINTS = "TrimTimepoints"
@@ -70,6 +92,8 @@ STEP_RESAMPLE = "Resample"
 
 STEP_SCRUB_TIMEPOINTS = "ScrubTimepoints"
 
+FUSED_WORKFLOW_PREFIX = "Fused"
+
 
 def build_image_postprocessing_workflow(
     processing_options: PostProcessingOptions,
@@ -83,9 +107,17 @@ def build_image_postprocessing_workflow(
     confounds_file: os.PathLike = None,
     tr: float = None,
     scrub_vector: list = None,
+    step_cache_dir: os.PathLike = None,
+    input_digests: dict = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
+    """Chain a workflow for each processing step.
+
+    If step_cache_dir and the input_digests of the image are given, the output of
+    each step is stored in the step cache, and processing starts after the last
+    step whose output is already there.
+    """
     postproc_wf = pe.Workflow(name=name, base_dir=base_dir)
 
     if crashdump_dir is not None:
@@ -100,6 +132,44 @@ def build_image_postprocessing_workflow(
             "The PostProcess workflow requires at least 1 processing step."
         )
 
+    memory_limit = None
+    if processing_options.chunk_memory_limit:
+        memory_limit = parse_memory(processing_options.chunk_memory_limit)
+
+    if processing_options.fused_execution:
+        step_groups = _group_fusable_steps(processing_steps, processing_options)
+    else:
+        step_groups = [[step] for step in processing_steps]
+
+    output_formats = [None] * len(step_groups)
+    if processing_options.intermediate_format:
+        output_formats = [
+            _get_group_output_format(
+                processing_options.intermediate_format,
+                step_groups[index + 1] if index + 1 < len(step_groups) else None,
+                processing_options,
+            )
+            for index in range(len(step_groups))
+        ]
+
+    step_cache_keys = None
+    if step_cache_dir and input_digests:
+        step_cache_keys = _get_step_cache_keys(
+            step_groups, output_formats, processing_options, input_digests, tr
+        )
+
+        # Skip the steps whose output is already cached, starting from the last one
+        for index in reversed(range(len(step_groups))):
+            cached_file = find_cached_step_output(
+                step_cache_dir, step_cache_keys[index]
+            )
+            if cached_file:
+                in_file = str(cached_file)
+                step_groups = step_groups[index + 1 :]
+                output_formats = output_formats[index + 1 :]
+                step_cache_keys = step_cache_keys[index + 1 :]
+                break
+
     input_node = pe.Node(
         IdentityInterface(
             fields=[
@@ -140,11 +210,42 @@ def build_image_postprocessing_workflow(
 
     current_wf = None
     prev_wf = None
+    out_node, out_field = input_node, "in_file"
+
+    # Iterate through groups of processing steps, adding a new sub workflow for each
+    #   group. Outside of fused execution, every group holds a single step.
+    for index, step_group in enumerate(step_groups):
+        step = step_group[0]
+
+        # Run runs of NumPy-based steps in memory, as a single node
+        if len(step_group) > 1:
+            operations = [
+                _get_fused_operation(
+                    group_step, processing_options, tr=tr, mask_file=mask_file
+                )
+                for group_step in step_group
+            ]
+            current_wf = build_fused_workflow(
+                operations,
+                name=f"{FUSED_WORKFLOW_PREFIX}_{'_'.join(step_group)}",
+                mask_file=mask_file,
+                base_dir=postproc_wf.base_dir,
+                crashdump_dir=crashdump_dir,
+            )
+            if STEP_SCRUB_TIMEPOINTS in step_group:
+                postproc_wf.connect(
+                    input_node, "scrub_vector", current_wf, "inputnode.scrub_vector"
+                )
+            if STEP_CONFOUND_REGRESSION in step_group:
+                postproc_wf.connect(
+                    input_node,
+                    "confounds_file",
+                    current_wf,
+                    "inputnode.confounds_file",
+                )
 
-    # Iterate through list of processing steps, adding a new sub workflow for each step
-    for index, step in enumerate(processing_steps):
         # Decide which wf to add next
-        if step == STEP_TEMPORAL_FILTERING:
+        elif step == STEP_TEMPORAL_FILTERING:
             if not tr:
                 raise ValueError(f"Missing TR corresponding to image: {in_file}")
             hp = (
@@ -167,6 +268,7 @@ def build_image_postprocessing_workflow(
                 tr=tr,
                 order=order,
                 scrub_targets=None,
+                memory_limit=memory_limit,
                 base_dir=postproc_wf.base_dir,
                 crashdump_dir=crashdump_dir,
             )
@@ -285,6 +387,7 @@ def build_image_postprocessing_workflow(
 
             current_wf = build_scrubbing_workflow(
                 insert_na=insert_na,
+                memory_limit=memory_limit,
                 base_dir=postproc_wf.base_dir,
                 crashdump_dir=crashdump_dir,
             )
@@ -301,22 +404,120 @@ def build_image_postprocessing_workflow(
                 prev_wf, "outputnode.out_file", current_wf, "inputnode.in_file"
             )
 
+        if processing_options.intermediate_format:
+            _set_intermediate_format(
+                current_wf,
+                output_formats[index],
+                processing_options.intermediate_compression_level,
+            )
+
+        if step_cache_keys:
+            store_node = pe.Node(
+                Function(
+                    input_names=["in_file", "step_cache_dir", "key"],
+                    output_names=["out_file"],
+                    function=store_step_output,
+                ),
+                name=f"store_step_cache_{index}",
+            )
+            store_node.inputs.step_cache_dir = str(step_cache_dir)
+            store_node.inputs.key = step_cache_keys[index]
+            postproc_wf.connect(
+                current_wf, "outputnode.out_file", store_node, "in_file"
+            )
+
         # Keep a reference to current_wf as "prev_wf" for the next loop
         prev_wf = current_wf
+        out_node, out_field = current_wf, "outputnode.out_file"
 
-    # Connect the output of the last node to postproc workflow's output node
-    postproc_wf.connect(prev_wf, "outputnode.out_file", output_node, "out_file")
+    # Connect the output of the last node to postproc workflow's output node. If
+    #   every step was cached, this is the cached output.
+    postproc_wf.connect(out_node, out_field, output_node, "out_file")
     if export_path:
-        # TODO: Update the postproc workflow to make extension guarentees
+        # Intermediates may use another format, so the export converts if needed
         export_node = pe.Node(
-            ExportFile(out_file=export_path, clobber=True, check_extension=False),
+            Function(
+                input_names=["in_file", "out_file"],
+                output_names=["out_file"],
+                function=export_image,
+            ),
             name="export_image",
         )
-        postproc_wf.connect(current_wf, "outputnode.out_file", export_node, "in_file")
+        export_node.inputs.out_file = str(export_path)
+        postproc_wf.connect(out_node, out_field, export_node, "in_file")
 
     return postproc_wf
 
 
+def _get_step_cache_keys(
+    step_groups: list,
+    output_formats: list,
+    processing_options: PostProcessingOptions,
+    input_digests: dict,
+    tr: float,
+):
+    """Build the step cache key of each step group's output, from the image's inputs
+    and the configuration of every step up to and including the group."""
+    options = normalize_processing_options(processing_options)
+
+    keys = []
+    steps = []
+    for step_group, output_format in zip(step_groups, output_formats):
+        steps += step_group
+        if STEP_CONFOUND_REGRESSION in steps:
+            # Regression uses confounds processed by all of the stream's steps
+            step_options = options
+        else:
+            step_options = {
+                "processing_steps": list(steps),
+                "processing_step_options": {
+                    step: options["processing_step_options"].get(step)
+                    for step in steps
+                },
+            }
+        keys.append(
+            compute_step_cache_key(input_digests, tr, step_options, output_format)
+        )
+
+    return keys
+
+
+def _get_group_output_format(
+    intermediate_format: str, next_group: list, processing_options
+):
+    """Choose the output format of a step group. zstd images can only be read by
+    NumPy-based steps, so steps feeding FSL or AFNI fall back to uncompressed."""
+    if intermediate_format != FORMAT_NIFTI_ZST or next_group is None:
+        return intermediate_format
+
+    reads_with_nibabel = len(next_group) > 1 or (
+        _is_fusable_step(next_group[0], processing_options)
+        and next_group[0] != STEP_APPLY_MASK
+    )
+    return intermediate_format if reads_with_nibabel else FORMAT_NIFTI
+
+
+def _set_intermediate_format(
+    workflow: pe.Workflow, output_format: str, compression_level: int = None
+):
+    """Set the output file format of every node in a step's workflow.
+
+    FSL and AFNI nodes cannot write zstd images or take a compression level, so
+    they write .nii for the nii.zst format and use their own gzip level.
+    """
+    external_type = "NIFTI_GZ" if output_format == FORMAT_NIFTI_GZ else "NIFTI"
+
+    for node in workflow._get_all_nodes():
+        if isinstance(node.interface, FSLCommand):
+            node.interface.inputs.output_type = external_type
+        elif isinstance(node.interface, AFNICommand):
+            node.interface.inputs.outputtype = external_type
+        elif hasattr(node.inputs, "output_format"):
+            node.inputs.output_format = output_format
+            if compression_level is not None:
+                node.inputs.compression_level = compression_level
+
+
 def build_temporal_filter_workflow(
     implementationName: str,
     hp: float,
@@ -329,6 +530,7 @@ def build_temporal_filter_workflow(
     crashdump_dir: os.PathLike = None,
     scrub_targets: os.PathLike = None,
     mask_file: os.PathLike = None,
+    memory_limit: int = None,
 ):
     if implementationName == IMPLEMENTATION_BUTTERWORTH:
         return build_butterworth_filter_workflow(
@@ -336,6 +538,7 @@ def build_temporal_filter_workflow(
             lp=lp,
             tr=tr,
             order=order,
+            memory_limit=memory_limit,
             base_dir=base_dir,
             crashdump_dir=crashdump_dir,
         )
@@ -365,6 +568,82 @@ def build_temporal_filter_workflow(
         )
 
 
+def _is_fusable_step(step: str, processing_options: PostProcessingOptions):
+    """Whether a step has a NumPy implementation that can run in memory as part of
+    a fused workflow."""
+    if step == STEP_TEMPORAL_FILTERING:
+        return (
+            processing_options.processing_step_options.temporal_filtering.implementation
+            == IMPLEMENTATION_BUTTERWORTH
+        )
+    if step == STEP_CONFOUND_REGRESSION:
+        return (
+            processing_options.processing_step_options.confound_regression.implementation
+            == IMPLEMENTATION_NUMPY_OLS
+        )
+    return step in (STEP_TRIM_TIMEPOINTS, STEP_SCRUB_TIMEPOINTS, STEP_APPLY_MASK)
+
+
+def _group_fusable_steps(processing_steps: list, processing_options):
+    """Group consecutive fusable steps together, leaving every other step in a
+    group of its own."""
+    step_groups = []
+    for step in processing_steps:
+        if (
+            step_groups
+            and _is_fusable_step(step, processing_options)
+            and _is_fusable_step(step_groups[-1][-1], processing_options)
+        ):
+            step_groups[-1].append(step)
+        else:
+            step_groups.append([step])
+
+    return step_groups
+
+
+def _get_fused_operation(
+    step: str,
+    processing_options: PostProcessingOptions,
+    tr: float = None,
+    mask_file: os.PathLike = None,
+):
+    """Build the FusedImageProcessing operation for a fusable step."""
+    step_options = processing_options.processing_step_options
+
+    if step == STEP_TEMPORAL_FILTERING:
+        if not tr:
+            raise ValueError(f"{STEP_TEMPORAL_FILTERING}: Missing TR.")
+        return {
+            "operation": FUSED_BUTTERWORTH,
+            "hp": step_options.temporal_filtering.filtering_high_pass,
+            "lp": step_options.temporal_filtering.filtering_low_pass,
+            "tr": tr,
+            "order": step_options.temporal_filtering.filtering_order,
+        }
+    elif step == STEP_TRIM_TIMEPOINTS:
+        return {
+            "operation": FUSED_TRIM,
+            "trim_from_beginning": step_options.trim_timepoints.from_beginning,
+            "trim_from_end": step_options.trim_timepoints.from_end,
+        }
+    elif step == STEP_SCRUB_TIMEPOINTS:
+        return {
+            "operation": FUSED_SCRUB,
+            "insert_na": step_options.scrub_timepoints.insert_na,
+        }
+    elif step == STEP_APPLY_MASK:
+        if mask_file is None:
+            raise ValueError(f"{STEP_APPLY_MASK}: No mask file provided.")
+        return {"operation": FUSED_MASK}
+    elif step == STEP_CONFOUND_REGRESSION:
+        return {
+            "operation": FUSED_REGRESS,
+            "block_size": DEFAULT_REGRESSION_BLOCK_SIZE,
+        }
+    else:
+        raise ImplementationNotFoundError(f"Step cannot be fused: {step}")
+
+
 def _getIntensityNormalizationImplementation(implementationName: str):
     if implementationName == IMPLEMENTATION_10000_GLOBAL_MEDIAN:
         return build_10000_global_median_workflow
@@ -399,6 +678,8 @@ def _getConfoundRegressionImplementation(implementationName: str):
         return build_confound_regression_fsl_glm_workflow
     elif implementationName == IMPLEMENTATION_AFNI_3DTPROJECT:
         return build_confound_regression_afni_3dTproject
+    elif implementationName == IMPLEMENTATION_NUMPY_OLS:
+        return build_confound_regression_numpy_ols_workflow
     else:
         raise ImplementationNotFoundError(
             f"{STEP_CONFOUND_REGRESSION} implementation not found: {implementationName}"
@@ -650,6 +931,7 @@ def build_butterworth_filter_workflow(
     out_file: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
+    memory_limit: int = None,
 ):
     workflow = pe.Workflow(
         name=f"{STEP_TEMPORAL_FILTERING}_{IMPLEMENTATION_BUTTERWORTH}",
@@ -665,6 +947,8 @@ def build_butterworth_filter_workflow(
     butterworth_node = pe.Node(
         ButterworthFilter(hp=hp, lp=lp, order=order, tr=tr), name="butterworth_filter"
     )
+    if memory_limit:
+        butterworth_node.inputs.memory_limit = memory_limit
 
     # Set WF inputs and outputs
     if in_file:
@@ -927,6 +1211,60 @@ def build_confound_regression_afni_3dTproject(
     return workflow
 
 
+def build_confound_regression_numpy_ols_workflow(
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    block_size: int = DEFAULT_REGRESSION_BLOCK_SIZE,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Builds a confound regression workflow using ordinary least squares in NumPy.
+
+    Like fsl_glm, the design is used as given and the residuals are returned, with
+    voxels outside of the mask set to 0.
+    """
+    workflow = pe.Workflow(
+        name=f"{STEP_CONFOUND_REGRESSION}_{IMPLEMENTATION_NUMPY_OLS}",
+        base_dir=base_dir,
+    )
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=["in_file", "out_file", "confounds_file", "mask_file"],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = build_output_node()
+
+    regressor_node = pe.Node(
+        RegressConfounds(block_size=block_size), name="numpy_ols"
+    )
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+    if confounds_file:
+        input_node.inputs.confounds_file = confounds_file
+
+    workflow.connect(input_node, "in_file", regressor_node, "in_file")
+    workflow.connect(input_node, "out_file", regressor_node, "out_file")
+    workflow.connect(input_node, "confounds_file", regressor_node, "confounds_file")
+    workflow.connect(regressor_node, "out_file", output_node, "out_file")
+
+    if mask_file:
+        input_node.inputs.mask_file = mask_file
+        workflow.connect(input_node, "mask_file", regressor_node, "mask_file")
+
+    return workflow
+
+
 def build_aroma_workflow_fsl_regfilt(
     in_file: os.PathLike = None,
     out_file: os.PathLike = None,
@@ -1120,6 +1458,7 @@ def build_scrubbing_workflow(
     export_path: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
+    memory_limit: int = None,
 ):
     workflow = pe.Workflow(name=STEP_SCRUB_TIMEPOINTS, base_dir=base_dir)
     """ Workflow for scrubbing a target file based on given scrub targets."""
@@ -1139,12 +1478,22 @@ def build_scrubbing_workflow(
 
     scrub_node = pe.Node(
         Function(
-            input_names=["nii_file", "scrub_vector", "insert_na", "export_path"],
+            input_names=[
+                "nii_file",
+                "scrub_vector",
+                "insert_na",
+                "export_path",
+                "output_format",
+                "compression_level",
+                "memory_limit",
+            ],
             output_names=["out_file"],
             function=scrub_image,
         ),
         name="scrub_timepoints",
     )
+    if memory_limit:
+        scrub_node.inputs.memory_limit = memory_limit
 
     # Set WF inputs and outputs
     if import_path:
@@ -1197,6 +1546,76 @@ def build_resample_workflow(
     return workflow
 
 
+def build_fused_workflow(
+    operations: list,
+    name: str = FUSED_WORKFLOW_PREFIX,
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    scrub_vector: list = None,
+    mask_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Builds a workflow running several NumPy-based steps on one in-memory array.
+
+    Args:
+        operations (list): Ordered FusedImageProcessing operations to apply.
+        name (str, optional): Name of the workflow. Defaults to "Fused".
+        in_file (os.PathLike, optional): The input image. Defaults to None.
+        out_file (os.PathLike, optional): An output path for the processed image.
+            Defaults to None.
+        scrub_vector (list, optional): Scrub vector used by a scrub operation.
+            Defaults to None.
+        mask_file (os.PathLike, optional): Mask used by mask and regress operations.
+            Defaults to None.
+        confounds_file (os.PathLike, optional): Confounds used by a regress
+            operation. Defaults to None.
+
+    Returns:
+        pe.Workflow: A fused processing workflow.
+    """
+    workflow = pe.Workflow(name=name, base_dir=base_dir)
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=["in_file", "out_file", "scrub_vector", "mask_file", "confounds_file"],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = build_output_node()
+
+    fused_node = pe.Node(
+        FusedImageProcessing(operations=operations), name="fused_processing"
+    )
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+    if scrub_vector:
+        input_node.inputs.scrub_vector = scrub_vector
+    if mask_file:
+        input_node.inputs.mask_file = mask_file
+        workflow.connect(input_node, "mask_file", fused_node, "mask_file")
+    if confounds_file:
+        input_node.inputs.confounds_file = confounds_file
+
+    workflow.connect(input_node, "in_file", fused_node, "in_file")
+    workflow.connect(input_node, "out_file", fused_node, "out_file")
+    if any(operation["operation"] == FUSED_SCRUB for operation in operations):
+        workflow.connect(input_node, "scrub_vector", fused_node, "scrub_vector")
+    if any(operation["operation"] == FUSED_REGRESS for operation in operations):
+        workflow.connect(input_node, "confounds_file", fused_node, "confounds_file")
+    workflow.connect(fused_node, "out_file", output_node, "out_file")
+
+    return workflow
+
+
 def _csv_to_list(csv_file):
     # Imports must be in function for running as node
     import numpy as np
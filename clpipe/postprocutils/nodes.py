@@ -1,6 +1,8 @@
 import nibabel as nb
 import numpy as np
+import pandas as pd
 import os
+import time
 
 from nipype.interfaces.base import (
     BaseInterface,
@@ -15,8 +17,49 @@ from nipype.utils.filemanip import split_filename
 import nipype.pipeline.engine as pe
 from nipype.interfaces.utility import IdentityInterface
 from nipype.interfaces.base.traits_extension import isdefined
+from nipype import logging
+
+from clpipe.postprocutils.utils import (
+    apply_filter,
+    butterworth_filter_chunked,
+    calc_filter,
+    get_scrub_targets,
+    trim_data,
+    regress_confounds,
+    MaskedMatrix,
+    save_image,
+    strip_image_extension,
+    INTERMEDIATE_FORMATS,
+    DEFAULT_REGRESSION_BLOCK_SIZE,
+)
+
+iflogger = logging.getLogger("nipype.interface")
+
+
+def _intermediate_format_trait():
+    return traits.Enum(
+        *INTERMEDIATE_FORMATS,
+        desc="File format of the output when out_file is not given.",
+        usedefault=True,
+    )
+
+
+def _compression_level_trait():
+    return traits.Int(
+        desc="gzip or zstd compression level. Defaults to nibabel's level.",
+        mandatory=False,
+    )
+
+
+def _build_out_file(in_file: os.PathLike, suffix: str, output_format: str):
+    _, base, _ = split_filename(in_file)
+    return f"{strip_image_extension(base)}_{suffix}.{output_format}"
+
 
-from clpipe.postprocutils.utils import apply_filter, calc_filter
+def _compression_level(inputs):
+    if isdefined(inputs.compression_level):
+        return inputs.compression_level
+    return None
 
 
 def build_input_node():
@@ -43,6 +86,13 @@ class ButterworthFilterInputSpec(BaseInterfaceInputSpec):
     tr = traits.Float(desc="Repetition time.", mandatory=True)
     order = traits.Float(desc="Order of the filter", mandatory=True)
     out_file = File(mandatory=False)
+    output_format = _intermediate_format_trait()
+    compression_level = _compression_level_trait()
+    memory_limit = traits.Int(
+        desc="If set, filter slabs of voxels in float32, holding about this many "
+        "bytes of image data in memory.",
+        mandatory=False,
+    )
 
 
 class ButterworthFilterOutputSpec(TraitedSpec):
@@ -55,23 +105,35 @@ class ButterworthFilter(BaseInterface):
 
     def _run_interface(self, runtime):
         fname = self.inputs.in_file
-        img = nb.load(fname)
-        data = np.array(img.get_data())
+        if not isdefined(self.inputs.out_file):
+            self.new_file = _build_out_file(
+                fname, "filtered", self.inputs.output_format
+            )
+        else:
+            self.new_file = self.inputs.out_file
 
         filter = calc_filter(
             self.inputs.hp, self.inputs.lp, self.inputs.tr, self.inputs.order
         )
-        filtered_data = apply_filter(filter, data)
 
-        new_img = nb.Nifti1Image(filtered_data, img.affine, img.header)
+        if isdefined(self.inputs.memory_limit):
+            butterworth_filter_chunked(
+                fname,
+                self.new_file,
+                filter,
+                self.inputs.memory_limit,
+                _compression_level(self.inputs),
+            )
+            return runtime
 
-        if not isdefined(self.inputs.out_file):
-            _, base, _ = split_filename(fname)
-            self.new_file = base + "_filtered.nii"
-        else:
-            self.new_file = self.inputs.out_file
+        img = nb.load(fname)
+        data = np.array(img.get_data())
+
+        # Time is the last axis of a 4D image
+        filtered_data = apply_filter(filter, data, axis=-1)
 
-        nb.save(new_img, self.new_file)
+        new_img = nb.Nifti1Image(filtered_data, img.affine, img.header)
+        save_image(new_img, self.new_file, _compression_level(self.inputs))
 
         return runtime
 
@@ -147,6 +209,8 @@ class ImageSliceInputSpec(BaseInterfaceInputSpec):
         default_value=0,
     )
     out_file = File(mandatory=False)
+    output_format = _intermediate_format_trait()
+    compression_level = _compression_level_trait()
 
 
 class ImageSliceOutputSpec(TraitedSpec):
@@ -182,12 +246,211 @@ class ImageSlice(BaseInterface):
             cropped_img = img.slicer[..., start_index:end_index]
 
         if not isdefined(self.inputs.out_file):
-            _, base, _ = split_filename(fname)
-            self.new_file = base + "_sliced.nii"
+            self.new_file = _build_out_file(fname, "sliced", self.inputs.output_format)
+        else:
+            self.new_file = self.inputs.out_file
+
+        save_image(cropped_img, self.new_file, _compression_level(self.inputs))
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+
+        return outputs
+
+
+FUSED_BUTTERWORTH = "butterworth"
+FUSED_TRIM = "trim"
+FUSED_SCRUB = "scrub"
+FUSED_MASK = "mask"
+FUSED_REGRESS = "regress"
+
+
+class FusedImageProcessingInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to be processed", mandatory=False)
+    operations = traits.List(
+        traits.Dict(),
+        desc="Ordered list of operations, each a dict with an 'operation' key "
+        "and that operation's parameters.",
+        mandatory=True,
+    )
+    scrub_vector = traits.List(
+        traits.Int(), desc="Scrub vector, required by the scrub operation."
+    )
+    mask_file = File(exists=True, desc="Mask, required by the mask operation.")
+    confounds_file = File(
+        exists=True, desc="Confounds TSV, required by the regress operation."
+    )
+    out_file = File(mandatory=False)
+    output_format = _intermediate_format_trait()
+    compression_level = _compression_level_trait()
+
+
+class FusedImageProcessingOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Processed image")
+    step_timings = traits.Dict(
+        desc="Wall-clock seconds spent loading, in each operation, and saving."
+    )
+
+
+class FusedImageProcessing(BaseInterface):
+    """Run a sequence of NumPy-based processing steps on a single in-memory
+    array, loading the input image once and writing the result once.
+
+    The image is held as a time by voxel matrix while processing. When the
+    operations zero everything outside of the mask anyway, only the in-mask
+    voxels are held, and the result is scattered back to 4D when saved.
+    """
+
+    input_spec = FusedImageProcessingInputSpec
+    output_spec = FusedImageProcessingOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+        self.step_timings = {}
+
+        start = time.perf_counter()
+        img = nb.load(fname)
+        operation_names = [
+            operation["operation"] for operation in self.inputs.operations
+        ]
+        self.masked = isdefined(self.inputs.mask_file) and (
+            FUSED_MASK in operation_names or FUSED_REGRESS in operation_names
+        )
+        matrix = MaskedMatrix.from_image(
+            fname, self.inputs.mask_file if self.masked else None, dtype=np.float32
+        )
+        data = matrix.data
+        self.step_timings["load"] = time.perf_counter() - start
+
+        # Chained steps round-trip through the input's on-disk type, where NaNs
+        #   become 0 for integer images; match that between operations.
+        #   Confound regression writes float32, as its standalone step does.
+        out_dtype = img.get_data_dtype()
+
+        for index, operation in enumerate(self.inputs.operations):
+            name = operation["operation"]
+            start = time.perf_counter()
+            data = self._apply_operation(name, operation, data)
+            if name == FUSED_REGRESS:
+                out_dtype = np.dtype(np.float32)
+            if name == FUSED_SCRUB and not np.issubdtype(out_dtype, np.floating):
+                data = np.nan_to_num(data, nan=0.0, copy=False)
+            elapsed = time.perf_counter() - start
+            self.step_timings[f"{index}_{name}"] = elapsed
+            iflogger.info(f"Fused operation '{name}' took {elapsed:.3f}s")
+
+        if not isdefined(self.inputs.out_file):
+            self.new_file = _build_out_file(fname, "fused", self.inputs.output_format)
+        else:
+            self.new_file = self.inputs.out_file
+
+        start = time.perf_counter()
+        matrix.data = data
+        out_data = matrix.to_array()
+        new_img = nb.Nifti1Image(out_data, img.affine, img.header)
+        if out_dtype != img.get_data_dtype():
+            new_img.set_data_dtype(out_dtype)
+            new_img.header.set_slope_inter(1, 0)
+        save_image(new_img, self.new_file, _compression_level(self.inputs))
+        self.step_timings["save"] = time.perf_counter() - start
+
+        return runtime
+
+    def _apply_operation(self, name: str, operation: dict, data: np.ndarray):
+        if name == FUSED_BUTTERWORTH:
+            filter = calc_filter(
+                operation["hp"], operation["lp"], operation["tr"], operation["order"]
+            )
+            return apply_filter(filter, data, axis=0)
+        elif name == FUSED_TRIM:
+            return trim_data(
+                data, operation["trim_from_beginning"], operation["trim_from_end"]
+            )
+        elif name == FUSED_SCRUB:
+            scrub_targets = get_scrub_targets(self.inputs.scrub_vector)
+            if operation["insert_na"]:
+                data[scrub_targets, :] = np.nan
+                return data
+            return np.delete(data, scrub_targets, axis=0)
+        elif name == FUSED_MASK:
+            # A masked matrix already holds only the in-mask voxels
+            if self.masked:
+                return data
+            mask = nb.load(self.inputs.mask_file).get_fdata().reshape(-1)
+            return data * mask
+        elif name == FUSED_REGRESS:
+            confounds = pd.read_csv(self.inputs.confounds_file, sep="\t")
+            # With a mask, the matrix holds only in-mask voxels, and the rest are
+            #   zeroed on saving, as with the file based step
+            return regress_confounds(data, confounds, operation["block_size"])
+        else:
+            raise ValueError(f"Unknown fused operation: {name}")
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+        outputs["step_timings"] = self.step_timings
+
+        return outputs
+
+
+class RegressConfoundsInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to be regressed", mandatory=True)
+    confounds_file = File(
+        exists=True, desc="Confounds TSV with a header row", mandatory=True
+    )
+    mask_file = File(
+        exists=True, desc="Only voxels in this mask are regressed", mandatory=False
+    )
+    block_size = traits.Int(
+        DEFAULT_REGRESSION_BLOCK_SIZE,
+        desc="Number of voxels to regress at a time",
+        usedefault=True,
+    )
+    out_file = File(mandatory=False)
+    output_format = _intermediate_format_trait()
+    compression_level = _compression_level_trait()
+
+
+class RegressConfoundsOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Residual image")
+
+
+class RegressConfounds(BaseInterface):
+    """Regress confounds out of an image with ordinary least squares, writing the
+    float32 residuals. Voxels outside of the mask are set to 0."""
+
+    input_spec = RegressConfoundsInputSpec
+    output_spec = RegressConfoundsOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+        img = nb.load(fname)
+        mask_file = None
+        if isdefined(self.inputs.mask_file):
+            mask_file = self.inputs.mask_file
+        matrix = MaskedMatrix.from_image(fname, mask_file, dtype=np.float32)
+
+        confounds = pd.read_csv(self.inputs.confounds_file, sep="\t")
+        matrix.data = regress_confounds(
+            matrix.data, confounds, block_size=self.inputs.block_size
+        )
+
+        new_img = nb.Nifti1Image(matrix.to_array(), img.affine, img.header)
+        new_img.set_data_dtype(np.float32)
+        new_img.header.set_slope_inter(1, 0)
+
+        if not isdefined(self.inputs.out_file):
+            self.new_file = _build_out_file(
+                fname, "regressed", self.inputs.output_format
+            )
         else:
             self.new_file = self.inputs.out_file
 
-        nb.save(cropped_img, self.new_file)
+        save_image(new_img, self.new_file, _compression_level(self.inputs))
 
         return runtime
 
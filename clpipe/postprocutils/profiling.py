@@ -0,0 +1,155 @@
+"""Profile the nodes of postprocessing workflows.
+
+A NodeProfiler, given to a workflow run as its status callback, records each node's
+wall time, CPU time, peak memory and bytes read and written. Peak memory comes
+from nipype's resource monitor, which must be enabled for it to be recorded.
+"""
+
+import json
+import os
+import resource
+import time
+from pathlib import Path
+
+import pandas as pd
+import psutil
+
+PROFILE_DIR_NAME = "profiles"
+"""Where image profiles are saved, within the subject's log folder"""
+PROFILE_SUFFIX = "_profile"
+PROFILE_COLUMNS = [
+    "node",
+    "status",
+    "wall_time",
+    "cpu_time",
+    "peak_rss_gb",
+    "cpu_percent",
+    "bytes_read",
+    "bytes_written",
+]
+
+
+def enable_resource_monitor():
+    """Turn on nipype's resource monitor, recording the peak memory and CPU use
+    of each node's interface."""
+    from nipype import config
+
+    config.enable_resource_monitor()
+
+
+class NodeProfiler:
+    """A nipype status callback recording resource use per node.
+
+    CPU time and bytes read and written are measured for this process and its
+    finished child processes, so are only attributed to the right node while nodes
+    run one at a time, as with the Linear plugin.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._started = {}
+
+    def __call__(self, node, status):
+        if status == "start":
+            self._started[node.fullname] = _sample_usage()
+            return
+
+        start = self._started.pop(node.fullname, None)
+        if start is None:
+            return
+        end = _sample_usage()
+        peak_rss_gb, cpu_percent = _get_monitored_usage(node)
+
+        self.records.append(
+            {
+                # Drop the image's workflow name, so nodes match across images
+                "node": node.fullname.split(".", 1)[-1],
+                "status": status,
+                "wall_time": end["wall_time"] - start["wall_time"],
+                "cpu_time": end["cpu_time"] - start["cpu_time"],
+                "peak_rss_gb": peak_rss_gb,
+                "cpu_percent": cpu_percent,
+                "bytes_read": end["bytes_read"] - start["bytes_read"],
+                "bytes_written": end["bytes_written"] - start["bytes_written"],
+            }
+        )
+
+
+def _sample_usage() -> dict:
+    cpu_time = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        cpu_time += usage.ru_utime + usage.ru_stime
+
+    io = psutil.Process().io_counters()
+    return {
+        "wall_time": time.time(),
+        "cpu_time": cpu_time,
+        # Characters count all reads and writes, including those from cache
+        "bytes_read": getattr(io, "read_chars", io.read_bytes),
+        "bytes_written": getattr(io, "write_chars", io.write_bytes),
+    }
+
+
+def _get_monitored_usage(node):
+    """Get the peak memory and CPU use the resource monitor recorded for a node,
+    taking the largest across a MapNode's runs."""
+    try:
+        runtimes = node.result.runtime
+    except Exception:
+        return None, None
+    if not isinstance(runtimes, list):
+        runtimes = [runtimes]
+
+    peaks = [getattr(runtime, "mem_peak_gb", None) for runtime in runtimes]
+    cpus = [getattr(runtime, "cpu_percent", None) for runtime in runtimes]
+    peaks = [peak for peak in peaks if peak is not None]
+    cpus = [cpu for cpu in cpus if cpu is not None]
+    return (max(peaks) if peaks else None, max(cpus) if cpus else None)
+
+
+def write_profile(records: list, profile_dir: os.PathLike, image_name: str):
+    """Save an image's node profile as JSON and TSV, returning their paths."""
+    profile_dir = Path(profile_dir)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+
+    json_path = profile_dir / f"{image_name}{PROFILE_SUFFIX}.json"
+    with open(json_path, "w") as f:
+        json.dump({"image": image_name, "nodes": records}, f, indent=4)
+
+    tsv_path = profile_dir / f"{image_name}{PROFILE_SUFFIX}.tsv"
+    pd.DataFrame(records, columns=PROFILE_COLUMNS).to_csv(
+        tsv_path, sep="\t", index=False
+    )
+
+    return json_path, tsv_path
+
+
+def load_profiles(log_dir: os.PathLike) -> pd.DataFrame:
+    """Load every image profile saved under a log directory."""
+    profiles = []
+    for tsv_path in sorted(Path(log_dir).rglob(f"*{PROFILE_SUFFIX}.tsv")):
+        profile = pd.read_csv(tsv_path, sep="\t")
+        profile.insert(0, "image", tsv_path.name[: -len(f"{PROFILE_SUFFIX}.tsv")])
+        profiles.append(profile)
+
+    if not profiles:
+        return pd.DataFrame(columns=["image"] + PROFILE_COLUMNS)
+    return pd.concat(profiles, ignore_index=True)
+
+
+def summarize_profiles(profiles: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate node profiles across images, with the nodes taking the most total
+    time first."""
+    summary = profiles.groupby("node").agg(
+        images=("image", "nunique"),
+        wall_time_total=("wall_time", "sum"),
+        wall_time_mean=("wall_time", "mean"),
+        wall_time_max=("wall_time", "max"),
+        cpu_time_mean=("cpu_time", "mean"),
+        peak_rss_gb_mean=("peak_rss_gb", "mean"),
+        peak_rss_gb_max=("peak_rss_gb", "max"),
+        bytes_read_mean=("bytes_read", "mean"),
+        bytes_written_mean=("bytes_written", "mean"),
+    )
+    return summary.sort_values("wall_time_total", ascending=False).reset_index()
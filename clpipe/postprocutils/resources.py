@@ -0,0 +1,255 @@
+"""Estimate the memory and time each postprocessing image job needs.
+
+A static model sizes a job from its image's shape and data type and the steps run
+on it. Once enough jobs with the same steps have finished, the model is corrected
+by the largest ratio of used to predicted resources among the recent jobs,
+recorded in a resource history file.
+"""
+
+import csv
+import fcntl
+import os
+import resource
+import threading
+import time
+from pathlib import Path
+
+import nibabel as nib
+import psutil
+
+from ..utils import format_memory, format_time
+from .image_workflows import (
+    STEP_AROMA_REGRESSION,
+    STEP_CONFOUND_REGRESSION,
+    STEP_RESAMPLE,
+    STEP_SPATIAL_SMOOTHING,
+    STEP_TEMPORAL_FILTERING,
+)
+
+HISTORY_COLUMNS = [
+    "finished",
+    "image_file",
+    "processing_steps",
+    "voxels",
+    "volumes",
+    "itemsize",
+    "predicted_memory",
+    "predicted_time",
+    "peak_memory",
+    "elapsed_time",
+]
+HISTORY_WINDOW = 20
+"""How many of the most recent jobs with the same steps to learn from"""
+MIN_HISTORY = 3
+"""How many finished jobs with the same steps are needed before learning from them"""
+MEMORY_SAMPLE_INTERVAL = 1.0
+"""Seconds between samples of the memory used by a job's processes"""
+
+BASE_MEMORY = 512 * 1024**2
+"""Bytes used by the job's interpreter and nipype, whatever the image"""
+BASE_TIME = 300
+"""Seconds of job overhead, whatever the image"""
+WORKING_ITEMSIZE = 8
+"""Steps working on image data in memory do so as float64"""
+DEFAULT_STEP_COPIES = 2
+STEP_COPIES = {
+    STEP_CONFOUND_REGRESSION: 3,
+    STEP_AROMA_REGRESSION: 3,
+    STEP_TEMPORAL_FILTERING: 3,
+}
+"""The most full copies of the image data a step holds at once"""
+DEFAULT_STEP_SECONDS = 400
+STEP_SECONDS = {
+    STEP_SPATIAL_SMOOTHING: 1200,
+    STEP_AROMA_REGRESSION: 1800,
+    STEP_CONFOUND_REGRESSION: 900,
+    STEP_RESAMPLE: 900,
+}
+"""Seconds a step takes per billion voxel timepoints"""
+MIN_TIME = 600
+
+
+def get_image_dimensions(image_file: os.PathLike) -> dict:
+    """Read an image's voxel count, volume count and data item size from its
+    header, without loading its data."""
+    image = nib.load(str(image_file))
+    shape = image.shape
+    voxels = 1
+    for size in shape[:3]:
+        voxels *= size
+    return {
+        "voxels": voxels,
+        "volumes": shape[3] if len(shape) > 3 else 1,
+        "itemsize": image.get_data_dtype().itemsize,
+    }
+
+
+def predict_resources(dimensions: dict, processing_steps: list) -> dict:
+    """Predict a job's peak memory, in bytes, and time, in seconds, with the
+    static model."""
+    elements = dimensions["voxels"] * dimensions["volumes"]
+    copies = max(
+        [STEP_COPIES.get(step, DEFAULT_STEP_COPIES) for step in processing_steps]
+        or [DEFAULT_STEP_COPIES]
+    )
+    step_seconds = sum(
+        STEP_SECONDS.get(step, DEFAULT_STEP_SECONDS) for step in processing_steps
+    )
+
+    return {
+        "memory": BASE_MEMORY
+        + elements * dimensions["itemsize"]
+        + elements * WORKING_ITEMSIZE * copies,
+        "time": BASE_TIME + elements / 1e9 * step_seconds,
+    }
+
+
+def load_resource_history(history_file: os.PathLike, processing_steps: list) -> list:
+    """Load the most recent records of finished jobs with the given steps."""
+    if not Path(history_file).exists():
+        return []
+
+    steps_key = ",".join(processing_steps)
+    with open(history_file, newline="") as f:
+        records = [
+            record
+            for record in csv.DictReader(f, delimiter="\t")
+            if record["processing_steps"] == steps_key
+        ]
+    return records[-HISTORY_WINDOW:]
+
+
+def get_history_corrections(records: list) -> dict:
+    """Find the largest ratios of used to predicted memory and time among the
+    records, or no correction if there are too few records."""
+    if len(records) < MIN_HISTORY:
+        return {"memory": 1.0, "time": 1.0}
+
+    return {
+        "memory": max(
+            float(record["peak_memory"]) / float(record["predicted_memory"])
+            for record in records
+        ),
+        "time": max(
+            float(record["elapsed_time"]) / float(record["predicted_time"])
+            for record in records
+        ),
+    }
+
+
+def estimate_job_resources(
+    image_file: os.PathLike,
+    processing_steps: list,
+    history_file: os.PathLike = None,
+    margin: float = 1.2,
+    memory_like: str = "1G",
+) -> dict:
+    """Estimate the memory and time to request for an image's job, as scheduler
+    style strings in the unit of memory_like, with margin to spare.
+
+    Returns:
+        dict: The job's "mem_use" and "time".
+    """
+    prediction = predict_resources(get_image_dimensions(image_file), processing_steps)
+    corrections = get_history_corrections(
+        load_resource_history(history_file, processing_steps) if history_file else []
+    )
+
+    memory = prediction["memory"] * corrections["memory"] * margin
+    seconds = max(MIN_TIME, prediction["time"] * corrections["time"] * margin)
+    return {
+        "mem_use": format_memory(memory, like=memory_like),
+        "time": format_time(seconds),
+    }
+
+
+def get_peak_memory() -> int:
+    """The peak resident memory, in bytes, of this process or of its largest
+    finished child process. Children running at once are not added together, so
+    this is only a lower bound for jobs running nodes in parallel."""
+    peak_kilobytes = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak_kilobytes * 1024
+
+
+class ProcessTreeMemoryMonitor:
+    """Sample the total resident memory of this process and all of its children in
+    a background thread, keeping the peak.
+
+    Unlike get_peak_memory, this adds up workers running at once, as nipype's
+    MultiProc plugin runs them, though processes shorter than the sampling
+    interval may be missed.
+    """
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_memory = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def sample(self) -> int:
+        """Measure the process tree's resident memory, in bytes, updating the
+        peak."""
+        process = psutil.Process()
+        total = 0
+        for member in [process] + process.children(recursive=True):
+            try:
+                total += member.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        self.peak_memory = max(self.peak_memory, total)
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+
+def record_job_resources(
+    history_file: os.PathLike,
+    image_file: os.PathLike,
+    processing_steps: list,
+    elapsed_time: float,
+    peak_memory: int = None,
+):
+    """Append the resources an image's job used to the resource history."""
+    dimensions = get_image_dimensions(image_file)
+    prediction = predict_resources(dimensions, processing_steps)
+    record = {
+        "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "image_file": str(image_file),
+        "processing_steps": ",".join(processing_steps),
+        **dimensions,
+        "predicted_memory": int(prediction["memory"]),
+        "predicted_time": round(prediction["time"]),
+        "peak_memory": peak_memory if peak_memory else get_peak_memory(),
+        "elapsed_time": round(elapsed_time),
+    }
+
+    # Concurrent jobs append to the same history, so each holds a lock on it
+    #   while writing, keeping rows whole and the header written once
+    with open(history_file, "a", newline="") as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0, os.SEEK_END)
+            writer = csv.DictWriter(f, fieldnames=HISTORY_COLUMNS, delimiter="\t")
+            if f.tell() == 0:
+                writer.writeheader()
+            writer.writerow(record)
+            f.flush()
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
@@ -1,72 +1,76 @@
 import numpy
 import math
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 
-def spec_inter(arr, tr, ofreq, scrub_mask, hifreq, binSize):
+def spec_inter(arr, tr, ofreq, scrub_mask, hifreq, binSize, n_threads=None):
+    """Replace scrubbed timepoints with a spectral (Lomb-Scargle) interpolation
+    fit to the good timepoints of each voxel.
+
+    Args:
+        arr (np.ndarray): The time by voxel matrix.
+        tr (float): Repetition time.
+        ofreq (int): Oversampling frequency.
+        scrub_mask (list): 1 for timepoints to interpolate, 0 otherwise.
+        hifreq (float): Fraction of the frequencies up to Nyquist to sample.
+        binSize (int): Number of voxels to interpolate at a time.
+        n_threads (int, optional): Number of threads interpolating bins at once.
+            Defaults to the ThreadPoolExecutor default.
+
+    Returns:
+        np.ndarray: A copy of arr with the scrubbed timepoints interpolated.
+    """
     scrub_mask = numpy.asarray(scrub_mask)
-    goodtpindex = numpy.asarray([[i for i, e in enumerate(scrub_mask) if e == 0]])
-    badtpindex = numpy.asarray([[i for i, e in enumerate(scrub_mask) if e == 1]])
+    goodtpindex = numpy.flatnonzero(scrub_mask == 0)
+    badtpindex = numpy.flatnonzero(scrub_mask == 1)
     tobs_good = (goodtpindex + 1) * tr
     timespan = tobs_good.max() - tobs_good.min()
     tpobs_all = numpy.arange(tr, tr * float(scrub_mask.shape[0] + 1), tr)
     freq = numpy.arange(
         1 / (timespan * ofreq),
-        hifreq * tobs_good.shape[1] / (2 * timespan) + 1 / (timespan * ofreq),
+        hifreq * tobs_good.shape[0] / (2 * timespan) + 1 / (timespan * ofreq),
         1 / (timespan * ofreq),
-    )[numpy.newaxis]
+    )
     freqang = 2.0 * math.pi * freq
     offsets = numpy.arctan2(
-        numpy.sin(numpy.matmul(numpy.transpose(2 * freqang), tobs_good)).sum(1),
-        numpy.cos(numpy.matmul(numpy.transpose(2 * freqang), tobs_good)).sum(1),
+        numpy.sin(numpy.outer(2 * freqang, tobs_good)).sum(1),
+        numpy.cos(numpy.outer(2 * freqang, tobs_good)).sum(1),
     ) / (2 * freqang)
-    costerm = numpy.cos(
-        numpy.matmul(numpy.transpose(freqang), tobs_good) - (offsets * freqang).T
-    )
-    sinterm = numpy.sin(
-        numpy.matmul(numpy.transpose(freqang), tobs_good) - (offsets * freqang).T
-    )
+
+    # The trig basis depends only on the timing, so build it once for all bins
+    phase = numpy.outer(freqang, tobs_good) - (offsets * freqang)[:, numpy.newaxis]
+    costerm = numpy.cos(phase)
+    sinterm = numpy.sin(phase)
+    cos_dem = (costerm**2).sum(axis=1)[:, numpy.newaxis]
+    sin_dem = (sinterm**2).sum(axis=1)[:, numpy.newaxis]
+    freqRep = numpy.outer(tpobs_all, freqang)
+    sin_t = numpy.sin(freqRep)
+    cos_t = numpy.cos(freqRep)
+
+    gooddata = arr[goodtpindex, :]
     totbins = math.ceil(float(arr.shape[1]) / float(binSize))
-    binnedRecon = []
-    for bin in range(0, totbins):
+    recon = numpy.empty((tpobs_all.shape[0], arr.shape[1]))
+
+    def reconstruct_bin(bin):
         logging.debug("Bin " + str(bin) + " out of " + str(totbins))
-        binVox = numpy.arange(bin * binSize, (bin + 1) * binSize, 1)
-        binVox = numpy.delete(
-            binVox, [i for i, e in enumerate(binVox) if e >= arr.shape[1]]
-        )
-        gooddata = arr[goodtpindex.T, binVox]
-        cosMultTemp = [
-            numpy.matmul(costerm[:, i][numpy.newaxis].T, gooddata[i, :][numpy.newaxis])
-            for i in range(0, tobs_good.shape[1])
-        ]
-        cosmult = numpy.dstack(cosMultTemp)
-        num = cosmult.sum(axis=2)
-        dem = (numpy.power(costerm, 2)).sum(axis=1)[numpy.newaxis].T
-        cosine = num / dem
-        sinMultTemp = [
-            numpy.matmul(sinterm[:, i][numpy.newaxis].T, gooddata[i, :][numpy.newaxis])
-            for i in range(0, tobs_good.shape[1])
-        ]
-        sinmult = numpy.dstack(sinMultTemp)
-        num = sinmult.sum(axis=2)
-        dem = (numpy.power(sinterm, 2)).sum(axis=1)[numpy.newaxis].T
-        sine = num / dem
-        freqRep = numpy.dstack([freqang * tp for tp in tpobs_all])[0, :, :].T
-        sin_t = numpy.sin(freqRep)
-        cos_t = numpy.cos(freqRep)
-        S = numpy.matmul(sin_t, sine)
-        C = numpy.matmul(cos_t, cosine)
-        temp = C + S
-        binnedRecon.append(temp)
-    recon = numpy.hstack(binnedRecon)
+        binVox = slice(bin * binSize, (bin + 1) * binSize)
+        cosine = numpy.matmul(costerm, gooddata[:, binVox]) / cos_dem
+        sine = numpy.matmul(sinterm, gooddata[:, binVox]) / sin_dem
+        recon[:, binVox] = numpy.matmul(cos_t, cosine) + numpy.matmul(sin_t, sine)
+
+    # matmul releases the GIL, so bins can be reconstructed concurrently
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(reconstruct_bin, range(0, totbins)))
+
     recon_std = numpy.std(recon, 0, ddof=1)
-    data_std = numpy.std(arr[goodtpindex, :], 1, ddof=1)
+    data_std = numpy.std(gooddata, 0, ddof=1)
     data_std[data_std == 0] = -1
     with numpy.errstate(divide="ignore", invalid="ignore"):
         cor_factor = recon_std / data_std
         recon = recon / cor_factor
     numpy.nan_to_num(recon, copy=False)
     corr_arr = numpy.copy(arr)
-    if badtpindex.shape[1] != 0:
+    if badtpindex.shape[0] != 0:
         corr_arr[badtpindex, :] = recon[badtpindex, :]
     return corr_arr
@@ -8,6 +8,13 @@ from typing import List
 
 DEFAULT_GRAPH_STYLE = "colored"
 
+FORMAT_NIFTI = "nii"
+FORMAT_NIFTI_GZ = "nii.gz"
+FORMAT_NIFTI_ZST = "nii.zst"
+INTERMEDIATE_FORMATS = (FORMAT_NIFTI, FORMAT_NIFTI_GZ, FORMAT_NIFTI_ZST)
+
+DEFAULT_REGRESSION_BLOCK_SIZE = 20000
+
 
 def find_sub_list(sl, l):
     results = []
@@ -23,6 +30,12 @@ def get_scrub_vector(fdts, fd_thres=0.3, fd_behind=1, fd_ahead=1, fd_contig=3):
     """Given a vector of timepoints for scrubbing, create a list of indexes representing
     scrub targets based given behind, ahead, and contigous selections.
 
+    Each timepoint exceeding the threshold marks a window of timepoints for scrubbing.
+    The window reaches fd_behind * (fd_behind + 1) / 2 timepoints behind and
+    fd_ahead * (fd_ahead + 1) / 2 timepoints ahead, matching the original
+    list-based implementation, which compounded its offsets. Runs of unscrubbed
+    timepoints shorter than fd_contig are then scrubbed too.
+
     Args:
         fdts (_type_): the input vector, a timeseries to scrub
         fd_thres (float, optional): the cutoff threshold for inclusion
@@ -33,44 +46,88 @@ def get_scrub_vector(fdts, fd_thres=0.3, fd_behind=1, fd_ahead=1, fd_contig=3):
     Returns:
         _type_: the fully prepared scrub target vector
     """
-    import numpy
+    import numpy as np
 
-    # index all timepoints that exceed the threshold as the base scrub targets
-    scrubTargets = [i for i, e in enumerate(fdts) if e > fd_thres]
-
-    # Generate scrub indexes behind the base targets
-    for t in numpy.arange(0, fd_behind + 1):
-        scrubTargetsAdd = scrubTargets - t
-        scrubTargets.extend(scrubTargetsAdd)
-
-    # Generate scrub indexes ahead of the base targets
-    for t in numpy.arange(0, fd_ahead + 1):
-        scrubTargetsAdd = scrubTargets + t
-        scrubTargets.extend(scrubTargetsAdd)
-
-    # Remove duplicates by converting to a set temporarily
-    scrubTargets = list(set(scrubTargets))
-    # Remove negatives
-    scrubTargets = [e for i, e in enumerate(scrubTargets) if e >= 0]
-    # Remove items outside the bounds of the original set of indexes
-    scrubTargets = [e for i, e in enumerate(scrubTargets) if e <= len(fdts) - 1]
-    # Convert to a set again
-    # TODO: is this necessary? Duplicates already removed above
-    scrubTargets = set(scrubTargets)
-    # Create a vector of 0s representing points not to scrub
-    scrubVect = [0] * len(fdts)
-    # Populate the 0 vector with 1s representing scrub targets
-    scrubVect = [1 if i in scrubTargets else 0 for i, e in enumerate(scrubVect)]
-
-    # Ensure fd_config number of consecutive points
+    fdts = np.asarray(fdts, dtype=float)
+    n_timepoints = len(fdts)
+
+    # Index all timepoints that exceed the threshold as the base scrub targets
+    with np.errstate(invalid="ignore"):
+        base_targets = (fdts > fd_thres).astype(int)
+
+    fd_behind = max(int(fd_behind), 0)
+    fd_ahead = max(int(fd_ahead), 0)
+    reach_behind = fd_behind * (fd_behind + 1) // 2
+    reach_ahead = fd_ahead * (fd_ahead + 1) // 2
+
+    # Timepoint j is scrubbed if any base target lies in [j - ahead, j + behind]
+    cumulative_targets = np.concatenate(([0], np.cumsum(base_targets)))
+    indexes = np.arange(n_timepoints)
+    window_start = np.clip(indexes - reach_ahead, 0, n_timepoints)
+    window_end = np.clip(indexes + reach_behind + 1, 0, n_timepoints)
+    scrub_vector = (
+        cumulative_targets[window_end] - cumulative_targets[window_start] > 0
+    ).astype(int)
+
+    # Ensure fd_contig number of consecutive points
     if fd_contig > 0:
-        target = [0] * fd_contig
-        contigSets = find_sub_list(target, scrubVect)
-        scrubVectTemp = [1] * len(fdts)
-        for conSet in contigSets:
-            scrubVectTemp[conSet[0] : conSet[1]] = target
-        scrubVect = scrubVectTemp
-    return scrubVect
+        # Find the runs of unscrubbed timepoints
+        edges = np.diff(np.concatenate(([0], scrub_vector == 0, [0])).astype(int))
+        run_starts = np.flatnonzero(edges == 1)
+        run_ends = np.flatnonzero(edges == -1)
+        long_runs = (run_ends - run_starts) >= fd_contig
+
+        # Only runs of at least fd_contig timepoints stay unscrubbed
+        run_markers = np.zeros(n_timepoints + 1, dtype=int)
+        np.add.at(run_markers, run_starts[long_runs], 1)
+        np.add.at(run_markers, run_ends[long_runs], -1)
+        scrub_vector = (np.cumsum(run_markers)[:-1] == 0).astype(int)
+
+    return scrub_vector.tolist()
+
+
+def get_scrub_vector_from_confounds(confounds, scrub_configs):
+    """Build a single scrub vector from a confounds table and a list of scrub
+    column definitions.
+
+    Wildcard target variables are expanded against the table's columns, a scrub
+    vector is built for each column, and the vectors are combined with a logical OR.
+
+    Args:
+        confounds (pd.DataFrame): The confounds timeseries table.
+        scrub_configs (list): ScrubColumn options, or their dictionary forms.
+
+    Returns:
+        list: The combined scrub vector.
+    """
+    import fnmatch
+    import numpy as np
+    from clpipe.postprocutils.utils import get_scrub_vector
+
+    combined = np.zeros(len(confounds), dtype=bool)
+    for scrub_config in scrub_configs:
+        if not isinstance(scrub_config, dict):
+            scrub_config = scrub_config.to_dict()
+
+        target_variable = scrub_config["target_variable"]
+        if "*" in target_variable:
+            columns = fnmatch.filter(confounds.columns, target_variable)
+        else:
+            columns = [target_variable]
+
+        for column in columns:
+            combined |= np.array(
+                get_scrub_vector(
+                    confounds[column],
+                    scrub_config["threshold"],
+                    scrub_config["scrub_behind"],
+                    scrub_config["scrub_ahead"],
+                    scrub_config["scrub_contiguous"],
+                ),
+                dtype=bool,
+            )
+
+    return combined.astype(int).tolist()
 
 
 def get_scrub_vector_node(confounds_file, scrub_configs):
@@ -92,6 +149,17 @@ def get_scrub_vector_node(confounds_file, scrub_configs):
     return scrub_vector
 
 
+def get_scrub_vector_from_confounds_node(confounds_file, scrub_configs):
+    """Wrapper for call to get_scrub_vector_from_confounds, reading the confounds
+    file."""
+    import pandas as pd
+    from clpipe.postprocutils.utils import get_scrub_vector_from_confounds
+
+    confounds_df = pd.read_csv(confounds_file, sep="\t")
+
+    return get_scrub_vector_from_confounds(confounds_df, scrub_configs)
+
+
 def get_scrub_targets(scrub_vector: list):
     """Given a scrubbing vector of 1s and 0s, convert this into a list of indexes."""
 
@@ -106,13 +174,51 @@ def scrub_data(data, fdts):
     return data
 
 
-def scrub_image(nii_file, scrub_vector, insert_na=True, export_path=None):
-    """Scrub the targets from the given image."""
+def scrub_image(
+    nii_file,
+    scrub_vector,
+    insert_na=True,
+    export_path=None,
+    output_format=None,
+    compression_level=None,
+    memory_limit=None,
+):
+    """Scrub the targets from the given image. If memory_limit (bytes) is given,
+    scrub in float32 blocks of volumes to stay under it."""
     import nibabel as nib
     import numpy as np
     from pathlib import Path
 
-    from clpipe.postprocutils.utils import get_scrub_targets
+    from clpipe.postprocutils.utils import (
+        get_scrub_targets,
+        save_image,
+        strip_image_extension,
+        scrub_image_chunked,
+    )
+
+    out_path = export_path
+    if export_path is None and output_format:
+        path_stem = strip_image_extension(Path(nii_file).name)
+        out_path = str(Path(f"{path_stem}_scrubbed.{output_format}").absolute())
+    elif export_path is None:
+        # Crude way to figure out .nii vs .nii.gz
+        path_stem = Path(nii_file).stem
+        if path_stem[-4:] == ".nii":
+            path_stem = Path(path_stem).stem
+            out_path = Path(path_stem + "_scrubbed.nii.gz")
+        else:
+            out_path = Path(path_stem + "_scrubbed.nii")
+        out_path = str(out_path.absolute())
+
+    if memory_limit:
+        return scrub_image_chunked(
+            nii_file,
+            scrub_vector,
+            out_path,
+            memory_limit,
+            insert_na=insert_na,
+            compression_level=compression_level,
+        )
 
     image = nib.load(nii_file)
     data = image.get_fdata()
@@ -144,24 +250,277 @@ def scrub_image(nii_file, scrub_vector, insert_na=True, export_path=None):
     data = np.transpose(data)
     data = data.reshape(new_shape)
 
-    if export_path is None:
-        # Crude way to figure out .nii vs .nii.gz
-        path_stem = Path(nii_file).stem
-        if path_stem[-4:] == ".nii":
-            path_stem = Path(path_stem).stem
-            out_path = Path(path_stem + "_scrubbed.nii.gz")
-        else:
-            out_path = Path(path_stem + "_scrubbed.nii")
-        out_path = str(out_path.absolute())
-    else:
-        out_path = export_path
-
     out_image = nib.Nifti1Image(data, affine, header)
-    nib.save(out_image, out_path)
+    save_image(out_image, out_path, compression_level)
+
+    return out_path
+
+
+def strip_image_extension(file_name: str):
+    """Remove a .nii, .nii.gz or .nii.zst extension from a file name."""
+    for extension in (".nii.gz", ".nii.zst", ".nii"):
+        if file_name.endswith(extension):
+            return file_name[: -len(extension)]
+    return file_name
+
+
+def _get_opener_kwargs(out_file, compression_level=None) -> dict:
+    """Get the options giving an image file's opener the gzip or zstd compression
+    level, so the level applies to that file alone rather than through nibabel's
+    class-wide defaults."""
+    out_file = str(out_file)
+    if compression_level is None:
+        return {}
+    if out_file.endswith(".zst"):
+        return {"level_or_option": compression_level}
+    if out_file.endswith((".gz", ".bz2")):
+        return {"compresslevel": compression_level}
+    return {}
+
+
+def _open_image_for_writing(out_file, compression_level=None):
+    from nibabel.openers import ImageOpener
+
+    return ImageOpener(
+        str(out_file), "wb", **_get_opener_kwargs(out_file, compression_level)
+    )
+
+
+def save_image(image, out_file, compression_level=None):
+    """Save an image with nibabel, optionally overriding the gzip or zstd
+    compression level, which otherwise falls back to nibabel's defaults."""
+    import nibabel as nib
+    from nibabel.fileholders import FileHolder
+    from nibabel.openers import ImageOpener
+
+    if compression_level is None:
+        nib.save(image, out_file)
+        return
+
+    class LeveledFileHolder(FileHolder):
+        """Opens its file with the compression level when nibabel writes it."""
+
+        def get_prepare_fileobj(self, *args, **kwargs):
+            kwargs.update(_get_opener_kwargs(self.filename, compression_level))
+            return ImageOpener(self.filename, *args, **kwargs)
+
+    if len(image.files_types) > 1:
+        image = nib.Nifti1Image.from_image(image)
+    file_map = image.filespec_to_file_map(str(out_file))
+    file_map["image"] = LeveledFileHolder(file_map["image"].filename)
+    image.to_file_map(file_map)
+
+
+def float32_header(header, shape):
+    """Copy a single-file NIfTI header for an unscaled float32 image of the given
+    shape."""
+    import numpy as np
+
+    header = header.copy()
+    header.set_data_dtype(np.float32)
+    header.set_data_shape(shape)
+    header.set_slope_inter(1, 0)
+    header.set_data_offset(header.single_vox_offset + header.extensions.get_sizeondisk())
+
+    return header
+
+
+def write_image_volumes(out_file, header, volume_blocks, compression_level=None):
+    """Write an image from an iterable of 4D blocks of volumes, given in time order,
+    without holding the whole image in memory."""
+    import numpy as np
+    from clpipe.postprocutils.utils import _open_image_for_writing
+
+    dtype = header.get_data_dtype()
+    with _open_image_for_writing(out_file, compression_level) as f:
+        header.write_to(f)
+        f.write(b"\x00" * (header.get_data_offset() - f.tell()))
+        for block in volume_blocks:
+            f.write(np.asarray(block, dtype=dtype).tobytes(order="F"))
+
+
+def read_image_volumes(in_file, volumes_per_block):
+    """Read a single-file NIfTI image's volumes in time order, as float32 blocks of
+    up to volumes_per_block volumes. Yields each block's first volume and the block.
+
+    The data is read once, front to back, so a compressed image is decompressed
+    once, rather than again from its start for each block sliced from its dataobj.
+    """
+    import numpy as np
+    import nibabel as nib
+    from nibabel.openers import ImageOpener
+
+    proxy = nib.load(in_file).dataobj
+    shape = proxy.shape
+    dtype = proxy.dtype
+    volume_bytes = int(np.prod(shape[:-1])) * dtype.itemsize
+
+    with ImageOpener(str(in_file), "rb") as f:
+        f.seek(proxy.offset)
+        for start in range(0, shape[-1], volumes_per_block):
+            n_volumes = min(volumes_per_block, shape[-1] - start)
+            # Decompressing streams may return less than asked for per read
+            buffer = bytearray()
+            while len(buffer) < volume_bytes * n_volumes:
+                chunk = f.read(volume_bytes * n_volumes - len(buffer))
+                if not chunk:
+                    raise EOFError(f"Image data ends early: {in_file}")
+                buffer += chunk
+
+            block = (
+                np.frombuffer(buffer, dtype=dtype)
+                .reshape(shape[:-1] + (n_volumes,), order="F")
+                .astype(np.float32)
+            )
+            if proxy.slope != 1:
+                block *= np.float32(proxy.slope)
+            if proxy.inter != 0:
+                block += np.float32(proxy.inter)
+            yield start, block
+
+
+def butterworth_filter_chunked(
+    in_file, out_file, sos, memory_limit, compression_level=None
+):
+    """Filter an image along time in float32, a slab of slices at a time, keeping
+    roughly memory_limit bytes of image data in memory.
+
+    The result is assembled in an uncompressed memory-mapped file, which is then
+    streamed to out_file if out_file is compressed. Slabs are read from a memory
+    map of uncompressed inputs. Compressed inputs are first decompressed once into
+    the result's file, and filtered there in place.
+    """
+    import os
+    import numpy as np
+    import nibabel as nib
+    from scipy.signal import sosfilt
+    from clpipe.postprocutils.utils import (
+        float32_header,
+        read_image_volumes,
+        write_image_volumes,
+    )
+
+    image = nib.load(in_file)
+    shape = image.shape
+    header = float32_header(image.header, shape)
+
+    # Each slab is held as the input, the filter output and sosfilt's working copy
+    bytes_per_slice = shape[0] * shape[1] * shape[3] * 4 * 3
+    slices_per_chunk = max(1, int(memory_limit // bytes_per_slice))
+
+    out_file = str(out_file)
+    memmap_file = out_file if out_file.endswith(".nii") else f"{out_file}.tmp.nii"
+    with open(memmap_file, "wb") as f:
+        header.write_to(f)
+        f.truncate(header.get_data_offset() + int(np.prod(shape)) * 4)
+    filtered = np.memmap(
+        memmap_file,
+        dtype=header.get_data_dtype(),
+        mode="r+",
+        offset=header.get_data_offset(),
+        shape=shape,
+        order="F",
+    )
+
+    # Reading a slab spans the whole series, which for a compressed input means
+    #   decompressing it from the start for every slab
+    volumes_per_chunk = max(1, slices_per_chunk * shape[3] // shape[2])
+    source = image.dataobj
+    if not str(in_file).endswith(".nii"):
+        for start, block in read_image_volumes(in_file, volumes_per_chunk):
+            filtered[..., start : start + block.shape[-1]] = block
+        source = filtered
+
+    apply_sos = not isinstance(sos, str)
+    if apply_sos:
+        sos = np.asarray(sos, dtype=np.float32)
+    for start in range(0, shape[2], slices_per_chunk):
+        slab = np.asarray(
+            source[:, :, start : start + slices_per_chunk, :], dtype=np.float32
+        )
+        if apply_sos:
+            slab = sosfilt(sos, slab, axis=-1)
+        filtered[:, :, start : start + slices_per_chunk, :] = slab
+    filtered.flush()
+
+    if memmap_file != out_file:
+        write_image_volumes(
+            out_file,
+            header,
+            (
+                filtered[..., start : start + volumes_per_chunk]
+                for start in range(0, shape[3], volumes_per_chunk)
+            ),
+            compression_level,
+        )
+        del filtered
+        os.remove(memmap_file)
+
+    return out_file
+
+
+def scrub_image_chunked(
+    nii_file, scrub_vector, out_path, memory_limit, insert_na=True, compression_level=None
+):
+    """Scrub the targets from an image in float32, streaming blocks of volumes so
+    that roughly memory_limit bytes of image data are held in memory."""
+    import numpy as np
+    import nibabel as nib
+    from clpipe.postprocutils.utils import (
+        float32_header,
+        get_scrub_targets,
+        read_image_volumes,
+        write_image_volumes,
+    )
+
+    image = nib.load(nii_file)
+    n_volumes = image.shape[-1]
+    scrub_targets = set(get_scrub_targets(scrub_vector))
+
+    if insert_na:
+        volumes = list(range(n_volumes))
+    else:
+        volumes = [t for t in range(n_volumes) if t not in scrub_targets]
+
+    # Each block is held as the raw read and its float32 copy
+    bytes_per_volume = int(np.prod(image.shape[:-1])) * 4 * 2
+    volumes_per_chunk = max(1, int(memory_limit // bytes_per_volume))
+
+    # Volumes are read once in order, so compressed inputs are decompressed once
+    def volume_blocks():
+        for start, block in read_image_volumes(nii_file, volumes_per_chunk):
+            block_volumes = range(start, start + block.shape[-1])
+            if insert_na:
+                scrubbed = [i for i, t in enumerate(block_volumes) if t in scrub_targets]
+                block[..., scrubbed] = np.nan
+            else:
+                block = block[..., [t not in scrub_targets for t in block_volumes]]
+            yield block
+
+    header = float32_header(image.header, image.shape[:-1] + (len(volumes),))
+    write_image_volumes(out_path, header, volume_blocks(), compression_level)
 
     return out_path
 
 
+def export_image(in_file, out_file):
+    """Copy an image to its export path, converting it with nibabel when the
+    export path uses a different file format."""
+    import shutil
+    import nibabel as nib
+    from clpipe.postprocutils.utils import strip_image_extension
+
+    in_extension = str(in_file)[len(strip_image_extension(str(in_file))) :]
+    out_extension = str(out_file)[len(strip_image_extension(str(out_file))) :]
+
+    if in_extension == out_extension:
+        shutil.copyfile(in_file, out_file)
+    else:
+        nib.save(nib.load(in_file), out_file)
+
+    return str(out_file)
+
+
 def calc_filter(hp, lp, tr, order):
     from scipy.signal import butter
 
@@ -180,16 +539,28 @@ def calc_filter(hp, lp, tr, order):
     return sos
 
 
-def apply_filter(sos, arr):
+def apply_filter(sos, arr, axis=0):
     from scipy.signal import sosfilt
 
     if sos is "none":
         return arr
     else:
-        toReturn = sosfilt(sos, arr, axis=0)
+        toReturn = sosfilt(sos, arr, axis=axis)
         return toReturn
 
 
+def trim_data(data, trim_from_beginning=0, trim_from_end=0):
+    """Trim timepoints from a time by voxel matrix. Mirrors the slicing done by
+    the ImageSlice node."""
+
+    start_index = trim_from_beginning
+    end_index = trim_from_end * -1
+
+    if end_index == 0:
+        return data[start_index:]
+    return data[start_index:end_index]
+
+
 def regress(pred, target):
     import numpy
 
@@ -201,6 +572,60 @@ def regress(pred, target):
     return toReturn
 
 
+def orthonormal_basis(design):
+    """Factorize a design matrix into an orthonormal basis of its column space.
+
+    Uses an SVD, so rank-deficient designs (e.g. duplicated columns) are handled.
+    """
+    import numpy as np
+
+    if design.size == 0:
+        return np.zeros((design.shape[0], 0))
+
+    u, s, _ = np.linalg.svd(design, full_matrices=False)
+    tolerance = s.max() * max(design.shape) * np.finfo(s.dtype).eps
+    return u[:, s > tolerance]
+
+
+def regress_confounds(data, confounds, block_size=DEFAULT_REGRESSION_BLOCK_SIZE):
+    """Regress confounds out of a time by voxel matrix with ordinary least squares.
+
+    The design is factorized once, then its basis is applied to blocks of voxels in
+    float32. Missing confound values are treated as 0. Timepoints missing for every
+    voxel, such as scrubbed volumes, are left out of the fit and stay missing.
+
+    Args:
+        data (np.ndarray): The time by voxel matrix.
+        confounds (np.ndarray): The time by confound design matrix.
+        block_size (int, optional): Number of voxels to regress at a time.
+
+    Returns:
+        np.ndarray: The float32 residuals.
+    """
+    import numpy as np
+    from clpipe.postprocutils.utils import orthonormal_basis
+
+    design = np.nan_to_num(np.asarray(confounds, dtype=np.float64))
+    data = np.asarray(data, dtype=np.float32)
+    if design.shape[0] != data.shape[0]:
+        raise ValueError(
+            f"Confounds have {design.shape[0]} timepoints, "
+            f"but the image has {data.shape[0]}."
+        )
+
+    valid = ~np.isnan(data).all(axis=1)
+    basis = orthonormal_basis(design[valid]).astype(np.float32)
+
+    residuals = np.full(data.shape, np.nan, dtype=np.float32)
+    for start in range(0, data.shape[1], block_size):
+        block = data[valid, start : start + block_size]
+        residuals[valid, start : start + block_size] = block - basis @ (
+            basis.T @ block
+        )
+
+    return residuals
+
+
 def notch_filter(motion_params, band, tr):
     from scipy.signal import iirnotch, filtfilt
     import numpy
@@ -272,6 +697,79 @@ def plot_image_sample(
     )
 
 
+class MaskedMatrix:
+    """A time by in-mask voxel matrix, along with the mask needed to scatter it
+    back into a 4D array.
+
+    Processing only the voxels in the brain mask saves the compute and memory
+    otherwise spent on the rest of the image's bounding box.
+    """
+
+    def __init__(self, data, mask):
+        self.data = data
+        self.mask = mask
+
+    @classmethod
+    def from_array(cls, array, mask=None):
+        """Gather the in-mask voxels of a 4D array. Without a mask, every voxel is
+        kept."""
+        import numpy as np
+
+        if mask is None:
+            mask = np.ones(array.shape[:-1], dtype=bool)
+        mask = np.asarray(mask, dtype=bool)
+
+        return cls(np.ascontiguousarray(array[mask].T), mask)
+
+    @classmethod
+    def from_image(cls, nii_file, mask_file=None, dtype=None):
+        """Load an image, and optionally a mask, into a masked matrix of dtype.
+
+        With a mask, the in-mask voxels are gathered from the image's stored
+        values before scaling, so the whole image is never held as floats.
+        """
+        import numpy as np
+        import nibabel as nib
+
+        dtype = np.dtype(dtype or np.float64)
+        img = nib.load(nii_file)
+        if mask_file is None or not hasattr(img.dataobj, "get_unscaled"):
+            mask = None
+            if mask_file is not None:
+                mask = nib.load(mask_file).get_fdata() > 0
+            return cls.from_array(img.get_fdata(dtype=dtype), mask)
+
+        mask = nib.load(mask_file).get_fdata() > 0
+        data = np.asanyarray(img.dataobj.get_unscaled())[mask].T.astype(dtype)
+        slope, inter = img.dataobj.slope, img.dataobj.inter
+        if slope != 1:
+            data *= dtype.type(slope)
+        if inter != 0:
+            data += dtype.type(inter)
+
+        return cls(np.ascontiguousarray(data), mask)
+
+    @property
+    def n_voxels(self):
+        return self.data.shape[1]
+
+    def to_array(self, fill_value=0):
+        """Scatter the matrix back into a 4D array, filling voxels outside of the
+        mask. Timepoints missing from every in-mask voxel, such as scrubbed
+        volumes, are marked missing across the whole volume."""
+        import numpy as np
+
+        out = np.full(
+            self.mask.shape + (self.data.shape[0],), fill_value, dtype=self.data.dtype
+        )
+        out[self.mask] = self.data.T
+
+        if np.issubdtype(self.data.dtype, np.floating) and self.n_voxels:
+            out[..., np.isnan(self.data).all(axis=1)] = np.nan
+
+        return out
+
+
 def nii_to_matrix(nii_file, save_df=False):
     """Transform a .nii file to a 2D, time by (x, y, z) matrix."""
     import numpy as np
@@ -1,28 +1,43 @@
+import nibabel as nib
 import numpy as np
-import warnings
-
-with warnings.catch_warnings():
-    warnings.filterwarnings("ignore", category=DeprecationWarning)
-    from nilearn.input_data import NiftiSpheresMasker
-    from nilearn.input_data import NiftiLabelsMasker
-    from nilearn.input_data import NiftiMapsMasker
-    from nilearn.image import concat_imgs
 import os
 
 import click
 import json
-import glob
 import shutil
-from .config.options import ProjectOptions
-from .job_manager import JobManagerFactory
+from .bids import BIDS_INDEX_NAME, get_bids
+from .config.options import DEFAULT_PROCESSING_STREAM, ProjectOptions
+from .job_manager import JobManagerFactory, JobManager, LocalJobManager
 from pkg_resources import resource_stream, resource_filename
 from .errors import MaskFileNotFoundError
+from .roi_outputs import (
+    OUTPUT_EXTENSIONS,
+    check_output_format,
+    consolidate_timeseries,
+    get_image_entities,
+    get_store_path,
+    write_timeseries,
+)
+from .roi_weights import extract_timeseries, get_roi_coverage, load_atlas_weights
 from .utils import get_logger, resolve_fmriprep_dir
 from pathlib import Path
 
 STEP_NAME = "roi_extraction"
 
 
+JOB_GROUPING_ATLAS = "atlas"
+JOB_GROUPING_SUBJECT = "subject"
+JOB_GROUPING_IMAGE = "image"
+JOB_GROUPINGS = [JOB_GROUPING_ATLAS, JOB_GROUPING_SUBJECT, JOB_GROUPING_IMAGE]
+CONSOLIDATE_SUBMISSION_STRING = (
+    "clpipe roi consolidate -config_file={config}{atlas_options} {subjects}"
+)
+MANIFEST_DIR_NAME = "manifests"
+"""Where each subject's images and masks are saved, within the output folder, for
+its jobs to read"""
+BRAIN_MASK_SUFFIXES = ("_desc-brain_mask.nii.gz", "_desc-brain_mask.nii")
+
+
 def fmri_roi_extraction(
     subjects=None,
     config_file=None,
@@ -41,7 +56,30 @@ def fmri_roi_extraction(
     overlap_ok=None,
     debug=False,
     overwrite=False,
+    job_grouping=None,
+    image_files=None,
+    manifest_file=None,
+    index_dir=None,
+    job_manager: JobManager = None,
+    consolidate: bool = None,
 ):
+    """Extract ROI timeseries from postprocessed images.
+
+    By default there is one job per subject and atlas. With a job grouping of
+    "subject" or "image", there is instead one job per subject or image, which
+    loads each image once and extracts every atlas from it. Giving atlas_name
+    always makes one job per subject for that atlas.
+
+    Each subject's images and masks are resolved once, when jobs are set up, and
+    saved to a manifest the jobs read, so jobs don't search the filesystem.
+    Masks are looked up in the pybids index postprocessing built, at index_dir
+    if given, when there is one.
+
+    If job_manager is given, the jobs are added to it for the caller to submit,
+    and each job finds its subject's images and masks when it runs instead.
+    Set consolidate to override whether a job consolidating the subjects' stores
+    is queued after them.
+    """
     config = ProjectOptions.load(config_file)
     config.load_cli_args(
         target_directory=target_dir,
@@ -72,199 +110,488 @@ def fmri_roi_extraction(
 
     if atlas_name is not None:
         atlas_list = [atlas_name]
+        job_grouping = JOB_GROUPING_ATLAS
     else:
         atlas_list = config.roi_extraction.atlases
+    if job_grouping is None:
+        job_grouping = config.roi_extraction.job_grouping
+    if job_grouping not in JOB_GROUPINGS:
+        raise ValueError(
+            f"Unknown ROI extraction job grouping: {job_grouping}. "
+            f"Choose from: {', '.join(JOB_GROUPINGS)}"
+        )
+    logger.debug(f"Job grouping: {job_grouping}")
 
     with resource_stream(__name__, "data/atlasLibrary.json") as at_lib:
         atlas_library = json.load(at_lib)
 
     atlas_names = [atlas["atlas_name"] for atlas in atlas_library["Atlases"]]
     logger.debug(atlas_names)
-    custom_radius = sphere_radius
-    submission_string = (
-        """clpipe roi extract -config_file={config} -atlas_name={atlas} -single"""
-    )
-    submission_string_custom = (
-        "clpipe roi extract -config_file={config} "
-        "-atlas_name={atlas} -custom_atlas={custom_atlas} -custom_label={custom_labels} "
-        "-custom_type={custom_type} -single"
-    )
+    atlases = [
+        _resolve_atlas(
+            cur_atlas,
+            atlas_library,
+            custom_atlas,
+            custom_label,
+            custom_type,
+            sphere_radius,
+            logger,
+        )
+        for cur_atlas in atlas_list
+    ]
 
-    batch_manager = JobManagerFactory.get(
-        batch_config=config.batch_config_path,
-        output_directory=config.roi_extraction.log_directory,
-        mem_use=config.roi_extraction.memory_usage,
-        time=config.roi_extraction.time_usage,
-        threads=config.roi_extraction.n_threads,
-        email=config.email_address
-    )
-    
+    submission_string = "clpipe roi extract -config_file={config}{options} -single"
+    common_options = ""
+    if task is not None:
+        common_options += " -task=" + task
+    if overlap_ok or config.roi_extraction.overlap_ok:
+        common_options += " -overlap_ok"
+        logger.debug("Overlap ok flag set")
+
+    output_format = config.roi_extraction.output_format
+    check_output_format(output_format)
+    if consolidate is None:
+        consolidate = config.roi_extraction.consolidate
+    consolidate = consolidate and not single
+
+    batch_manager = job_manager
+    if batch_manager is None:
+        batch_manager = get_batch_manager(config, debug=debug)
+
+    # Jobs queued with a caller's job manager, as by the pipeline, may be set up
+    #   before postprocessing has made their images, so they find their images
+    #   and masks when they run
+    defer_manifests = job_manager is not None and manifest_file is None
+    if defer_manifests and job_grouping == JOB_GROUPING_IMAGE:
+        logger.info(
+            "Images aren't listed until extraction jobs run, so there is one job "
+            "per subject instead of per image."
+        )
+        job_grouping = JOB_GROUPING_SUBJECT
+
+    # Jobs given a manifest have their images and masks already
+    bids = None
+    if manifest_file is None and not defer_manifests:
+        bids = get_roi_bids_index(config, index_dir=index_dir, logger=logger)
+
+    extraction_jobs = []
     for subject in sublist:
         logger.debug(f"Setting up ROI extraction for subject {subject}")
-        for cur_atlas in atlas_list:
-            custom_flag = False
-            sphere_flag = False
-            if type(cur_atlas) is dict:
-                custom_flag = True
-                atlas_name = cur_atlas["atlas_name"]
-                logger.info(f"Using Custom Dict Atlas: {atlas_name}")
-                custom_atlas = cur_atlas["atlas_file"]
-                logger.debug(custom_atlas)
-                custom_label = cur_atlas["atlas_labels"]
-                logger.debug(custom_label)
-                custom_type = cur_atlas["atlas_type"]
-                logger.debug(custom_type)
-                if "sphere" in custom_type:
-                    logger.debug("Sphere flag: ON")
-                    sphere_flag = True
-                    custom_radius = cur_atlas["radius"]
-                    logger.debug(custom_radius)
-            else:
-                atlas_name = cur_atlas
-            logger.debug(atlas_name)
-            if atlas_name in atlas_names:
-                logger.debug("Found atlas name in library")
-                index = atlas_names.index(atlas_name)
-                atlas_filename = atlas_library["Atlases"][index]["atlas_file"]
-                atlas_labels = atlas_library["Atlases"][index]["atlas_labels"]
-                atlas_type = atlas_library["Atlases"][index]["atlas_type"]
-                if "sphere" in atlas_type:
-                    sphere_flag = True
-            else:
-                logger.debug("Did Not Find Atlas Name in Library")
-                custom_flag = True
-                if any(
-                    [
-                        not os.path.exists(custom_atlas),
-                        not os.path.exists(custom_label),
-                        custom_type not in ["label", "maps", "sphere"],
-                    ]
-                ):
-                    raise ValueError(
-                        "You are attempting to use a custom atlas, but have not "
-                        "specified one or more of the following: \n"
-                        "\t A custom atlas mask file (.nii or .nii.gz)"
-                        "\t A custom atlas label file (a file with information about the atlas)"
-                        "\t A custom atlas type (label, maps or spheres)"
-                    )
-                else:
-                    atlas_filename = custom_atlas
-                    atlas_labels = custom_label
-                    atlas_type = custom_type
-                    if "sphere" in custom_type:
-                        sphere_flag = True
-            if custom_flag:
-                sub_string_temp = submission_string_custom.format(
-                    config=config_path,
-                    atlas=atlas_name,
-                    custom_atlas=atlas_filename,
-                    custom_labels=atlas_labels,
-                    custom_type=atlas_type,
-                )
+        if defer_manifests:
+            targets = None
+            subject_options = ""
+        else:
+            if manifest_file is not None:
+                targets = load_roi_manifest(manifest_file)
             else:
-                sub_string_temp = submission_string.format(
-                    config=config_path,
-                    atlas=atlas_name,
-                )
-            if sphere_flag:
-                sub_string_temp = sub_string_temp + " -sphere_radius=" + custom_radius
-            if task is not None:
-                sub_string_temp = sub_string_temp + " -task=" + task
-            if overlap_ok or config.roi_extraction.overlap_ok:
-                sub_string_temp = sub_string_temp + " -overlap_ok"
-                logger.debug("Overlap ok flag set")
-
-            sub_string_temp = sub_string_temp + " " + subject
-            batch_manager.add_job(
-                "ROI_extract_" + subject + "_" + atlas_name, 
-                sub_string_temp
-            )
+                targets = build_roi_manifest(subject, task, config, logger, bids=bids)
+            if not targets:
+                logger.warning(f"No images found for subject {subject}. Skipping.")
+                continue
+
             if single:
                 _fmri_roi_extract_subject(
                     subject,
-                    task,
-                    atlas_name,
-                    atlas_filename,
-                    atlas_labels,
-                    atlas_type,
-                    custom_radius,
-                    custom_flag,
+                    atlases,
                     config,
+                    targets,
                     overlap_ok,
                     overwrite,
                     logger,
+                    image_files=image_files,
                 )
-    if not single:
+                continue
+
+            subject_options = " -manifest_file=" + str(
+                write_roi_manifest(targets, config, subject)
+            )
+        if job_grouping == JOB_GROUPING_ATLAS:
+            for atlas in atlases:
+                job = batch_manager.add_job(
+                    "ROI_extract_" + subject + "_" + atlas["atlas_name"],
+                    submission_string.format(
+                        config=config_path,
+                        options=_get_atlas_options(atlas)
+                        + subject_options
+                        + common_options,
+                    )
+                    + " "
+                    + subject,
+                )
+                extraction_jobs.append(job)
+        elif job_grouping == JOB_GROUPING_SUBJECT:
+            job = batch_manager.add_job(
+                "ROI_extract_" + subject,
+                submission_string.format(
+                    config=config_path, options=subject_options + common_options
+                )
+                + " "
+                + subject,
+            )
+            extraction_jobs.append(job)
+        else:
+            for target in targets:
+                file = target["image_file"]
+                job = batch_manager.add_job(
+                    "ROI_extract_" + _get_file_outname(file),
+                    submission_string.format(
+                        config=config_path,
+                        options=" -image_file="
+                        + file
+                        + subject_options
+                        + common_options,
+                    )
+                    + " "
+                    + subject,
+                )
+                extraction_jobs.append(job)
+
+    # Local jobs don't wait on others, so local stores are consolidated after
+    # the jobs have run
+    consolidate_locally = isinstance(batch_manager, LocalJobManager) and not job_manager
+    if consolidate and extraction_jobs and not consolidate_locally:
+        queue_roi_consolidation(
+            batch_manager, config_path, sublist, extraction_jobs, atlas_name
+        )
+
+    if not single and not job_manager:
         if submit:
             batch_manager.submit_jobs()
+            if consolidate and consolidate_locally:
+                consolidate_roi_timeseries(
+                    subjects=sublist,
+                    config_file=config_path,
+                    atlas_name=atlas_name,
+                    debug=debug,
+                )
         else:
             click.echo(batch_manager.print_jobs())
 
 
+def queue_roi_consolidation(
+    job_manager: JobManager, config_path, subjects, dependencies, atlas_name=None
+):
+    """Queue a job consolidating the subjects' stores, once the extraction jobs
+    in dependencies have ended."""
+    return job_manager.add_job(
+        "ROI_consolidate",
+        CONSOLIDATE_SUBMISSION_STRING.format(
+            config=config_path,
+            atlas_options=(
+                f" -atlas_name={atlas_name}" if atlas_name is not None else ""
+            ),
+            subjects=" ".join(subjects),
+        ),
+        dependencies=dependencies,
+    )
+
+
+def consolidate_roi_timeseries(
+    subjects=None, config_file=None, atlas_name=None, debug=False
+):
+    """Add subjects' ROI timeseries to the store of each atlas, replacing any rows
+    the stores held for them. Without subjects, every subject's timeseries are
+    gathered."""
+    config = ProjectOptions.load(config_file)
+    logger = get_logger(STEP_NAME, debug=debug, log_dir=config.get_logs_dir())
+
+    if atlas_name is not None:
+        atlas_names = [atlas_name]
+    else:
+        atlas_names = [
+            atlas["atlas_name"] if type(atlas) is dict else atlas
+            for atlas in config.roi_extraction.atlases
+        ]
+    output_format = config.roi_extraction.output_format
+    extension = OUTPUT_EXTENSIONS[output_format]
+
+    for name in atlas_names:
+        atlas_dir = Path(config.roi_extraction.output_directory) / name
+        timeseries_files = sorted(atlas_dir.glob(f"*_atlas-{name}{extension}"))
+        if subjects:
+            prefixes = tuple(f"sub-{subject}_" for subject in subjects)
+            timeseries_files = [
+                path for path in timeseries_files if path.name.startswith(prefixes)
+            ]
+        store_path = get_store_path(atlas_dir, name, output_format)
+        logger.info(
+            f"Adding {len(timeseries_files)} image(s) to atlas store: {store_path}"
+        )
+        consolidate_timeseries(timeseries_files, store_path, atlas_name=name)
+
+
+def build_roi_manifest(subject, task, config: ProjectOptions, logger, bids=None):
+    """Resolve a subject's images to extract ROIs from, and the brain mask of each.
+
+    Masks are matched to images by their entities. Images without a mask have a
+    mask_file of None.
+
+    Returns:
+        list: A dict per image, giving its image_file and mask_file.
+    """
+    masks = _find_subject_masks(subject, config, logger, bids=bids)
+    manifest = []
+    for image_file in _find_subject_images(subject, task, config, logger, bids=bids):
+        mask_file = masks.get(_get_mask_key(image_file))
+        if mask_file is None:
+            logger.warning(f"No mask found for image: {image_file}")
+        manifest.append({"image_file": image_file, "mask_file": mask_file})
+    return manifest
+
+
+def write_roi_manifest(manifest: list, config: ProjectOptions, subject) -> Path:
+    """Save a subject's manifest as JSON in the output folder, returning its path."""
+    manifest_dir = Path(config.roi_extraction.output_directory) / MANIFEST_DIR_NAME
+    manifest_dir.mkdir(parents=True, exist_ok=True)
+    manifest_file = manifest_dir / f"sub-{subject}.json"
+
+    # Write then rename, so running jobs never read a partial manifest
+    temp_file = manifest_file.with_name(f".{manifest_file.name}.{os.getpid()}.tmp")
+    with open(temp_file, "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(temp_file, manifest_file)
+
+    return manifest_file.resolve()
+
+
+def load_roi_manifest(manifest_file: os.PathLike) -> list:
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def get_roi_bids_index(config: ProjectOptions, index_dir=None, logger=None):
+    """Open the pybids index postprocessing built, or the one at index_dir, if it
+    exists. ROI extraction doesn't build an index of its own."""
+    database_path = index_dir
+    if database_path is None:
+        database_path = config.postprocessing.get_pybids_db_path(
+            DEFAULT_PROCESSING_STREAM, BIDS_INDEX_NAME
+        )
+    if not os.path.exists(database_path):
+        if logger:
+            logger.debug(f"No BIDS index at {database_path}, searching folders")
+        return None
+    return get_bids(
+        config.fmriprep.bids_directory, database_path=database_path, logger=logger
+    )
+
+
+def _resolve_atlas(
+    cur_atlas,
+    atlas_library,
+    custom_atlas,
+    custom_label,
+    custom_type,
+    sphere_radius,
+    logger,
+) -> dict:
+    """Look up an atlas, given by name or as a custom atlas dict, returning its
+    name, files, type, sphere radius and whether it is custom."""
+    atlas_names = [atlas["atlas_name"] for atlas in atlas_library["Atlases"]]
+    custom_flag = False
+    if type(cur_atlas) is dict:
+        custom_flag = True
+        atlas_name = cur_atlas["atlas_name"]
+        logger.info(f"Using Custom Dict Atlas: {atlas_name}")
+        custom_atlas = cur_atlas["atlas_file"]
+        logger.debug(custom_atlas)
+        custom_label = cur_atlas["atlas_labels"]
+        logger.debug(custom_label)
+        custom_type = cur_atlas["atlas_type"]
+        logger.debug(custom_type)
+        if "sphere" in custom_type:
+            sphere_radius = cur_atlas["radius"]
+            logger.debug(sphere_radius)
+    else:
+        atlas_name = cur_atlas
+    logger.debug(atlas_name)
+    if atlas_name in atlas_names:
+        logger.debug("Found atlas name in library")
+        index = atlas_names.index(atlas_name)
+        atlas_filename = atlas_library["Atlases"][index]["atlas_file"]
+        atlas_labels = atlas_library["Atlases"][index]["atlas_labels"]
+        atlas_type = atlas_library["Atlases"][index]["atlas_type"]
+    else:
+        logger.debug("Did Not Find Atlas Name in Library")
+        custom_flag = True
+        if any(
+            [
+                not custom_atlas or not os.path.exists(custom_atlas),
+                not custom_label or not os.path.exists(custom_label),
+                custom_type not in ["label", "maps", "sphere"],
+            ]
+        ):
+            raise ValueError(
+                "You are attempting to use a custom atlas, but have not "
+                "specified one or more of the following: \n"
+                "\t A custom atlas mask file (.nii or .nii.gz)"
+                "\t A custom atlas label file (a file with information about the atlas)"
+                "\t A custom atlas type (label, maps or spheres)"
+            )
+        atlas_filename = custom_atlas
+        atlas_labels = custom_label
+        atlas_type = custom_type
+
+    return {
+        "atlas_name": atlas_name,
+        "atlas_file": atlas_filename,
+        "atlas_labels": atlas_labels,
+        "atlas_type": atlas_type,
+        "sphere_radius": str(sphere_radius),
+        "custom": custom_flag,
+    }
+
+
+def _get_atlas_options(atlas: dict) -> str:
+    """Get the command line options naming an atlas for a job."""
+    options = " -atlas_name=" + atlas["atlas_name"]
+    if atlas["custom"]:
+        options += (
+            f" -custom_atlas={atlas['atlas_file']}"
+            f" -custom_label={atlas['atlas_labels']}"
+            f" -custom_type={atlas['atlas_type']}"
+        )
+    if "sphere" in atlas["atlas_type"]:
+        options += " -sphere_radius=" + atlas["sphere_radius"]
+    return options
+
+
+def _find_subject_images(subject, task, config: ProjectOptions, logger, bids=None):
+    """Find a subject's images to extract ROIs from, in the index if it covers the
+    target folder, or else with one walk of the subject's folder."""
+    target_dir = os.path.abspath(config.roi_extraction.target_directory)
+    target_suffix = config.roi_extraction.target_suffix
+    if bids is not None and target_dir in _get_index_roots(bids):
+        logger.debug(f"Finding images of subject {subject} in the BIDS index")
+        subject_files = [
+            path
+            for path in bids.get(
+                subject=subject, scope="derivatives", return_type="filename"
+            )
+            if path.startswith(target_dir + os.sep) and path.endswith(target_suffix)
+        ]
+    else:
+        subject_dir = os.path.join(target_dir, "sub-" + subject)
+        logger.debug(f"Finding images in: {subject_dir}")
+        subject_files = _scan_subject_dir(subject_dir, (target_suffix,))
+    if task is not None:
+        logger.info(f"Checking for task {task} for subjects: {subject_files}")
+        subject_files = [x for x in subject_files if "task-" + task in x]
+    return sorted(subject_files)
+
+
+def _find_subject_masks(subject, config: ProjectOptions, logger, bids=None) -> dict:
+    """Find a subject's fMRIPrep brain masks, keyed by their entities other than
+    desc, in the index if given, or else with one walk of the subject's folder."""
+    if bids is not None:
+        mask_files = bids.get(
+            subject=subject,
+            datatype="func",
+            desc="brain",
+            suffix="mask",
+            scope="derivatives",
+            return_type="filename",
+        )
+    else:
+        fmriprep_dir = resolve_fmriprep_dir(config.postprocessing.target_directory)
+        subject_dir = os.path.join(fmriprep_dir, "sub-" + subject)
+        logger.debug(f"Finding masks in: {subject_dir}")
+        mask_files = _scan_subject_dir(subject_dir, BRAIN_MASK_SUFFIXES)
+
+    masks = {}
+    for mask_file in mask_files:
+        if not mask_file.endswith(BRAIN_MASK_SUFFIXES):
+            continue
+        key = _get_mask_key(mask_file)
+        # Prefer zipped masks, as fMRIPrep writes them
+        if key not in masks or mask_file.endswith(BRAIN_MASK_SUFFIXES[0]):
+            masks[key] = mask_file
+    return masks
+
+
+def _get_mask_key(path) -> tuple:
+    """Images share entities with their masks, other than desc."""
+    entities = get_image_entities(os.path.basename(path).split(".")[0])
+    entities.pop("desc", None)
+    return tuple(sorted(entities.items()))
+
+
+def _get_index_roots(bids) -> list:
+    return [os.path.abspath(bids.root)] + [
+        os.path.abspath(derivative.root) for derivative in bids.derivatives.values()
+    ]
+
+
+def _scan_subject_dir(subject_dir, suffixes: tuple) -> list:
+    return [
+        os.path.join(dir_path, file_name)
+        for dir_path, _, file_names in os.walk(subject_dir)
+        for file_name in file_names
+        if file_name.endswith(suffixes) and not file_name.startswith(".")
+    ]
+
+
 def _fmri_roi_extract_subject(
     subject,
-    task,
-    atlas_name,
-    atlas_filename,
-    atlas_label,
-    atlas_type,
-    sphere_radius,
-    custom_flag,
+    atlases,
     config: ProjectOptions,
+    targets: list,
     overlap_ok,
     overwrite,
     logger,
+    image_files=None,
 ):
     logger.info(
         "Running Subject "
         + subject
-        + " Atlas: "
-        + atlas_name
-        + " Atlas Type: "
-        + atlas_type
-    )
-
-    if not custom_flag:
-        atlas_path = resource_filename(__name__, atlas_filename)
-        atlas_labelpath = resource_filename(__name__, atlas_label)
-    else:
-        atlas_path = os.path.abspath(atlas_filename)
-        atlas_labelpath = os.path.abspath(atlas_label)
-    logger.debug(f"Using atlas path: {atlas_path}")
-
-    search_string = os.path.abspath(
-        os.path.join(
-            config.roi_extraction.target_directory,
-            "sub-" + subject,
-            "**",
-            "*" + config.roi_extraction.target_suffix,
+        + " Atlases: "
+        + ", ".join(
+            f"{atlas['atlas_name']} ({atlas['atlas_type']})" for atlas in atlases
         )
     )
-    logger.debug(search_string)
-    subject_files = glob.glob(search_string, recursive=True)
-    if task is not None:
-        logger.info(f"Checking for task {task} for subjects: {subject_files}")
-        subject_files = [x for x in subject_files if "task-" + task in x]
-    logger.info(f"Processing subjects: {subject_files}")
 
-    os.makedirs(
-        os.path.join(config.roi_extraction.output_directory, atlas_name),
-        exist_ok=True,
+    extraction_atlases = []
+    for atlas in atlases:
+        if not atlas["custom"]:
+            atlas_path = resource_filename(__name__, atlas["atlas_file"])
+            atlas_labelpath = resource_filename(__name__, atlas["atlas_labels"])
+        else:
+            atlas_path = os.path.abspath(atlas["atlas_file"])
+            atlas_labelpath = os.path.abspath(atlas["atlas_labels"])
+        logger.debug(f"Using atlas path: {atlas_path}")
+
+        os.makedirs(
+            os.path.join(config.roi_extraction.output_directory, atlas["atlas_name"]),
+            exist_ok=True,
+        )
+        if not Path(atlas_labelpath).exists():
+            shutil.copy2(atlas_labelpath, config.roi_extraction.output_directory)
+        extraction_atlases.append({**atlas, "atlas_path": atlas_path})
+
+    if image_files:
+        image_files = {os.path.abspath(file) for file in image_files}
+        targets = [
+            target
+            for target in targets
+            if os.path.abspath(target["image_file"]) in image_files
+        ]
+    logger.info(
+        f"Processing subjects: {[target['image_file'] for target in targets]}"
     )
-    if not Path(atlas_labelpath).exists():
-        shutil.copy2(atlas_labelpath, config.roi_extraction.output_directory)
 
-    for file in subject_files:
-        fmri_roi_extract_image(
-            file,
+    # Runs of a subject often share a brain mask, so each mask is loaded, and its
+    # ROI coverage computed, once per job
+    mask_cache = {}
+    for target in targets:
+        fmri_roi_extract_image_atlases(
+            target["image_file"],
             config,
-            atlas_name,
-            atlas_path,
-            atlas_type,
-            sphere_radius,
+            extraction_atlases,
             overlap_ok,
             overwrite,
             logger,
+            mask_file=target["mask_file"],
+            mask_cache=mask_cache,
         )
 
 
@@ -279,27 +606,70 @@ def fmri_roi_extract_image(
     overwrite,
     logger,
 ):
-    logger.info(f"Processing image: {Path(file).stem}")
-    file_outname = os.path.splitext(os.path.basename(file))[0]
-    if ".nii" in file_outname:
-        file_outname = os.path.splitext(file_outname)[0]
+    """Extract one atlas's ROI timeseries from an image."""
+    try:
+        mask_file = fmriprep_mask_finder(file, config, logger)
+    except MaskFileNotFoundError:
+        mask_file = None
+
+    fmri_roi_extract_image_atlases(
+        file,
+        config,
+        [
+            {
+                "atlas_name": atlas_name,
+                "atlas_path": atlas_path,
+                "atlas_type": atlas_type,
+                "sphere_radius": sphere_radius,
+            }
+        ],
+        overlap_ok,
+        overwrite,
+        logger,
+        mask_file=mask_file,
+    )
+
+
+def fmri_roi_extract_image_atlases(
+    file,
+    config: ProjectOptions,
+    atlases: list,
+    overlap_ok,
+    overwrite,
+    logger,
+    mask_file=None,
+    mask_cache: dict = None,
+):
+    """Extract the ROI timeseries of several atlases from an image, loading the
+    image and its mask only once.
 
-    if (
-        os.path.exists(
-            os.path.join(
-                config.roi_extraction.output_directory,
-                atlas_name + "/" + file_outname + "_atlas-" + atlas_name + ".csv",
+    Each atlas is a dict giving its atlas_name, atlas_path, atlas_type and
+    sphere_radius. A mask_file of None means the image has no mask. If mask_cache
+    is given, masks and their ROI coverage are kept in it, by mask file, for
+    other images sharing the mask.
+    """
+    logger.info(f"Processing image: {Path(file).stem}")
+    file_outname = _get_file_outname(file)
+
+    extension = OUTPUT_EXTENSIONS[config.roi_extraction.output_format]
+    pending_atlases = []
+    for atlas in atlases:
+        if (
+            os.path.exists(
+                _get_output_path(config, atlas["atlas_name"], file_outname, extension)
             )
-        )
-        and not overwrite
-    ):
-        logger.info("File Exists! Skipping. Use -overwrite to reprocess.")
+            and not overwrite
+        ):
+            logger.info(
+                f"File Exists for atlas {atlas['atlas_name']}! Skipping. "
+                "Use -overwrite to reprocess."
+            )
+        else:
+            pending_atlases.append(atlas)
+    if not pending_atlases:
         return
 
-    try:
-        # First, try to find this image's mask from fMRIPrep.
-        mask_file = fmriprep_mask_finder(file, config, logger)
-    except MaskFileNotFoundError:
+    if mask_file is None:
         if config.roi_extraction.require_mask:
             # If a mask is required, return here due to missing mask.
             logger.warning("Skipping this scan due to missing brain mask.")
@@ -309,94 +679,142 @@ def fmri_roi_extract_image(
             logger.warning(
                 "Unable to find a mask for this image. Extracting ROIs without using brain mask."
             )
-            ROI_ts = _fmri_roi_extract_image(
-                file, atlas_path, atlas_type, sphere_radius, overlap_ok, logger
-            )
+            mask_entry = None
     else:
+        if mask_cache is None:
+            mask_cache = {}
+        if mask_file not in mask_cache:
+            mask_cache[mask_file] = {"mask": _load_image(mask_file), "coverage": {}}
+        mask_entry = mask_cache[mask_file]
+
+    image = _load_image(file)
+    for atlas in pending_atlases:
+        _fmri_roi_extract_atlas(
+            image, mask_entry, atlas, config, file_outname, overlap_ok, logger
+        )
+
+
+def _fmri_roi_extract_atlas(
+    image,
+    mask_entry,
+    atlas: dict,
+    config: ProjectOptions,
+    file_outname,
+    overlap_ok,
+    logger,
+):
+    atlas_name = atlas["atlas_name"]
+    logger.info(f"Extracting atlas: {atlas_name}")
+
+    cache_dir = config.roi_extraction.get_weights_cache_dir()
+    if mask_entry is None:
+        ROI_ts, rois = _fmri_roi_extract_weighted(
+            image, atlas, cache_dir, overlap_ok, logger
+        )
+    else:
+        mask = mask_entry["mask"]
         try:
             logger.info("Starting masked ROI extraction...")
             # Attempt to run ROI extraction with mask
-            ROI_ts = _fmri_roi_extract_image(
-                file,
-                atlas_path,
-                atlas_type,
-                sphere_radius,
-                overlap_ok,
-                logger,
-                mask=mask_file,
+            ROI_ts, rois = _fmri_roi_extract_weighted(
+                image, atlas, cache_dir, overlap_ok, logger, mask=mask
             )
         except ValueError as ve:
             # Trigger fallback flag if any ROIs are outside of the mask region.
             logger.warning(ve.__str__() + ". Extracting ROIs without using brain mask.")
             logger.info("Starting non-masked ROI extraction...")
-            ROI_ts = _fmri_roi_extract_image(
-                file, atlas_path, atlas_type, sphere_radius, overlap_ok, logger
+            ROI_ts, rois = _fmri_roi_extract_weighted(
+                image, atlas, cache_dir, overlap_ok, logger
             )
 
-        temp_mask = concat_imgs([mask_file, mask_file])
-        mask_ROIs = _fmri_roi_extract_image(
-            temp_mask, atlas_path, atlas_type, sphere_radius, overlap_ok, logger
-        )
-        mask_ROIs = np.nan_to_num(mask_ROIs)
-        logger.debug(mask_ROIs[0])
-        to_remove = [
-            ind
-            for ind, prop in np.ndenumerate(mask_ROIs[0])
-            if prop < config.roi_extraction.prop_voxels
-        ]
+        if atlas_name not in mask_entry["coverage"]:
+            # The proportion of each ROI within the mask, from the atlas's
+            # unmasked weights
+            weights, _ = load_atlas_weights(
+                atlas["atlas_path"],
+                atlas["atlas_type"],
+                image,
+                cache_dir=cache_dir,
+                sphere_radius=atlas["sphere_radius"],
+                overlap_ok=overlap_ok,
+                logger=logger,
+            )
+            mask_entry["coverage"][atlas_name] = get_roi_coverage(
+                weights, mask, image
+            )
+        mask_ROIs = mask_entry["coverage"][atlas_name]
+        logger.debug(mask_ROIs)
+        to_remove = np.flatnonzero(mask_ROIs < config.roi_extraction.prop_voxels)
         logger.debug(to_remove)
         ROI_ts[:, to_remove] = np.nan
 
         # Save ROI masked threshold timeseries
         np.savetxt(
-            os.path.join(
-                os.path.join(
-                    config.roi_extraction.output_directory,
-                    atlas_name,
-                ),
-                file_outname + "_atlas-" + atlas_name + "_voxel_prop.csv",
-            ),
-            mask_ROIs[0],
+            _get_output_path(config, atlas_name, file_outname, "_voxel_prop.csv"),
+            mask_ROIs,
             delimiter=",",
         )
 
     # Save the ROI timeseries
-    np.savetxt(
-        os.path.join(
-            os.path.join(config.roi_extraction.output_directory, atlas_name),
-            file_outname + "_atlas-" + atlas_name + ".csv",
+    output_format = config.roi_extraction.output_format
+    write_timeseries(
+        _get_output_path(
+            config, atlas_name, file_outname, OUTPUT_EXTENSIONS[output_format]
         ),
         ROI_ts,
-        delimiter=",",
+        output_format,
+        rois=rois,
+        metadata={
+            "atlas": atlas_name,
+            "image": file_outname,
+            "entities": get_image_entities(file_outname),
+        },
     )
 
     logger.info("Extraction completed.")
 
 
-def _fmri_roi_extract_image(
-    data, atlas_path, atlas_type, sphere_radius, overlap_ok, logger, mask=None
-):
-    if "label" in atlas_type:
-        logger.info("Extract type: label")
-        label_masker = NiftiLabelsMasker(atlas_path, mask_img=mask)
-        timeseries = label_masker.fit_transform(data)
-    if "sphere" in atlas_type:
-        atlas_path = np.loadtxt(atlas_path)
-        logger.info("Extract type: sphere")
-        logger.info(f"Sphere radius: {sphere_radius}mm")
-        spheres_masker = NiftiSpheresMasker(
-            atlas_path, float(sphere_radius), mask_img=mask, allow_overlap=overlap_ok
-        )
-        timeseries = spheres_masker.fit_transform(data)
-    if "maps" in atlas_type:
-        logger.info("Extract type: maps")
-        maps_masker = NiftiMapsMasker(
-            atlas_path, mask_img=mask, allow_overlap=overlap_ok
-        )
-        timeseries = maps_masker.fit_transform(data)
+def _get_file_outname(file) -> str:
+    file_outname = os.path.splitext(os.path.basename(file))[0]
+    if ".nii" in file_outname:
+        file_outname = os.path.splitext(file_outname)[0]
+    return file_outname
+
+
+def _get_output_path(config: ProjectOptions, atlas_name, file_outname, suffix):
+    return os.path.join(
+        config.roi_extraction.output_directory,
+        atlas_name,
+        file_outname + "_atlas-" + atlas_name + suffix,
+    )
+
+
+def _load_image(path):
+    """Load an image with its data in memory, so it is read and decompressed only
+    once however many atlases are extracted from it."""
+    image = nib.load(str(path))
+    return image.__class__(np.asanyarray(image.dataobj), image.affine, image.header)
+
+
+def _fmri_roi_extract_weighted(image, atlas, cache_dir, overlap_ok, logger, mask=None):
+    """Extract an atlas's ROI timeseries as one product of the image's data with
+    the atlas's weights, cached for images sharing the grid and mask. Returns the
+    timeseries and their ROIs."""
+    logger.info(f"Extract type: {atlas['atlas_type']}")
+    weights, rois = load_atlas_weights(
+        atlas["atlas_path"],
+        atlas["atlas_type"],
+        image,
+        cache_dir=cache_dir,
+        mask_img=mask,
+        sphere_radius=atlas["sphere_radius"],
+        overlap_ok=overlap_ok,
+        logger=logger,
+    )
+    timeseries = extract_timeseries(image, weights)
     timeseries[timeseries == 0.0] = np.nan
 
-    return timeseries
+    return timeseries, rois
 
 
 def get_available_atlases():
@@ -444,6 +862,19 @@ def fmriprep_mask_finder(image_path, config: ProjectOptions, logger) -> os.PathL
     return target_mask
 
 
+def get_batch_manager(config: ProjectOptions, debug=False) -> JobManager:
+    """Get a job manager requesting the resources of ROI extraction jobs."""
+    return JobManagerFactory.get(
+        batch_config=config.batch_config_path,
+        output_directory=config.roi_extraction.log_directory,
+        debug=debug,
+        mem_use=config.roi_extraction.memory_usage,
+        time=config.roi_extraction.time_usage,
+        threads=config.roi_extraction.n_threads,
+        email=config.email_address
+    )
+
+
 def setup_dirs(config: ProjectOptions):
     """Setup the directories necessary for ROI extraction's output."""
     
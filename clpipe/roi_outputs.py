@@ -0,0 +1,247 @@
+"""Save ROI timeseries, and consolidate them into one store per atlas.
+
+Timeseries are saved as CSV, Parquet, Feather or NPZ files. Parquet and Feather
+files name their columns by ROI and keep the atlas and the image's BIDS entities
+in their schema metadata; NPZ files keep them as arrays. CSV files are written
+without a header, as they always have been, so existing readers keep working.
+
+A store gathers the timeseries of many images of an atlas into one table, with a
+row per image timepoint, the image's entities as leading columns and a column
+per ROI. Adding subjects to a store replaces any rows it held for them.
+
+Parquet and Feather need pyarrow.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+OUTPUT_FORMAT_CSV = "csv"
+OUTPUT_FORMAT_PARQUET = "parquet"
+OUTPUT_FORMAT_FEATHER = "feather"
+OUTPUT_FORMAT_NPZ = "npz"
+OUTPUT_EXTENSIONS = {
+    OUTPUT_FORMAT_CSV: ".csv",
+    OUTPUT_FORMAT_PARQUET: ".parquet",
+    OUTPUT_FORMAT_FEATHER: ".feather",
+    OUTPUT_FORMAT_NPZ: ".npz",
+}
+ARROW_FORMATS = (OUTPUT_FORMAT_PARQUET, OUTPUT_FORMAT_FEATHER)
+METADATA_KEY = b"clpipe"
+TIMEPOINT_COLUMN = "timepoint"
+STORE_FORMAT_STR = "atlas-{atlas_name}_timeseries{extension}"
+
+
+def check_output_format(output_format: str):
+    """Fail early if an output format's writer is not available."""
+    if output_format not in OUTPUT_EXTENSIONS:
+        raise ValueError(
+            f"Unknown ROI output format: {output_format}. "
+            f"Choose from: {', '.join(OUTPUT_EXTENSIONS)}"
+        )
+    if output_format in ARROW_FORMATS:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                f"The {output_format} ROI output format needs pyarrow. "
+                "Install it with 'pip install pyarrow'."
+            ) from e
+
+
+def get_image_entities(image_name: str) -> dict:
+    """Parse the BIDS entities, like sub and task, from an image's name without
+    its extension."""
+    entities = {}
+    for part in image_name.split("_"):
+        key, separator, value = part.partition("-")
+        if separator:
+            entities[key] = value
+    return entities
+
+
+def write_timeseries(
+    path: os.PathLike,
+    timeseries: np.ndarray,
+    output_format: str,
+    rois=None,
+    metadata: dict = None,
+):
+    """Save an image's timepoints by ROIs timeseries."""
+    if output_format == OUTPUT_FORMAT_CSV:
+        np.savetxt(path, timeseries, delimiter=",")
+        return
+
+    if rois is None:
+        rois = np.arange(1, timeseries.shape[1] + 1)
+    metadata = metadata if metadata else {}
+    if output_format == OUTPUT_FORMAT_NPZ:
+        np.savez(
+            path,
+            timeseries=timeseries,
+            rois=np.asarray(rois),
+            metadata=json.dumps(metadata),
+        )
+    else:
+        frame = pd.DataFrame(timeseries, columns=[str(roi) for roi in rois])
+        _write_arrow(frame, path, output_format, metadata)
+
+
+def read_timeseries(path: os.PathLike) -> tuple:
+    """Load an image's timeseries, with a column per ROI, and its metadata.
+
+    CSV files have no metadata, so their ROIs are numbered by position, and their
+    entities are parsed from the file name.
+    """
+    path = Path(path)
+    output_format = _get_format(path)
+    if output_format == OUTPUT_FORMAT_CSV:
+        timeseries = np.loadtxt(path, delimiter=",", ndmin=2)
+        frame = pd.DataFrame(
+            timeseries, columns=[str(roi) for roi in range(1, timeseries.shape[1] + 1)]
+        )
+        image_name = path.name[: -len(path.suffix)].rsplit("_atlas-", 1)[0]
+        return frame, {"entities": get_image_entities(image_name)}
+    if output_format == OUTPUT_FORMAT_NPZ:
+        with np.load(path) as saved:
+            frame = pd.DataFrame(
+                saved["timeseries"], columns=[str(roi) for roi in saved["rois"]]
+            )
+            return frame, json.loads(str(saved["metadata"]))
+    return _read_arrow(path, output_format)
+
+
+def get_store_path(atlas_dir: os.PathLike, atlas_name: str, output_format: str):
+    """Get the path of an atlas's store within its output folder."""
+    return Path(atlas_dir) / STORE_FORMAT_STR.format(
+        atlas_name=atlas_name, extension=OUTPUT_EXTENSIONS[output_format]
+    )
+
+
+def consolidate_timeseries(
+    timeseries_files: list, store_path: os.PathLike, atlas_name: str = None
+) -> pd.DataFrame:
+    """Add the timeseries of images to an atlas's store, replacing any rows it held
+    for their subjects, and return the store."""
+    store_path = Path(store_path)
+    output_format = _get_format(store_path)
+
+    frames = []
+    for path in timeseries_files:
+        frame, metadata = read_timeseries(path)
+        frame.insert(0, TIMEPOINT_COLUMN, np.arange(len(frame)))
+        for index, (key, value) in enumerate(metadata["entities"].items()):
+            frame.insert(index, key, value)
+        frames.append(frame)
+    if not frames:
+        return read_store(store_path) if store_path.exists() else pd.DataFrame()
+    store = pd.concat(frames, ignore_index=True)
+
+    if store_path.exists():
+        existing = read_store(store_path)
+        if "sub" in existing and "sub" in store:
+            existing = existing[~existing["sub"].isin(store["sub"].unique())]
+        store = pd.concat([existing, store], ignore_index=True)
+    store = store[_order_store_columns(store)]
+
+    # Write then rename, so readers never see a partial store
+    temp_path = store_path.with_name(f".{store_path.name}.{os.getpid()}.tmp")
+    _write_store(store, temp_path, output_format, {"atlas": atlas_name})
+    os.replace(temp_path, store_path)
+    return store
+
+
+def read_store(store_path: os.PathLike) -> pd.DataFrame:
+    """Load an atlas's store."""
+    store_path = Path(store_path)
+    output_format = _get_format(store_path)
+    if output_format == OUTPUT_FORMAT_CSV:
+        return pd.read_csv(store_path, dtype=str).pipe(_restore_store_types)
+    if output_format == OUTPUT_FORMAT_NPZ:
+        with np.load(store_path, allow_pickle=False) as saved:
+            store = pd.DataFrame(saved["keys"], columns=saved["key_columns"])
+            values = pd.DataFrame(saved["timeseries"], columns=saved["rois"])
+        store = pd.concat([store, values], axis=1).replace("", np.nan)
+        return _restore_store_types(store)
+    return _read_arrow(store_path, output_format)[0]
+
+
+def _write_store(store, path, output_format, metadata):
+    if output_format == OUTPUT_FORMAT_CSV:
+        store.to_csv(path, index=False)
+    elif output_format == OUTPUT_FORMAT_NPZ:
+        key_columns = [column for column in store if not _is_roi_column(column)]
+        roi_columns = [column for column in store if column not in key_columns]
+        # Write to an open file, so numpy doesn't add an extension to the name
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                keys=store[key_columns].fillna("").astype(str).to_numpy(dtype=str),
+                key_columns=np.asarray(key_columns, dtype=str),
+                timeseries=store[roi_columns].to_numpy(dtype=float),
+                rois=np.asarray(roi_columns, dtype=str),
+                metadata=json.dumps(metadata),
+            )
+    else:
+        _write_arrow(store, path, output_format, metadata)
+
+
+def _write_arrow(frame, path, output_format, metadata):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), METADATA_KEY: json.dumps(metadata)}
+    )
+    if output_format == OUTPUT_FORMAT_PARQUET:
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, str(path))
+    else:
+        from pyarrow import feather
+
+        feather.write_feather(table, str(path))
+
+
+def _read_arrow(path, output_format):
+    if output_format == OUTPUT_FORMAT_PARQUET:
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(str(path))
+    else:
+        from pyarrow import feather
+
+        table = feather.read_table(str(path))
+    metadata = (table.schema.metadata or {}).get(METADATA_KEY)
+    return table.to_pandas(), json.loads(metadata) if metadata else {}
+
+
+def _get_format(path: Path) -> str:
+    for output_format, extension in OUTPUT_EXTENSIONS.items():
+        if path.name.endswith(extension):
+            return output_format
+    raise ValueError(f"Unknown ROI output format for file: {path}")
+
+
+def _is_roi_column(column) -> bool:
+    """ROI columns are named by number, unlike entities and the timepoint."""
+    return column != TIMEPOINT_COLUMN and str(column).isdigit()
+
+
+def _order_store_columns(store) -> list:
+    roi_columns = [column for column in store if _is_roi_column(column)]
+    key_columns = [column for column in store if column not in roi_columns]
+    key_columns.remove(TIMEPOINT_COLUMN)
+    return key_columns + [TIMEPOINT_COLUMN] + roi_columns
+
+
+def _restore_store_types(store):
+    for column in store:
+        if column == TIMEPOINT_COLUMN:
+            store[column] = store[column].astype(int)
+        elif _is_roi_column(column):
+            store[column] = store[column].astype(float)
+    return store
@@ -0,0 +1,290 @@
+"""Extract ROI timeseries with precomputed atlas weight matrices.
+
+An atlas's weights are a sparse voxels by ROIs matrix over an image grid, so an
+image's ROI timeseries are one sparse matrix product with its data. Each ROI is
+identified by its label value, for label atlases, or its 1-based position among
+the atlas's seeds or maps. Label and
+sphere atlases average the voxels of each ROI, and map atlases take the least
+squares fit of their maps, as nilearn's maskers do. Weights depend only on the
+atlas, the image grid, the mask and the sphere radius, so they are cached on disk
+by a hash of those and reused by every image in the same space.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+from nibabel.affines import apply_affine
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from .postprocutils.cache import hash_file
+
+WEIGHTS_SUFFIX = ".npz"
+# Bump when the cached weights' layout changes, so older caches aren't read
+WEIGHTS_VERSION = 2
+
+
+def load_atlas_weights(
+    atlas_path,
+    atlas_type: str,
+    reference_img,
+    cache_dir: os.PathLike = None,
+    mask_img=None,
+    sphere_radius=None,
+    overlap_ok=False,
+    logger=None,
+) -> tuple:
+    """Get an atlas's weights for the grid of reference_img, from the cache when
+    an image with the same grid and mask has been extracted before.
+
+    Returns:
+        tuple: The weights and the ROI of each of their columns.
+    """
+    mask_data = _get_mask_data(mask_img, reference_img)
+    if cache_dir is None:
+        return build_atlas_weights(
+            atlas_path, atlas_type, reference_img, mask_data, sphere_radius, overlap_ok
+        )
+
+    key = get_weights_key(
+        atlas_path, atlas_type, reference_img, mask_data, sphere_radius, overlap_ok
+    )
+    cache_file = Path(cache_dir) / f"{Path(atlas_path).name}_{key}{WEIGHTS_SUFFIX}"
+    if cache_file.exists():
+        if logger:
+            logger.debug(f"Using cached atlas weights: {cache_file}")
+        return _load_weights(cache_file)
+
+    weights, rois = build_atlas_weights(
+        atlas_path, atlas_type, reference_img, mask_data, sphere_radius, overlap_ok
+    )
+
+    # Write then rename, so jobs building the same weights at once don't read
+    # a partial file
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    temp_file = cache_file.with_name(f"{cache_file.stem}.{os.getpid()}.tmp.npz")
+    np.savez(
+        temp_file,
+        data=weights.data,
+        indices=weights.indices,
+        indptr=weights.indptr,
+        shape=weights.shape,
+        rois=rois,
+    )
+    os.replace(temp_file, cache_file)
+    if logger:
+        logger.debug(f"Cached atlas weights: {cache_file}")
+
+    return weights, rois
+
+
+def _load_weights(cache_file):
+    with np.load(cache_file) as cached:
+        weights = sparse.csc_matrix(
+            (cached["data"], cached["indices"], cached["indptr"]),
+            shape=tuple(cached["shape"]),
+        )
+        return weights, cached["rois"]
+
+
+def get_weights_key(
+    atlas_path,
+    atlas_type: str,
+    reference_img,
+    mask_data: np.ndarray = None,
+    sphere_radius=None,
+    overlap_ok=False,
+) -> str:
+    """Hash what an atlas's weights depend on: the atlas's contents and type, the
+    image grid, the mask and the sphere radius."""
+    description = {
+        "version": WEIGHTS_VERSION,
+        "atlas": hash_file(atlas_path),
+        "atlas_type": atlas_type,
+        "shape": list(reference_img.shape[:3]),
+        "affine": np.round(reference_img.affine, 6).tolist(),
+        "mask": (
+            hashlib.sha256(np.packbits(mask_data)).hexdigest()
+            if mask_data is not None
+            else None
+        ),
+        "sphere_radius": float(sphere_radius) if "sphere" in atlas_type else None,
+        "overlap_ok": bool(overlap_ok),
+    }
+    return hashlib.sha256(
+        json.dumps(description, sort_keys=True).encode()
+    ).hexdigest()[:16]
+
+
+def build_atlas_weights(
+    atlas_path,
+    atlas_type: str,
+    reference_img,
+    mask_data: np.ndarray = None,
+    sphere_radius=None,
+    overlap_ok=False,
+) -> tuple:
+    """Build an atlas's weights for the grid of reference_img, using only voxels
+    within mask_data, a boolean array over the grid, if given.
+
+    Returns:
+        tuple: The weights and the ROI of each of their columns.
+
+    Raises:
+        ValueError: If a sphere has no voxels, or if spheres or maps overlap when
+            overlap is not ok.
+    """
+    if "label" in atlas_type:
+        return _build_label_weights(atlas_path, reference_img, mask_data)
+    if "sphere" in atlas_type:
+        return _build_sphere_weights(
+            atlas_path, reference_img, mask_data, float(sphere_radius), overlap_ok
+        )
+    if "maps" in atlas_type:
+        return _build_maps_weights(atlas_path, reference_img, mask_data, overlap_ok)
+    raise ValueError(f"Unknown atlas type: {atlas_type}")
+
+
+def extract_timeseries(image, weights: sparse.spmatrix) -> np.ndarray:
+    """Extract the timepoints by ROIs timeseries of a 4D image with an atlas's
+    weights."""
+    data = np.asanyarray(image.dataobj)
+    data = data.reshape(-1, data.shape[-1] if data.ndim > 3 else 1)
+    return np.asarray(weights.T @ data).T
+
+
+def get_roi_coverage(weights: sparse.spmatrix, mask_img, reference_img) -> np.ndarray:
+    """Get the proportion of each ROI's voxels within a mask, given the atlas's
+    weights without a mask. For map atlases, this is the fit of the maps to the
+    mask, as extracting the mask as an image would give."""
+    mask_data = _get_mask_data(mask_img, reference_img).astype(np.float64)
+    return np.asarray(weights.T @ mask_data).ravel()
+
+
+def _get_mask_data(mask_img, reference_img) -> np.ndarray:
+    """Resample a mask to the grid of reference_img, as a flat boolean array."""
+    if mask_img is None:
+        return None
+    mask_data = np.asanyarray(
+        _resample(_to_3d(mask_img), reference_img, "nearest").dataobj
+    )
+    return mask_data.reshape(-1) > 0
+
+
+def _load_resampled(atlas_path, reference_img, interpolation):
+    atlas_img = nib.load(str(atlas_path))
+    if interpolation == "nearest":
+        atlas_img = _to_3d(atlas_img)
+    return np.asanyarray(_resample(atlas_img, reference_img, interpolation).dataobj)
+
+
+def _resample(image, reference_img, interpolation):
+    """Resample an image to the grid of reference_img, as nilearn's maskers do."""
+    from nilearn.image import resample_img
+
+    if image.shape[:3] == reference_img.shape[:3] and np.allclose(
+        image.affine, reference_img.affine
+    ):
+        return image
+    return resample_img(
+        image,
+        target_affine=reference_img.affine,
+        target_shape=reference_img.shape[:3],
+        interpolation=interpolation,
+    )
+
+
+def _to_3d(image):
+    if len(image.shape) > 3:
+        data = np.asanyarray(image.dataobj)[..., 0]
+        image = nib.Nifti1Image(data, image.affine)
+    return image
+
+
+def _build_label_weights(atlas_path, reference_img, mask_data):
+    labels_data = _load_resampled(atlas_path, reference_img, "nearest").reshape(-1)
+    labels = np.unique(labels_data)
+    labels = labels[labels != 0]
+    if mask_data is not None:
+        labels_data = np.where(mask_data, labels_data, 0)
+
+    voxels = np.flatnonzero(labels_data)
+    columns = np.searchsorted(labels, labels_data[voxels])
+    counts = np.bincount(columns, minlength=len(labels))
+    weights = sparse.csc_matrix(
+        (1.0 / counts[columns], (voxels, columns)),
+        shape=(labels_data.size, len(labels)),
+    )
+    return weights, labels.astype(int)
+
+
+def _build_sphere_weights(atlas_path, reference_img, mask_data, radius, overlap_ok):
+    seeds = np.atleast_2d(np.loadtxt(atlas_path))
+    shape = reference_img.shape[:3]
+    voxel_count = int(np.prod(shape))
+    if mask_data is not None:
+        candidates = np.flatnonzero(mask_data)
+    else:
+        candidates = np.arange(voxel_count)
+    coords = apply_affine(
+        reference_img.affine, np.column_stack(np.unravel_index(candidates, shape))
+    )
+    neighbors = cKDTree(coords).query_ball_point(seeds, r=radius)
+
+    # A seed's nearest voxel is part of its sphere, however small the radius
+    nearest = np.round(
+        apply_affine(np.linalg.inv(reference_img.affine), seeds)
+    ).astype(int)
+
+    voxels, columns = [], []
+    for index, (hits, seed_voxel) in enumerate(zip(neighbors, nearest)):
+        sphere = set(candidates[hits].tolist())
+        if np.all((seed_voxel >= 0) & (seed_voxel < shape)):
+            seed_index = int(np.ravel_multi_index(tuple(seed_voxel), shape))
+            if mask_data is None or mask_data[seed_index]:
+                sphere.add(seed_index)
+        if not sphere:
+            raise ValueError(f"Sphere around seed #{index} is empty")
+        voxels.extend(sphere)
+        columns.extend([index] * len(sphere))
+
+    voxels = np.asarray(voxels, dtype=int)
+    columns = np.asarray(columns, dtype=int)
+    if not overlap_ok and len(np.unique(voxels)) < len(voxels):
+        raise ValueError("Overlap detected between spheres")
+
+    counts = np.bincount(columns, minlength=len(seeds))
+    weights = sparse.csc_matrix(
+        (1.0 / counts[columns], (voxels, columns)), shape=(voxel_count, len(seeds))
+    )
+    return weights, np.arange(1, len(seeds) + 1)
+
+
+def _build_maps_weights(atlas_path, reference_img, mask_data, overlap_ok):
+    maps_data = _load_resampled(atlas_path, reference_img, "continuous")
+    maps_data = maps_data.reshape(-1, maps_data.shape[-1])
+    used = np.any(maps_data != 0, axis=1)
+    if mask_data is not None:
+        used &= mask_data
+
+    # Voxels outside every map don't change the least squares fit, so the fit is
+    # the pseudoinverse of the maps over the voxels they cover
+    voxels = np.flatnonzero(used)
+    maps_data = maps_data[voxels]
+    if not overlap_ok and np.any(np.count_nonzero(maps_data, axis=1) > 1):
+        raise ValueError("Overlap detected in the maps")
+    pseudoinverse = np.linalg.pinv(maps_data)
+
+    map_count = maps_data.shape[1]
+    weights = sparse.csc_matrix(
+        (
+            pseudoinverse.T.ravel(),
+            (np.repeat(voxels, map_count), np.tile(np.arange(map_count), len(voxels))),
+        ),
+        shape=(used.size, map_count),
+    )
+    return weights, np.arange(1, map_count + 1)
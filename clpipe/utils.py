@@ -2,6 +2,7 @@ import click
 import os
 import sys
 import logging
+from math import ceil
 from pathlib import Path
 
 from nipype.utils.filemanip import split_filename
@@ -49,6 +50,69 @@ def append_suffix(original_path, suffix_to_add):
     return out_file
 
 
+MEMORY_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_memory(memory: str) -> int:
+    """Convert a scheduler style memory string, such as '20G' or '500M', to bytes.
+
+    As with SLURM, a value without a unit is read as megabytes.
+    """
+    memory = str(memory).strip().upper().rstrip("B")
+    if not memory:
+        raise ValueError("Memory value is empty.")
+
+    unit = memory[-1]
+    if unit in MEMORY_UNITS:
+        return int(float(memory[:-1]) * MEMORY_UNITS[unit])
+    return int(float(memory) * MEMORY_UNITS["M"])
+
+
+def format_memory(memory: int, like: str = "1G") -> str:
+    """Convert bytes to a scheduler style memory string, rounded up to a whole
+    number of the unit used by like. As with parse_memory, a like value without a
+    unit gives megabytes, without a unit."""
+    like = str(like).strip().upper().rstrip("B")
+    unit = like[-1] if like and like[-1] in MEMORY_UNITS else ""
+    value = max(1, ceil(memory / MEMORY_UNITS[unit or "M"]))
+    return f"{value}{unit}"
+
+
+def parse_time(time: str) -> int:
+    """Convert a SLURM style time string to seconds.
+
+    Accepts 'minutes', 'minutes:seconds', 'hours:minutes:seconds', 'days-hours',
+    'days-hours:minutes' and 'days-hours:minutes:seconds'.
+    """
+    time = str(time).strip()
+    if not time:
+        raise ValueError("Time value is empty.")
+
+    days = 0
+    if "-" in time:
+        days, time = time.split("-", 1)
+        parts = [int(part) for part in time.split(":")]
+        # After days, values start from hours
+        parts += [0] * (3 - len(parts))
+        hours, minutes, seconds = parts
+    else:
+        parts = [int(part) for part in time.split(":")]
+        if len(parts) == 1:
+            hours, minutes, seconds = 0, parts[0], 0
+        elif len(parts) == 2:
+            hours, (minutes, seconds) = 0, parts
+        else:
+            hours, minutes, seconds = parts
+
+    return ((int(days) * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def format_time(seconds: int) -> str:
+    """Convert seconds to an 'hours:minutes:seconds' time string."""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
 def resolve_fmriprep_dir_new(fmriprep_dir):
     fmriprep_root = fmriprep_dir
     if os.path.exists(fmriprep_root) and not os.path.exists(
@@ -0,0 +1,66 @@
+from dataclasses import replace
+
+from clpipe.config.options import PostProcessingOptions
+from clpipe.postprocutils.cache import *
+
+
+def test_cache_key_options(tmp_path):
+    """The cache key follows the options of requested steps, but not unused step
+    options or execution settings."""
+    image_file = tmp_path / "image.nii.gz"
+    image_file.write_bytes(b"image")
+    manifest = {
+        "image_file": str(image_file),
+        "confounds_file": None,
+        "mask_file": None,
+        "mixing_file": None,
+        "noise_file": None,
+        "tr": 2.0,
+    }
+    digests = get_input_digests(manifest)
+    options = PostProcessingOptions()
+    key = compute_cache_key(digests, 2.0, options)
+
+    execution_changed = replace(
+        options, fused_execution=True, write_process_graph=False
+    )
+    assert compute_cache_key(digests, 2.0, execution_changed) == key
+
+    options.processing_step_options.aroma_regression.implementation = "other"
+    assert compute_cache_key(digests, 2.0, options) == key
+
+    options.processing_step_options.spatial_smoothing.fwhm = 8
+    assert compute_cache_key(digests, 2.0, options) != key
+    assert compute_cache_key(digests, 1.5, PostProcessingOptions()) != key
+
+
+def test_provenance_cache_hit(tmp_path):
+    image_file = tmp_path / "image.nii.gz"
+    image_file.write_bytes(b"image")
+    export_path = tmp_path / "sub-0_task-rest_desc-postproc_bold.nii.gz"
+    manifest = {
+        "image_file": str(image_file),
+        "confounds_file": None,
+        "mask_file": None,
+        "mixing_file": None,
+        "noise_file": None,
+        "tr": 2.0,
+    }
+    options = PostProcessingOptions()
+    digest_memo = {}
+    digests = get_input_digests(manifest, digest_memo)
+    key = compute_cache_key(digests, 2.0, options)
+
+    assert not is_cached(export_path, key)
+
+    export_path.write_bytes(b"output")
+    provenance_path = write_provenance(export_path, key, manifest, digests, options)
+
+    assert provenance_path.name == "sub-0_task-rest_desc-postproc_bold_provenance.json"
+    assert is_cached(export_path, key)
+
+    image_file.write_bytes(b"changed image")
+    changed_key = compute_cache_key(
+        get_input_digests(manifest, digest_memo), 2.0, options
+    )
+    assert not is_cached(export_path, changed_key)
@@ -1,3 +1,5 @@
+import nibabel as nib
+import numpy as np
 import pytest
 
 from clpipe.postprocutils.image_workflows import *
@@ -135,6 +137,37 @@ def test_butterworth_filter_wf(
     assert True
 
 
+def test_butterworth_filter_wf_chunked(artifact_dir, sample_raw_image, request, helpers):
+    """A small memory limit filters in slabs, giving the same image as filtering
+    the whole image."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    # Roughly five slices at a time
+    chunk_memory_limit = 64 * 64 * 10 * 4 * 3 * 5
+
+    filtered = {}
+    for memory_limit in (None, chunk_memory_limit):
+        filtered_path = test_path / f"sample_raw_filtered_{memory_limit}.nii.gz"
+        wf = build_butterworth_filter_workflow(
+            hp=0.008,
+            lp=0.1,
+            tr=2,
+            order=2,
+            in_file=sample_raw_image,
+            out_file=filtered_path,
+            memory_limit=memory_limit,
+            base_dir=test_path / str(memory_limit),
+            crashdump_dir=test_path,
+        )
+        wf.run()
+        filtered[memory_limit] = nib.load(filtered_path).get_fdata()
+
+    expected = filtered[None]
+    assert filtered[chunk_memory_limit].shape == expected.shape
+    assert np.allclose(
+        filtered[chunk_memory_limit], expected, atol=1e-4 * np.abs(expected).max()
+    )
+
+
 def test_fslmath_temporal_filter_wf(
     artifact_dir, sample_raw_image, plot_img, write_graph, request, helpers
 ):
@@ -299,6 +332,52 @@ def test_confound_regression_afni_3dTproject_wf(
         helpers.plot_4D_img_slice(regressed_path, "regressed.png")
 
 
+def test_confound_regression_numpy_ols_wf(
+    artifact_dir,
+    sample_raw_image,
+    sample_confounds_timeseries,
+    sample_raw_image_mask,
+    request,
+    helpers,
+):
+    """Test that numpy_ols gives the least squares residuals within the mask, as
+    fsl_glm does."""
+    import numpy as np
+    import nibabel as nib
+    import pandas as pd
+    from clpipe.postprocutils.utils import regress
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    confounds_path = test_path / "confounds.tsv"
+    confounds = pd.read_csv(sample_confounds_timeseries, sep="\t")
+    confounds = confounds[["csf", "csf_derivative1", "white_matter"]].head(10)
+    confounds.to_csv(confounds_path, sep="\t", index=False, na_rep="n/a")
+
+    regressed_path = test_path / "sample_raw_regressed.nii.gz"
+
+    wf = build_confound_regression_numpy_ols_workflow(
+        confounds_file=confounds_path,
+        in_file=sample_raw_image,
+        out_file=regressed_path,
+        mask_file=sample_raw_image_mask,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    data = nib.load(sample_raw_image).get_fdata()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    regressed = nib.load(regressed_path).get_fdata()
+
+    expected = regress(confounds.fillna(0).to_numpy(), data[mask].T).T
+
+    assert np.allclose(
+        regressed[mask], expected, atol=1e-4 * np.abs(data[mask]).max()
+    )
+    assert not regressed[~mask].any()
+
+
 def test_apply_aroma_fsl_regfilt_wf(
     artifact_dir,
     sample_raw_image,
@@ -528,3 +607,236 @@ def test_scrubbing_wf_aroma(artifact_dir, sample_melodic_mixing, request, helper
         crashdump_dir=test_path,
     )
     wf.run()
+
+
+def test_fused_workflow_matches_chained(
+    artifact_dir, sample_raw_image, request, helpers
+):
+    """Test that fused execution gives the same image as running each step on its
+    own."""
+    import numpy as np
+    import nibabel as nib
+    from clpipe.config.options import PostProcessingOptions
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    processing_options = PostProcessingOptions()
+    processing_options.processing_steps = [
+        "TemporalFiltering",
+        "TrimTimepoints",
+        "ScrubTimepoints",
+    ]
+    step_options = processing_options.processing_step_options
+    step_options.temporal_filtering.implementation = "Butterworth"
+    step_options.trim_timepoints.from_beginning = 1
+    step_options.scrub_timepoints.insert_na = False
+    scrub_vector = [0, 1, 0, 0, 0, 0, 1, 0, 0]
+
+    out_paths = {}
+    for fused in (False, True):
+        processing_options.fused_execution = fused
+        out_paths[fused] = test_path / f"fused_{fused}.nii"
+        wf = build_image_postprocessing_workflow(
+            processing_options,
+            in_file=sample_raw_image,
+            export_path=out_paths[fused],
+            name=f"postproc_fused_{fused}",
+            tr=2,
+            scrub_vector=scrub_vector,
+            base_dir=test_path,
+            crashdump_dir=test_path,
+        )
+        wf.run()
+
+    chained = nib.load(out_paths[False]).get_fdata()
+    fused = nib.load(out_paths[True]).get_fdata()
+
+    assert chained.shape == fused.shape == (64, 64, 36, 7)
+    assert np.allclose(chained, fused, rtol=1e-4, atol=1e-3 * np.abs(chained).max())
+
+
+def test_fused_workflow_masked(
+    artifact_dir, sample_raw_image, sample_raw_image_mask, request, helpers
+):
+    """Test that a fused group ending in a mask, which processes only in-mask
+    voxels, matches processing the whole image."""
+    import numpy as np
+    import nibabel as nib
+    from clpipe.postprocutils.nodes import FUSED_BUTTERWORTH, FUSED_SCRUB, FUSED_MASK
+    from clpipe.postprocutils.utils import calc_filter, apply_filter
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    out_path = test_path / "fused_masked.nii"
+    scrub_vector = [0, 0, 1, 0, 0, 0, 0, 0, 0, 0]
+
+    wf = build_fused_workflow(
+        [
+            {"operation": FUSED_BUTTERWORTH, "hp": 0.01, "lp": 0.1, "tr": 2, "order": 2},
+            {"operation": FUSED_SCRUB, "insert_na": True},
+            {"operation": FUSED_MASK},
+        ],
+        in_file=sample_raw_image,
+        out_file=out_path,
+        scrub_vector=scrub_vector,
+        mask_file=sample_raw_image_mask,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    data = nib.load(sample_raw_image).get_fdata()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    expected = apply_filter(calc_filter(0.01, 0.1, 2, 2), data, axis=-1)
+    expected = expected * mask[..., np.newaxis]
+    expected[..., 2] = np.nan
+
+    fused = nib.load(out_path).get_fdata()
+
+    # The integer sample image stores scrubbed volumes as 0
+    assert np.allclose(fused[..., 2], 0, atol=1e-6)
+    fused = np.delete(fused, 2, axis=-1)
+    expected = np.delete(expected, 2, axis=-1)
+    assert np.allclose(fused, expected, atol=1e-3 * np.abs(expected).max())
+
+
+def test_group_fusable_steps():
+    from clpipe.config.options import PostProcessingOptions
+    from clpipe.postprocutils.image_workflows import _group_fusable_steps
+
+    processing_options = PostProcessingOptions()
+    processing_options.processing_step_options.temporal_filtering.implementation = (
+        "Butterworth"
+    )
+
+    step_groups = _group_fusable_steps(
+        [
+            "TemporalFiltering",
+            "TrimTimepoints",
+            "SpatialSmoothing",
+            "ScrubTimepoints",
+            "ApplyMask",
+        ],
+        processing_options,
+    )
+
+    assert step_groups == [
+        ["TemporalFiltering", "TrimTimepoints"],
+        ["SpatialSmoothing"],
+        ["ScrubTimepoints", "ApplyMask"],
+    ]
+
+
+@pytest.mark.parametrize("intermediate_format", ["nii", "nii.gz", "nii.zst"])
+def test_intermediate_format(
+    artifact_dir, sample_raw_image, request, helpers, intermediate_format
+):
+    """Test that intermediates use the configured format, while the exported image
+    is still a gzipped NIfTI."""
+    import nibabel as nib
+    from clpipe.config.options import PostProcessingOptions
+
+    if intermediate_format == "nii.zst":
+        pytest.importorskip("pyzstd")
+
+    # nipype globs its node directories, so keep brackets out of the path
+    test_path = helpers.create_test_dir(
+        artifact_dir, f"{request.node.originalname}_{intermediate_format}"
+    )
+    out_path = test_path / "postprocessed.nii.gz"
+
+    processing_options = PostProcessingOptions()
+    processing_options.processing_steps = ["TemporalFiltering", "TrimTimepoints"]
+    processing_options.processing_step_options.temporal_filtering.implementation = (
+        "Butterworth"
+    )
+    processing_options.intermediate_format = intermediate_format
+
+    wf = build_image_postprocessing_workflow(
+        processing_options,
+        in_file=sample_raw_image,
+        export_path=out_path,
+        tr=2,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    intermediates = [
+        path.name
+        for path in (test_path / wf.name).rglob("*_sliced.*")
+        if path.name.startswith("sample_raw")
+    ]
+    assert intermediates == [f"sample_raw_filtered_sliced.{intermediate_format}"]
+
+    with open(out_path, "rb") as f:
+        assert f.read(2) == b"\x1f\x8b"
+    assert nib.load(out_path).shape == (64, 64, 36, 10)
+
+
+def test_step_cache_shared_prefix(
+    artifact_dir, sample_raw_image, request, helpers, tmp_path
+):
+    """Test that a stream sharing its first steps with an earlier stream starts
+    from the earlier stream's cached output."""
+    from dataclasses import replace
+    import numpy as np
+    import nibabel as nib
+    from clpipe.config.options import PostProcessingOptions
+    from clpipe.postprocutils.cache import hash_file
+
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    step_cache_dir = tmp_path / "step_cache"
+    input_digests = {"image_file": hash_file(sample_raw_image)}
+
+    processing_options = PostProcessingOptions()
+    processing_options.processing_steps = ["TrimTimepoints", "TemporalFiltering"]
+    step_options = processing_options.processing_step_options
+    step_options.trim_timepoints.from_beginning = 2
+    step_options.temporal_filtering.implementation = "Butterworth"
+
+    first_wf = build_image_postprocessing_workflow(
+        processing_options,
+        in_file=sample_raw_image,
+        name="first_stream",
+        tr=2,
+        step_cache_dir=step_cache_dir,
+        input_digests=input_digests,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    first_wf.run()
+    assert len(list(step_cache_dir.glob("*.nii*"))) == 2
+
+    # A stream with only the shared step is entirely cached
+    trim_options = replace(processing_options, processing_steps=["TrimTimepoints"])
+    out_path = test_path / "trimmed.nii.gz"
+    trim_wf = build_image_postprocessing_workflow(
+        trim_options,
+        in_file=sample_raw_image,
+        export_path=out_path,
+        name="trim_stream",
+        tr=2,
+        step_cache_dir=step_cache_dir,
+        input_digests=input_digests,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    assert trim_wf.list_node_names() == ["export_image", "inputnode", "outputnode"]
+    trim_wf.run()
+    assert nib.load(out_path).shape == (64, 64, 36, 8)
+
+    # A stream with different filtering only recomputes the filter
+    step_options.temporal_filtering.filtering_high_pass = 0.02
+    second_wf = build_image_postprocessing_workflow(
+        processing_options,
+        in_file=sample_raw_image,
+        name="second_stream",
+        tr=2,
+        step_cache_dir=step_cache_dir,
+        input_digests=input_digests,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    assert not any("trim" in node for node in second_wf.list_node_names())
+    second_wf.run()
+    assert len(list(step_cache_dir.glob("*.nii*"))) == 3
@@ -0,0 +1,54 @@
+import nipype.pipeline.engine as pe
+from nipype import config
+from nipype.interfaces.utility import Function
+
+from clpipe.postprocutils.profiling import *
+
+
+def _write_file(out_name, size):
+    import os
+
+    with open(out_name, "wb") as f:
+        f.write(b"0" * size)
+    return os.path.abspath(out_name)
+
+
+def test_node_profiler(tmp_path):
+    """Each node's profile is recorded, and summarized across images."""
+    enable_resource_monitor()
+    for image_name in ["image_a", "image_b"]:
+        wf = pe.Workflow(name=image_name, base_dir=tmp_path / "work")
+        write_node = pe.Node(
+            Function(
+                input_names=["out_name", "size"],
+                output_names=["out_file"],
+                function=_write_file,
+            ),
+            name="write_file",
+        )
+        write_node.inputs.out_name = "out.bin"
+        write_node.inputs.size = 1 << 20
+        wf.add_nodes([write_node])
+
+        profiler = NodeProfiler()
+        wf.run(plugin="Linear", plugin_args={"status_callback": profiler})
+        json_path, tsv_path = write_profile(
+            profiler.records, tmp_path / "logs" / "sub-1" / PROFILE_DIR_NAME, image_name
+        )
+
+        assert json_path.exists() and tsv_path.exists()
+        (record,) = profiler.records
+        assert record["node"] == "write_file"
+        assert record["status"] == "end"
+        assert record["wall_time"] > 0
+        assert record["bytes_written"] >= 1 << 20
+        assert record["peak_rss_gb"] > 0
+
+    profiles = load_profiles(tmp_path / "logs")
+    summary = summarize_profiles(profiles)
+
+    assert sorted(profiles["image"].unique()) == ["image_a", "image_b"]
+    assert list(summary["node"]) == ["write_file"]
+    assert summary.loc[0, "images"] == 2
+
+    config.disable_resource_monitor()
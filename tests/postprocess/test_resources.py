@@ -0,0 +1,119 @@
+import nibabel as nib
+import numpy as np
+
+from clpipe.postprocutils.resources import *
+from clpipe.utils import parse_memory, parse_time
+
+STEPS = ["TemporalFiltering", "SpatialSmoothing"]
+
+
+def test_estimate_scales_with_image(tmp_path):
+    """Larger images are given more memory and time."""
+    small_image = tmp_path / "small.nii.gz"
+    large_image = tmp_path / "large.nii.gz"
+    nib.save(nib.Nifti1Image(np.zeros((4, 4, 4, 10), np.int16), np.eye(4)), small_image)
+    nib.save(
+        nib.Nifti1Image(np.zeros((64, 64, 64, 200), np.int8), np.eye(4)),
+        large_image,
+    )
+
+    small = estimate_job_resources(small_image, STEPS, memory_like="20G")
+    large = estimate_job_resources(large_image, STEPS, memory_like="20G")
+
+    assert small == {"mem_use": "1G", "time": "0:10:00"}
+    assert large["mem_use"].endswith("G")
+    assert parse_memory(large["mem_use"]) > parse_memory(small["mem_use"])
+    assert (
+        predict_resources(get_image_dimensions(large_image), STEPS)["time"]
+        > predict_resources(get_image_dimensions(small_image), STEPS)["time"]
+    )
+    # Memory is given in the unit of the configured memory usage
+    assert estimate_job_resources(small_image, STEPS, memory_like="20000")[
+        "mem_use"
+    ].isdigit()
+
+
+def test_estimate_learns_from_history(tmp_path):
+    image_file = tmp_path / "image.nii.gz"
+    nib.save(
+        nib.Nifti1Image(np.zeros((50, 50, 50, 200), np.float32), np.eye(4)), image_file
+    )
+    history_file = tmp_path / "resource_history.tsv"
+    prediction = predict_resources(get_image_dimensions(image_file), STEPS)
+    static = estimate_job_resources(image_file, STEPS, history_file=history_file)
+
+    # Jobs used half the predicted memory and twice the predicted time
+    for _ in range(MIN_HISTORY):
+        record_job_resources(
+            history_file,
+            image_file,
+            STEPS,
+            elapsed_time=prediction["time"] * 2,
+            peak_memory=int(prediction["memory"] / 2),
+        )
+    # Jobs with other steps are not learned from
+    record_job_resources(
+        history_file, image_file, ["Resample"], elapsed_time=1, peak_memory=1
+    )
+    learned = estimate_job_resources(image_file, STEPS, history_file=history_file)
+
+    assert parse_memory(learned["mem_use"]) < parse_memory(static["mem_use"])
+    assert parse_time(learned["time"]) > parse_time(static["time"])
+
+
+def test_process_tree_memory_adds_up_children():
+    """The monitor counts children running at once, which the rusage peak of the
+    largest single child does not."""
+    import multiprocessing
+
+    def hold_memory(ready, done):
+        data = np.ones(100 * 1024**2 // 8)  # noqa: F841
+        ready.set()
+        done.wait()
+
+    context = multiprocessing.get_context("fork")
+    done = context.Event()
+    events = [context.Event() for _ in range(2)]
+    workers = [
+        context.Process(target=hold_memory, args=(ready, done)) for ready in events
+    ]
+    with ProcessTreeMemoryMonitor(interval=0.05) as monitor:
+        for worker in workers:
+            worker.start()
+        for ready in events:
+            ready.wait()
+        monitor.sample()
+        done.set()
+        for worker in workers:
+            worker.join()
+
+    assert monitor.peak_memory >= 200 * 1024**2
+
+
+def test_record_job_resources_concurrently(tmp_path):
+    """Jobs recording at once each write a whole row, under a single header."""
+    import csv
+    import multiprocessing
+
+    image_file = tmp_path / "image.nii.gz"
+    nib.save(nib.Nifti1Image(np.zeros((4, 4, 4, 10), np.int16), np.eye(4)), image_file)
+    history_file = tmp_path / "resource_history.tsv"
+
+    def record_jobs():
+        for _ in range(20):
+            record_job_resources(
+                history_file, image_file, STEPS, elapsed_time=1, peak_memory=1
+            )
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=record_jobs) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    with open(history_file, newline="") as f:
+        rows = list(csv.DictReader(f, delimiter="\t"))
+    assert len(rows) == 80
+    assert all(list(row) == HISTORY_COLUMNS for row in rows)
+    assert all(row["peak_memory"] == "1" for row in rows)
@@ -0,0 +1,31 @@
+import numpy as np
+
+from clpipe.postprocutils.spec_interpolate import spec_inter
+
+
+def test_spec_inter_only_replaces_scrubbed():
+    rng = np.random.default_rng(0)
+    timepoints = np.arange(60)
+    signal = np.sin(2 * np.pi * 0.05 * timepoints)[:, np.newaxis]
+    data = 100 * signal + rng.normal(0, 1, (60, 25))
+    scrub_mask = np.zeros(60, dtype=int)
+    scrub_mask[[10, 11, 40]] = 1
+
+    interpolated = spec_inter(data, 2.0, 8, scrub_mask, 1, binSize=25)
+
+    assert np.array_equal(interpolated[scrub_mask == 0], data[scrub_mask == 0])
+    assert not np.allclose(interpolated[scrub_mask == 1], data[scrub_mask == 1])
+
+
+def test_spec_inter_bins_and_threads():
+    """Binning voxels and spreading bins over threads does not change the
+    result."""
+    rng = np.random.default_rng(1)
+    data = rng.normal(500, 20, (40, 103)).astype(np.float32)
+    scrub_mask = np.zeros(40, dtype=int)
+    scrub_mask[[0, 5, 6, 30]] = 1
+
+    single = spec_inter(data, 2.0, 8, scrub_mask, 1, binSize=103, n_threads=1)
+    binned = spec_inter(data, 2.0, 8, scrub_mask, 1, binSize=10, n_threads=4)
+
+    assert np.array_equal(single, binned)
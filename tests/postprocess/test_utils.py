@@ -1,6 +1,23 @@
-from clpipe.postprocutils.utils import nii_to_matrix, matrix_to_nii, scrub_image
+from clpipe.postprocutils.utils import (
+    nii_to_matrix,
+    matrix_to_nii,
+    scrub_image,
+    calc_filter,
+    apply_filter,
+    butterworth_filter_chunked,
+    read_image_volumes,
+    get_scrub_vector,
+    get_scrub_vector_from_confounds,
+    regress_confounds,
+    MaskedMatrix,
+    save_image,
+)
+from clpipe.config.options import ScrubColumn
 import nibabel as nib
+import pytest
+from nibabel.openers import ImageOpener
 import numpy as np
+import pandas as pd
 
 
 def test_nii_to_matrix(sample_raw_image):
@@ -27,6 +44,42 @@ def test_matrix_to_nii(sample_raw_image):
     assert np.array_equal(nii.affine, orig_affine)
 
 
+def test_masked_matrix(sample_raw_image, sample_raw_image_mask):
+    """The masked matrix holds only in-mask voxels and scatters back to the
+    original image, with 0 outside of the mask."""
+    data = nib.load(sample_raw_image).get_fdata()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+
+    matrix = MaskedMatrix.from_image(sample_raw_image, sample_raw_image_mask)
+
+    assert matrix.data.shape == (data.shape[-1], mask.sum())
+    assert np.array_equal(matrix.to_array(), data * mask[..., np.newaxis])
+
+    # Timepoints missing from every in-mask voxel are missing everywhere
+    matrix.data[3] = np.nan
+    assert np.isnan(matrix.to_array()[..., 3]).all()
+
+
+def test_masked_matrix_scaled_image(tmp_path, sample_raw_image_mask):
+    """Scaled images are gathered from their stored values, matching their
+    floating point data."""
+    mask_img = nib.load(sample_raw_image_mask)
+    stored = np.random.default_rng(0).integers(
+        0, 1000, mask_img.shape + (4,), dtype=np.int16
+    )
+    img = nib.Nifti1Image(stored, mask_img.affine)
+    img.header.set_slope_inter(0.5, 10)
+    image_path = tmp_path / "scaled.nii"
+    nib.save(img, image_path)
+    data = nib.load(image_path).get_fdata(dtype=np.float32)
+
+    matrix = MaskedMatrix.from_image(image_path, sample_raw_image_mask, np.float32)
+
+    assert matrix.data.dtype == np.float32
+    mask = mask_img.get_fdata() > 0
+    assert np.allclose(matrix.to_array(), data * mask[..., np.newaxis])
+
+
 def test_scrub_image_no_insert_na(
     artifact_dir, sample_raw_image, plot_img, request, helpers
 ):
@@ -43,3 +96,186 @@ def test_scrub_image_no_insert_na(
 
     if plot_img:
         helpers.plot_4D_img_slice(scrubbed_path, "scrubbed.png")
+
+
+def test_scrub_image_chunked(artifact_dir, sample_raw_image, request, helpers):
+    """Test that scrubbing blocks of volumes in float32 gives the expected image."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    scrub_vector = [0, 1, 0, 0, 0, 0, 1, 1, 0, 0]
+    data = nib.load(sample_raw_image).get_fdata()
+
+    for insert_na in (True, False):
+        out_path = test_path / f"scrubbed_{insert_na}.nii.gz"
+        # Roughly three volumes at a time
+        scrub_image(
+            sample_raw_image,
+            scrub_vector,
+            insert_na=insert_na,
+            export_path=out_path,
+            memory_limit=64 * 64 * 36 * 4 * 2 * 3,
+        )
+
+        if insert_na:
+            expected = data.copy()
+            expected[..., [1, 6, 7]] = np.nan
+        else:
+            expected = np.delete(data, [1, 6, 7], axis=-1)
+
+        scrubbed = nib.load(out_path)
+        assert scrubbed.get_data_dtype() == np.float32
+        assert np.array_equal(scrubbed.get_fdata(), expected, equal_nan=True)
+
+
+def test_butterworth_filter_chunked(artifact_dir, sample_raw_image, request, helpers):
+    """Test that filtering slabs in float32 matches filtering the whole image."""
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+    sos = calc_filter(0.008, 0.1, 2, 2)
+
+    expected = apply_filter(sos, nib.load(sample_raw_image).get_fdata(), axis=-1)
+    # Uncompressed inputs are read through a memory map, compressed ones are
+    #   decompressed first
+    uncompressed_image = test_path / "raw.nii"
+    nib.save(nib.load(sample_raw_image), uncompressed_image)
+
+    for in_file in (sample_raw_image, uncompressed_image):
+        for out_name in ("filtered.nii", "filtered.nii.gz"):
+            out_path = test_path / out_name
+            # Roughly five slices at a time
+            butterworth_filter_chunked(
+                in_file, out_path, sos, memory_limit=64 * 64 * 10 * 4 * 3 * 5
+            )
+            filtered = nib.load(out_path).get_fdata()
+
+            assert filtered.shape == expected.shape
+            assert np.allclose(filtered, expected, atol=1e-4 * np.abs(expected).max())
+
+
+def test_read_image_volumes(tmp_path, monkeypatch):
+    """Blocks of volumes match the image's data, and a compressed image is read
+    through once."""
+    stored = np.random.default_rng(0).integers(0, 1000, (6, 5, 4, 10), dtype=np.int16)
+    img = nib.Nifti1Image(stored, np.eye(4))
+    img.header.set_slope_inter(0.5, 10)
+    image_path = tmp_path / "scaled.nii.gz"
+    nib.save(img, image_path)
+    expected = nib.load(image_path).get_fdata()
+
+    bytes_read = []
+    opener_read = ImageOpener.read
+
+    def read(self, *args):
+        data = opener_read(self, *args)
+        bytes_read.append(len(data))
+        return data
+
+    monkeypatch.setattr(ImageOpener, "read", read)
+    # Loading the image reads its header
+    nib.load(image_path)
+    header_bytes = sum(bytes_read)
+    bytes_read.clear()
+    blocks = list(read_image_volumes(image_path, 3))
+
+    assert [start for start, _ in blocks] == [0, 3, 6, 9]
+    assert all(block.dtype == np.float32 for _, block in blocks)
+    assert np.allclose(np.concatenate([block for _, block in blocks], -1), expected)
+    assert sum(bytes_read) == header_bytes + stored.nbytes
+
+
+@pytest.mark.parametrize("extension,levels", [("nii.gz", (1, 9)), ("nii.zst", (1, 19))])
+def test_save_image_compression_level(tmp_path, sample_raw_image, extension, levels):
+    """The compression level applies to the file being saved only, leaving
+    nibabel's defaults as they were."""
+    image = nib.load(sample_raw_image)
+    default_compresslevel = ImageOpener.default_compresslevel
+    default_level_or_option = dict(ImageOpener.default_level_or_option)
+
+    sizes = []
+    for compression_level in levels:
+        out_path = tmp_path / f"image_{compression_level}.{extension}"
+        save_image(image, out_path, compression_level)
+        sizes.append(out_path.stat().st_size)
+
+        assert np.array_equal(nib.load(out_path).get_fdata(), image.get_fdata())
+    assert sizes[1] < sizes[0]
+    assert ImageOpener.default_compresslevel == default_compresslevel
+    assert ImageOpener.default_level_or_option == default_level_or_option
+
+
+def _list_based_scrub_vector(fdts, fd_thres, fd_behind, fd_ahead, fd_contig):
+    """The original list-based get_scrub_vector, kept as a reference."""
+    scrubTargets = [i for i, e in enumerate(fdts) if e > fd_thres]
+    for t in np.arange(0, fd_behind + 1):
+        scrubTargets.extend(scrubTargets - t)
+    for t in np.arange(0, fd_ahead + 1):
+        scrubTargets.extend(scrubTargets + t)
+    scrubTargets = set(e for e in set(scrubTargets) if 0 <= e <= len(fdts) - 1)
+    scrubVect = [1 if i in scrubTargets else 0 for i in range(len(fdts))]
+
+    if fd_contig > 0:
+        target = [0] * fd_contig
+        scrubVectTemp = [1] * len(fdts)
+        for start in range(len(fdts)):
+            if scrubVect[start : start + fd_contig] == target:
+                scrubVectTemp[start : start + fd_contig] = target
+        scrubVect = scrubVectTemp
+    return scrubVect
+
+
+def test_get_scrub_vector_matches_list_based():
+    """Test that the vectorized scrub vector matches the original implementation
+    across random timeseries and settings."""
+    rng = np.random.default_rng(0)
+
+    for _ in range(300):
+        fdts = rng.exponential(0.3, rng.integers(1, 80))
+        fdts[0] = np.nan
+        settings = (
+            0.5,
+            int(rng.integers(0, 4)),
+            int(rng.integers(0, 4)),
+            int(rng.integers(0, 6)),
+        )
+
+        assert get_scrub_vector(fdts, *settings) == _list_based_scrub_vector(
+            fdts, *settings
+        )
+
+
+def test_get_scrub_vector_from_confounds(sample_confounds_timeseries):
+    """Test that the batch scrub vector is the OR of each expanded column's
+    vector."""
+    confounds = pd.read_csv(sample_confounds_timeseries, sep="\t")
+    scrub_columns = [
+        ScrubColumn(target_variable="csf", threshold=332.44),
+        ScrubColumn(
+            target_variable="trans_*", threshold=0.05, scrub_ahead=1, scrub_contiguous=2
+        ),
+    ]
+
+    expected = np.zeros(len(confounds), dtype=int)
+    expected |= get_scrub_vector(confounds["csf"], 332.44, 0, 0, 0)
+    for column in ("trans_x", "trans_y", "trans_z"):
+        expected |= get_scrub_vector(confounds[column], 0.05, 0, 1, 2)
+
+    assert get_scrub_vector_from_confounds(confounds, scrub_columns) == list(
+        expected
+    )
+
+
+def test_regress_confounds_scrubbed_rank_deficient():
+    """Scrubbed timepoints are left out of the fit, and duplicated confound columns
+    give the same residuals as the full rank design."""
+    rng = np.random.default_rng(0)
+    design = rng.normal(size=(40, 3))
+    data = design @ rng.normal(size=(3, 50)) + rng.normal(size=(40, 50))
+    data[[5, 17]] = np.nan
+
+    residuals = regress_confounds(data, np.column_stack([design, design[:, 0]]), 7)
+
+    valid = ~np.isnan(data[:, 0])
+    beta = np.linalg.lstsq(design[valid], data[valid], rcond=None)[0]
+    expected = data[valid] - design[valid] @ beta
+
+    assert residuals.dtype == np.float32
+    assert np.isnan(residuals[~valid]).all()
+    assert np.allclose(residuals[valid], expected, atol=1e-4)
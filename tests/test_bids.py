@@ -47,3 +47,87 @@ def test_no_ignore_BIDS_Indexer(clpipe_fmriprep_dir):
     )
 
     assert len(layout.get(datatype="anat")) != 0
+
+
+def _touch_bold(root: Path, subject: str, derivative=False):
+    func_dir = root / f"sub-{subject}" / "func"
+    func_dir.mkdir(parents=True, exist_ok=True)
+    name = f"sub-{subject}_task-rest_bold.nii.gz"
+    if derivative:
+        name = f"sub-{subject}_task-rest_space-MNI_desc-preproc_bold.nii.gz"
+    (func_dir / name).touch()
+
+
+def _make_dataset(tmp_path):
+    """Make raw and fMRIPrep datasets of two subjects, returning their folders."""
+    import json
+
+    bids_dir = tmp_path / "data_BIDS"
+    fmriprep_dir = tmp_path / "data_fmriprep"
+    bids_dir.mkdir()
+    fmriprep_dir.mkdir()
+    (bids_dir / "dataset_description.json").write_text(
+        json.dumps({"Name": "test", "BIDSVersion": "1.6.0"})
+    )
+    (fmriprep_dir / "dataset_description.json").write_text(
+        json.dumps(
+            {
+                "Name": "fMRIPrep",
+                "BIDSVersion": "1.6.0",
+                "DatasetType": "derivative",
+                "GeneratedBy": [{"Name": "fMRIPrep"}],
+            }
+        )
+    )
+    for subject in ("0", "1"):
+        _touch_bold(bids_dir, subject)
+        _touch_bold(fmriprep_dir, subject, derivative=True)
+
+    return bids_dir, fmriprep_dir
+
+
+def test_incremental_refresh(tmp_path):
+    """Test that an incremental refresh picks up added and removed subjects'
+    files, in both the raw data and the derivatives."""
+    import shutil
+    import time
+
+    bids_dir, fmriprep_dir = _make_dataset(tmp_path)
+    index_kwargs = dict(
+        database_path=tmp_path / "BIDS_index", fmriprep_dir=fmriprep_dir
+    )
+    layout = get_bids(bids_dir, refresh="full", **index_kwargs)
+    assert layout.get_subjects(scope="derivatives") == ["0", "1"]
+
+    # Directory mtimes can be coarse, so make sure the change is visible
+    time.sleep(0.01)
+    _touch_bold(bids_dir, "2")
+    _touch_bold(fmriprep_dir, "2", derivative=True)
+    shutil.rmtree(fmriprep_dir / "sub-0")
+
+    layout = get_bids(bids_dir, refresh="incremental", **index_kwargs)
+
+    assert sorted(layout.get_subjects(scope="raw")) == ["0", "1", "2"]
+    assert sorted(layout.get_subjects(scope="derivatives")) == ["1", "2"]
+    assert len(layout.get(subject="2", desc="preproc", scope="derivatives")) == 1
+
+
+def test_incremental_refresh_fallback(tmp_path, monkeypatch):
+    """Test that the index is rebuilt when the pybids internals the incremental
+    refresh relies on are missing."""
+    import clpipe.bids
+
+    def reindex_subject_dirs(layout, subject_dirs, ignore):
+        raise AttributeError("'BIDSLayoutIndexer' object has no attribute '_config'")
+
+    bids_dir, fmriprep_dir = _make_dataset(tmp_path)
+    index_kwargs = dict(
+        database_path=tmp_path / "BIDS_index", fmriprep_dir=fmriprep_dir
+    )
+    get_bids(bids_dir, refresh="full", **index_kwargs)
+    _touch_bold(fmriprep_dir, "2", derivative=True)
+    monkeypatch.setattr(clpipe.bids, "_reindex_subject_dirs", reindex_subject_dirs)
+
+    layout = get_bids(bids_dir, refresh="incremental", **index_kwargs)
+
+    assert sorted(layout.get_subjects(scope="derivatives")) == ["0", "1", "2"]
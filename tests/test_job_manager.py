@@ -1,4 +1,7 @@
+import pandas as pd
 import pytest
+import time
+from pathlib import Path
 from clpipe.job_manager import *
 
 SLURMUNCCONFIG: str = "tests/data/legacy_batch_configs/slurmUNCConfigSnakeCase.json"
@@ -76,3 +79,226 @@ def test_local_manager_instantiation(scatch_dir):
     assert process2.stdout.decode("utf-8") == "running\n"
 
     assert len(local_manager.job_queue) == 0
+
+
+def test_local_manager_concurrent_logs(scatch_dir):
+    local_manager = JobManagerFactory.get(output_directory=scatch_dir, n_jobs=3)
+
+    for index in range(3):
+        local_manager.add_job(f"job{index}", f"sleep 0.5; echo job{index}")
+    local_manager.add_job("failing", "echo oops; exit 3")
+
+    start = time.perf_counter()
+    processes = local_manager.submit_jobs()
+    elapsed = time.perf_counter() - start
+
+    # The three sleeping jobs ran at the same time
+    assert elapsed < 1.4
+    assert [process.returncode for process in processes] == [0, 0, 0, 3]
+    assert (Path(scatch_dir) / "Output-job1.out").read_text() == "job1\n"
+    assert (Path(scatch_dir) / "Output-failing.out").read_text() == "oops\n"
+    assert len(local_manager.job_queue) == 0
+
+
+def test_local_manager_memory_budget(scatch_dir):
+    local_manager = JobManagerFactory.get(
+        output_directory=scatch_dir, n_jobs=8, memory_budget="50G", mem_use="20G"
+    )
+    for index in range(8):
+        local_manager.add_job(index, "true")
+
+    assert local_manager.get_concurrency() == 2
+
+
+def test_batch_manager_job_array(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.array_command_active = True
+    batch_config.array_throttle = 50
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir
+    )
+    batch_manager.add_job("job1", "echo first")
+    batch_manager.add_job("job2", "echo second; exit 2")
+
+    script_path = batch_manager.write_array_files("array-test", batch_manager.job_queue)
+    submission = batch_manager.create_array_submission("array-test", 2, script_path)
+
+    assert submission.startswith("sbatch --no-requeue")
+    assert submission.endswith(f"--array=1-2%50 {script_path}")
+    assert "--wrap" not in submission
+
+    # Run the array's second task as the scheduler would
+    process = subprocess.run(
+        ["bash", script_path], env={**os.environ, "SLURM_ARRAY_TASK_ID": "2"}
+    )
+    assert process.returncode == 2
+    assert (Path(scatch_dir) / "Output-job2.out").read_text() == "second\n"
+    assert not (Path(scatch_dir) / "Output-job1.out").exists()
+
+
+def test_batch_manager_job_resources(scatch_dir):
+    """Jobs can request their own memory and time, and bundles request the most
+    any of their jobs need."""
+    batch_manager = JobManagerFactory.get(
+        batch_config=BatchManagerConfig.from_default("unc"),
+        output_directory=scatch_dir,
+        mem_use="20G",
+        time="2:0:0",
+    )
+    small_job = batch_manager.add_job(
+        "small", "echo small", resources={"mem_use": "2G", "time": "0:30:00"}
+    )
+    large_job = batch_manager.add_job(
+        "large", "echo large", resources={"mem_use": "6G", "time": "0:20:00"}
+    )
+    default_job = batch_manager.add_job("default", "echo default")
+
+    assert "--mem=2G --time=0:30:00" in small_job.job_string
+    assert "--mem=20G --time=2:0:0" in default_job.job_string
+    assert batch_manager.get_max_resources([small_job, large_job]) == {
+        "mem_use": "6G",
+        "time": "0:30:00",
+        "threads": "1",
+    }
+
+
+def test_batch_manager_bundles(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.bundle_target_time = "3:0:0"
+    batch_config.bundle_workers = 2
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config,
+        output_directory=scatch_dir,
+        mem_use="4G",
+        time="1:0:0",
+        threads="2",
+    )
+    assert batch_manager.get_bundle_size() == 3
+
+    for index in range(4):
+        batch_manager.add_job(f"job{index}", f"echo job{index}; exit {index % 2}")
+    bundles, resources = batch_manager.bundle_jobs(batch_manager.job_queue, 3)
+
+    # Two of the three jobs run at once, taking two job lengths
+    assert resources == {"mem_use": "8G", "time": "2:00:00", "threads": "4"}
+    assert len(bundles) == 2
+    assert "--mem=8G --time=2:00:00 --cpus-per-task=4" in bundles[0].job_string
+    assert bundles[0].command.startswith("run_job_bundle ")
+
+    manifest_path = bundles[0].command.split()[1]
+    processes = run_job_bundle(manifest_path, scatch_dir, n_workers=2)
+
+    assert [process.returncode for process in processes] == [0, 1, 0]
+    assert (Path(scatch_dir) / "Output-job2.out").read_text() == "job2\n"
+    status_path = Path(manifest_path).with_name(
+        Path(manifest_path).stem + BUNDLE_STATUS_SUFFIX
+    )
+    assert status_path.read_text().splitlines() == [
+        "job_name\texit_status",
+        "job0\t0",
+        "job1\t1",
+        "job2\t0",
+    ]
+
+
+def test_batch_manager_dependencies(tmp_path):
+    """Jobs are held on the scheduler IDs of the jobs they depend on."""
+    submission_log = tmp_path / "submissions.txt"
+    fake_sbatch = tmp_path / "sbatch"
+    fake_sbatch.write_text(
+        "#!/bin/bash\n"
+        f'printf "%s\\n" "$*" >> {submission_log}\n'
+        f"echo Submitted batch job $(wc -l < {submission_log})\n"
+    )
+    fake_sbatch.chmod(0o755)
+
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.submission_head = str(fake_sbatch)
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=tmp_path
+    )
+    convert_job = batch_manager.add_job("convert", "echo convert")
+    batch_manager.add_job("preprocess", "echo preprocess", dependencies=[convert_job])
+    jobs = batch_manager.submit_jobs()
+
+    assert [job.scheduler_id for job in jobs] == ["1", "2"]
+    submissions = submission_log.read_text().splitlines()
+    assert "--dependency" not in submissions[0]
+    assert submissions[1].startswith("--dependency=afterany:1 ")
+
+
+@pytest.mark.parametrize("grouping", ["array", "bundle"])
+def test_batch_manager_dependent_allocations(tmp_path, grouping):
+    """Jobs depending on queued jobs are submitted after their parents' arrays or
+    bundles, held on those allocations' scheduler IDs."""
+    submission_log = tmp_path / "submissions.txt"
+    fake_sbatch = tmp_path / "sbatch"
+    fake_sbatch.write_text(
+        "#!/bin/bash\n"
+        f'printf "%s\\n" "$*" >> {submission_log}\n'
+        f"echo Submitted batch job $(wc -l < {submission_log})\n"
+    )
+    fake_sbatch.chmod(0o755)
+
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.submission_head = str(fake_sbatch)
+    if grouping == "array":
+        batch_config.array_command_active = True
+    else:
+        batch_config.bundle_target_time = "3:0:0"
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=tmp_path, time="1:0:0"
+    )
+    extract_jobs = [
+        batch_manager.add_job(f"extract{index}", f"echo extract{index}")
+        for index in range(3)
+    ]
+    batch_manager.add_job("consolidate", "echo consolidate", dependencies=extract_jobs)
+    jobs = batch_manager.submit_jobs()
+
+    assert [job.scheduler_id for job in jobs] == ["1", "1", "1", "2"]
+    submissions = submission_log.read_text().splitlines()
+    assert len(submissions) == 2
+    assert "--dependency" not in submissions[0]
+    assert submissions[1].startswith("--dependency=afterany:1 ")
+    assert "consolidate" in submissions[1]
+
+
+def test_batch_manager_submission_retry(tmp_path):
+    """Transient submission errors are retried, and every submission is recorded
+    in the ledger."""
+    fake_sbatch = tmp_path / "sbatch"
+    fake_sbatch.write_text(
+        "#!/bin/bash\n"
+        'name=$(printf "%s\\n" "$*" | grep -o "job-name=[a-z]*" | cut -d= -f2)\n'
+        f"attempts={tmp_path}/$name.attempts\n"
+        'echo >> "$attempts"\n'
+        'if [ "$name" = "flaky" ] && [ $(wc -l < "$attempts") -lt 3 ]; then\n'
+        '    echo "Socket timed out" >&2; exit 1\n'
+        "fi\n"
+        'if [ "$name" = "broken" ]; then echo "Invalid account" >&2; exit 1; fi\n'
+        'echo "Submitted batch job 10$(wc -l < "$attempts")"\n'
+    )
+    fake_sbatch.chmod(0o755)
+
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.submission_head = str(fake_sbatch)
+    batch_config.submit_concurrency = 3
+    batch_config.submit_rate = 100
+    batch_config.submit_retry_delay = 0
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=tmp_path
+    )
+    for name in ["steady", "flaky", "broken"]:
+        batch_manager.add_job(name, f"echo {name}")
+    jobs = batch_manager.submit_jobs()
+
+    assert [job.scheduler_id for job in jobs] == ["101", "103", None]
+    ledger = pd.read_csv(tmp_path / "submission_ledger.tsv", sep="\t")
+    ledger = ledger.set_index("job_name").sort_index()
+    assert list(ledger.columns) == LEDGER_COLUMNS[:1] + LEDGER_COLUMNS[2:]
+    assert ledger.loc["flaky", "attempts"] == 3
+    assert ledger.loc["flaky", "return_code"] == 0
+    # Errors not matching the transient pattern are not retried
+    assert ledger.loc["broken", "attempts"] == 1
+    assert ledger.loc["broken", "return_code"] == 1
@@ -0,0 +1,184 @@
+import logging
+
+import pytest
+
+from clpipe.config.options import BatchManagerConfig, ProjectOptions
+from clpipe.job_manager import JobManagerFactory
+import clpipe.pipeline as pipeline
+from clpipe.pipeline import *
+
+# The jobs each fake stage queues per subject. Subject 02 has no preprocessing jobs
+STAGE_JOBS = {
+    STAGE_CONVERSION: {"01": 1, "02": 1},
+    STAGE_PREPROCESS: {"01": 1, "02": 0},
+    STAGE_POSTPROCESS: {"01": 1, "02": 1},
+    STAGE_ROI_EXTRACTION: {"01": 2, "02": 1},
+}
+
+
+@pytest.fixture()
+def fake_stages(tmp_path, monkeypatch):
+    """Stages queue jobs from STAGE_JOBS on batch managers submitting to a fake
+    sbatch, which logs each submission. Returns the submission log."""
+    submission_log = tmp_path / "submissions.txt"
+    fake_sbatch = tmp_path / "sbatch"
+    fake_sbatch.write_text(
+        "#!/bin/bash\n"
+        f'printf "%s\\n" "$*" >> {submission_log}\n'
+        f"echo Submitted batch job $(wc -l < {submission_log})\n"
+    )
+    fake_sbatch.chmod(0o755)
+
+    def get_stage_manager(stage, options, processing_stream, debug):
+        batch_config = BatchManagerConfig.from_default("unc")
+        batch_config.submission_head = str(fake_sbatch)
+        return JobManagerFactory.get(
+            batch_config=batch_config, output_directory=tmp_path
+        )
+
+    def queue_stage(stage, subject, config_file, options, job_manager, *args):
+        # Jobs of a stage may depend on each other
+        first_job = None
+        for index in range(STAGE_JOBS[stage][subject]):
+            job = job_manager.add_job(
+                f"{stage}_{subject}_{index}",
+                f"echo {stage}",
+                dependencies=[first_job] if first_job else None,
+            )
+            first_job = first_job or job
+
+    monkeypatch.setattr(pipeline, "_get_stage_manager", get_stage_manager)
+    monkeypatch.setattr(pipeline, "_queue_stage", queue_stage)
+    return submission_log
+
+
+@pytest.fixture()
+def consolidate_config_file(config_file, tmp_path):
+    options = ProjectOptions.load(config_file)
+    options.roi_extraction.consolidate = True
+    consolidate_config_file = tmp_path / "clpipe_config.json"
+    options.dump(consolidate_config_file)
+    return consolidate_config_file
+
+
+def test_queue_pipeline_stage_order(config_file, fake_stages):
+    """Stages are queued in pipeline order, whatever order they are given in."""
+    queued_jobs = queue_pipeline(
+        ["01", "02"],
+        config_file,
+        stages=[STAGE_POSTPROCESS, STAGE_CONVERSION],
+        submit=True,
+    )
+
+    assert list(queued_jobs) == [STAGE_CONVERSION, STAGE_POSTPROCESS]
+    submissions = fake_stages.read_text().splitlines()
+    assert ["job-name=convert2bids" in line for line in submissions] == [
+        True,
+        True,
+        False,
+        False,
+        False,
+    ]
+
+
+def test_queue_pipeline_dependencies(consolidate_config_file, fake_stages):
+    """Each subject's jobs wait on its own jobs from the stage before, or the
+    stage before that when a stage has none for it, keeping the dependencies
+    stages give their jobs. One job consolidates every subject's ROIs."""
+    queued_jobs = queue_pipeline(
+        ["01", "02"],
+        consolidate_config_file,
+        stages=[STAGE_PREPROCESS, STAGE_POSTPROCESS, STAGE_ROI_EXTRACTION],
+        submit=True,
+    )
+    jobs = {
+        job.job_name: job for stage_jobs in queued_jobs.values() for job in stage_jobs
+    }
+
+    def parents(job_name):
+        return [parent.job_name for parent in jobs[job_name].dependencies]
+
+    assert parents("preprocess_01_0") == []
+    assert parents(POSTPROCESS_INDEX_JOB_NAME) == ["preprocess_01_0"]
+    assert parents("postprocess_01_0") == [
+        "preprocess_01_0",
+        POSTPROCESS_INDEX_JOB_NAME,
+    ]
+    # Subject 02 has no preprocessing jobs to wait on
+    assert parents("postprocess_02_0") == [POSTPROCESS_INDEX_JOB_NAME]
+    assert parents("roi_extract_01_0") == ["postprocess_01_0"]
+    assert parents("roi_extract_01_1") == ["postprocess_01_0", "roi_extract_01_0"]
+    assert parents("roi_extract_02_0") == ["postprocess_02_0"]
+    assert parents("ROI_consolidate") == [
+        "roi_extract_01_0",
+        "roi_extract_01_1",
+        "roi_extract_02_0",
+    ]
+
+    submissions = fake_stages.read_text().splitlines()
+    assert len(submissions) == len(jobs) == 8
+    assert all(job.scheduler_id for job in jobs.values())
+    assert submissions[-1].startswith(
+        "--dependency=afterany:"
+        + ":".join(jobs[name].scheduler_id for name in parents("ROI_consolidate"))
+    )
+
+
+def test_get_postprocess_time(config_file, tmp_path):
+    """Postprocessing jobs request time for each of their subject's BOLD runs,
+    assuming subjects yet to be converted have as many as others."""
+    options = ProjectOptions.load(config_file)
+    options.fmriprep.bids_directory = str(tmp_path)
+    options.postprocessing.batch_options.time_usage = "1:30:00"
+    func_dir = tmp_path / "sub-01" / "ses-1" / "func"
+    func_dir.mkdir(parents=True)
+    for run in range(3):
+        (func_dir / f"sub-01_ses-1_task-rest_run-{run}_bold.nii.gz").touch()
+    logger = logging.getLogger(STEP_NAME)
+
+    assert (
+        pipeline._get_postprocess_time("01", options, DEFAULT_PROCESSING_STREAM, logger)
+        == "4:30:00"
+    )
+    assert (
+        pipeline._get_postprocess_time("02", options, DEFAULT_PROCESSING_STREAM, logger)
+        == "4:30:00"
+    )
+
+
+def test_queue_pipeline_roi_extraction_before_postprocessing(config_file, tmp_path):
+    """ROI extraction jobs are queued before postprocessing has made their
+    images."""
+    options = ProjectOptions.load(config_file)
+    options.postprocessing.log_directory = str(tmp_path / "postprocess_logs")
+    options.roi_extraction.output_directory = str(tmp_path / "roi")
+    config_file = tmp_path / "clpipe_config.json"
+    options.dump(config_file)
+
+    queued_jobs = queue_pipeline(
+        ["01"], config_file, stages=[STAGE_POSTPROCESS, STAGE_ROI_EXTRACTION]
+    )
+    index_job, postprocess_job = queued_jobs[STAGE_POSTPROCESS]
+
+    assert queued_jobs[STAGE_ROI_EXTRACTION]
+    for job in queued_jobs[STAGE_ROI_EXTRACTION]:
+        assert job.dependencies == [postprocess_job]
+
+
+def test_queue_pipeline_postprocess_index(config_file, tmp_path):
+    """One job refreshes the BIDS index for all subjects, before any subject is
+    postprocessed from it."""
+    options = ProjectOptions.load(config_file)
+    options.postprocessing.log_directory = str(tmp_path / "postprocess_logs")
+    config_file = tmp_path / "clpipe_config.json"
+    options.dump(config_file)
+
+    queued_jobs = queue_pipeline(["01", "02"], config_file, stages=[STAGE_POSTPROCESS])
+    index_job, *subject_jobs = queued_jobs[STAGE_POSTPROCESS]
+
+    assert index_job.command.startswith("clpipe postprocess 01 02 ")
+    assert "-refresh_index=incremental" in index_job.command
+    assert "-submit" not in index_job.command
+    for job in subject_jobs:
+        assert job.dependencies == [index_job]
+        assert "-refresh_index" not in job.command
@@ -1,7 +1,8 @@
 import pytest
-from clpipe.config.options import ProcessingStream
+from clpipe.config.options import ProcessingStream, PostProcessingOptions
 
 from clpipe.postprocutils.image_workflows import *
+from clpipe import postprocess
 from clpipe.postprocess import *
 from pathlib import Path
 
@@ -139,3 +140,117 @@ def test_build_export_path_confounds(clpipe_fmriprep_dir: Path):
     assert str(export_path) == str(
         subject_out_dir / "func" / "sub-0_task-rest_desc-confounds_timeseries.tsv"
     )
+
+
+def test_image_manifest(artifact_dir, helpers, request):
+    """Test that a written image manifest is read back, and is passed to the image
+    job."""
+    from types import SimpleNamespace
+    from clpipe.utils import get_logger
+    from clpipe.postprocess import _create_image_submission_strings
+
+    test_dir = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    image_file = str(
+        test_dir / "sub-0_task-rest_space-MNI152NLin2009cAsym_desc-preproc_bold.nii.gz"
+    )
+    manifest = {
+        "image_file": image_file,
+        "subject": "0",
+        "entities": {"subject": "0", "task": "rest"},
+        "tr": 2.0,
+        "mask_file": None,
+        "confounds_file": None,
+        "mixing_file": None,
+        "noise_file": None,
+    }
+
+    manifest_file = write_image_manifest(manifest, test_dir / MANIFEST_DIR_NAME)
+
+    assert manifest_file.name == (
+        "sub-0_task-rest_space-MNI152NLin2009cAsym_desc-preproc_bold.json"
+    )
+    assert load_image_manifest(manifest_file) == manifest
+
+    submission_strings = _create_image_submission_strings(
+        test_dir / RUN_CONFIG_FILE_NAME,
+        [SimpleNamespace(path=image_file)],
+        {image_file: manifest_file},
+        test_dir,
+        test_dir,
+        test_dir,
+        False,
+        get_logger("test_image_manifest"),
+    )
+
+    (submission_string,) = submission_strings.values()
+    assert f"-manifest_file {manifest_file}" in submission_string
+
+
+def test_workflow_run_args():
+    """Image workflows run on MultiProc within the job's threads and memory."""
+    from clpipe.config.options import BatchOptions
+
+    batch_options = BatchOptions(memory_usage="20G", n_threads="4")
+    assert get_workflow_run_args(batch_options) == {
+        "plugin": "MultiProc",
+        "plugin_args": {"n_procs": 4, "memory_gb": 20},
+    }
+    # Estimated job memory takes the place of the batch options'
+    assert get_workflow_run_args(batch_options, {"mem_use": "6G"})["plugin_args"][
+        "memory_gb"
+    ] == 6
+
+    batch_options.n_threads = "1"
+    assert get_workflow_run_args(batch_options)["plugin"] == "Linear"
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_postprocess_subjects_hashes_only_to_cache(
+    clpipe_fmriprep_dir, tmp_path, monkeypatch, cache
+):
+    """Inputs are hashed when jobs are set up only if the cache is checked."""
+    # Only the fMRIPrep derivatives are needed, under a valid dataset root
+    bids_dir = tmp_path / "data_BIDS"
+    bids_dir.mkdir()
+    (bids_dir / "dataset_description.json").write_text(
+        '{"Name": "Postprocess test", "BIDSVersion": "1.4.0"}'
+    )
+    options = ProjectOptions.load(clpipe_fmriprep_dir / "clpipe_config.json")
+    options.fmriprep.bids_directory = str(bids_dir)
+    options.postprocessing.working_directory = str(tmp_path / "data_working")
+    options.postprocessing.output_directory = str(tmp_path / "data_postprocess")
+    options.postprocessing.log_directory = str(tmp_path / "logs")
+
+    hashed = []
+    monkeypatch.setattr(
+        "clpipe.postprocess.get_input_digests",
+        lambda manifest, memo=None: hashed.append(manifest["image_file"]) or {},
+    )
+
+    postprocess_subjects(subjects=["1"], config_file=options, batch=True, cache=cache)
+
+    assert bool(hashed) == cache
+
+
+@pytest.mark.parametrize(
+    "submitted_digests,step_cache,hashes",
+    [(None, False, False), (None, True, True), ({"image_file": "abc"}, True, False)],
+)
+def test_get_image_input_digests(monkeypatch, submitted_digests, step_cache, hashes):
+    """Image jobs hash their inputs only for the step cache, reusing any digests
+    made when the result cache was checked."""
+    hashed = []
+    monkeypatch.setattr(
+        "clpipe.postprocess.get_input_digests",
+        lambda manifest, memo=None: hashed.append(manifest["image_file"]) or {"x": 1},
+    )
+    manifest = {"image_file": "sub-1_bold.nii.gz"}
+    if submitted_digests:
+        manifest["input_digests"] = submitted_digests
+    options = PostProcessingOptions(step_cache=step_cache)
+
+    input_digests = postprocess._get_image_input_digests(manifest, options)
+
+    assert bool(hashed) == hashes
+    assert bool(input_digests) == bool(submitted_digests or step_cache)
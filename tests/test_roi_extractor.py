@@ -1,13 +1,19 @@
 import pytest
 from clpipe.config.options import ProjectOptions
+from clpipe import roi_extractor
 from pathlib import Path
 
+from clpipe.bids import get_bids
 from clpipe.roi_extractor import (
+    build_roi_manifest,
+    consolidate_roi_timeseries,
     fmri_roi_extraction,
     fmri_roi_extract_image,
     fmriprep_mask_finder,
+    get_batch_manager,
     STEP_NAME,
 )
+from clpipe.roi_outputs import read_store
 from clpipe.utils import get_logger
 
 
@@ -95,3 +101,156 @@ def test_fmriprep_mask_finder(clpipe_postproc_dir):
 
 
 
+
+def test_fmri_roi_extraction_single_pass(clpipe_postproc_dir, tmp_path):
+    """Extract several atlases from each image in one pass, as a per subject job
+    would."""
+    config_file_path = clpipe_postproc_dir / "clpipe_config.json"
+    config: ProjectOptions = ProjectOptions.load(config_file_path)
+    config.roi_extraction.atlases = ["power", "harvard_oxford"]
+    config.roi_extraction.target_directory = str(
+        clpipe_postproc_dir / "data_postproc" / "default"
+    )
+    config.roi_extraction.output_directory = str(tmp_path / "roi")
+    config.roi_extraction.job_grouping = "subject"
+    config_file_path = tmp_path / "clpipe_config.json"
+    config.dump(config_file_path)
+
+    fmri_roi_extraction(
+        subjects=["1"], single=True, config_file=config_file_path, task="gonogo"
+    )
+
+    image_name = "sub-1_task-gonogo_space-MNI152NLin2009cAsym_desc-postproc_bold"
+    for atlas_name in config.roi_extraction.atlases:
+        assert (
+            tmp_path / "roi" / atlas_name / f"{image_name}_atlas-{atlas_name}.csv"
+        ).exists()
+        assert (
+            tmp_path
+            / "roi"
+            / atlas_name
+            / f"{image_name}_atlas-{atlas_name}_voxel_prop.csv"
+        ).exists()
+
+
+def test_fmri_roi_extraction_image_jobs(clpipe_postproc_dir, tmp_path, monkeypatch):
+    """Queue one job per image, naming its image, for every atlas."""
+    config_file_path = clpipe_postproc_dir / "clpipe_config.json"
+    config: ProjectOptions = ProjectOptions.load(config_file_path)
+    config.roi_extraction.target_directory = str(
+        clpipe_postproc_dir / "data_postproc" / "default"
+    )
+    config.roi_extraction.output_directory = str(tmp_path / "roi")
+    config_file_path = tmp_path / "clpipe_config.json"
+    config.dump(config_file_path)
+
+    job_manager = get_batch_manager(config)
+    monkeypatch.setattr(
+        roi_extractor, "get_batch_manager", lambda config, debug=False: job_manager
+    )
+    fmri_roi_extraction(
+        subjects=["1"], config_file=config_file_path, job_grouping="image"
+    )
+
+    images = list(
+        (clpipe_postproc_dir / "data_postproc" / "default" / "sub-1").glob(
+            "**/*desc-postproc_bold.nii.gz"
+        )
+    )
+    assert len(job_manager.job_queue) == len(images)
+    for job in job_manager.job_queue:
+        assert "-image_file=" in job.job_string
+        assert "-manifest_file=" in job.job_string
+        assert "-atlas_name" not in job.job_string
+
+
+def test_fmri_roi_extraction_deferred_jobs(clpipe_dir, tmp_path):
+    """Jobs added to a caller's job manager are queued before their subject has
+    images, finding them when they run."""
+    config: ProjectOptions = ProjectOptions.load(clpipe_dir / "clpipe_config.json")
+    config.roi_extraction.atlases = ["power", "dosenbach"]
+    config.roi_extraction.output_directory = str(tmp_path / "roi")
+    config_file_path = tmp_path / "clpipe_config.json"
+    config.dump(config_file_path)
+
+    job_manager = get_batch_manager(config)
+    fmri_roi_extraction(
+        subjects=["01"], config_file=config_file_path, job_manager=job_manager
+    )
+
+    assert [job.job_name for job in job_manager.job_queue] == [
+        "ROI_extract_01_power",
+        "ROI_extract_01_dosenbach",
+    ]
+    for job in job_manager.job_queue:
+        assert "-manifest_file=" not in job.job_string
+        assert job.command.endswith("-single 01")
+
+
+def test_build_roi_manifest(clpipe_postproc_dir):
+    """Match each image to its fMRIPrep mask, by their entities."""
+    config: ProjectOptions = ProjectOptions.load(
+        clpipe_postproc_dir / "clpipe_config.json"
+    )
+    config.roi_extraction.target_directory = str(
+        clpipe_postproc_dir / "data_postproc" / "default"
+    )
+
+    manifest = build_roi_manifest("1", None, config, get_logger(STEP_NAME))
+
+    assert len(manifest) == 4
+    for target in manifest:
+        assert Path(target["mask_file"]).name == Path(
+            target["image_file"]
+        ).name.replace("desc-postproc_bold", "desc-brain_mask")
+
+
+def test_build_roi_manifest_indexed(clpipe_fmriprep_dir, tmp_path):
+    """Find images and masks in the BIDS index when it covers the target folder."""
+    config: ProjectOptions = ProjectOptions.load(
+        clpipe_fmriprep_dir / "clpipe_config.json"
+    )
+    config.roi_extraction.target_directory = str(clpipe_fmriprep_dir / "data_fmriprep")
+    config.roi_extraction.target_suffix = "desc-preproc_bold.nii.gz"
+    # Only the derivatives are needed, under a valid dataset root
+    bids_dir = tmp_path / "data_BIDS"
+    bids_dir.mkdir()
+    (bids_dir / "dataset_description.json").write_text(
+        '{"Name": "ROI test", "BIDSVersion": "1.4.0"}'
+    )
+    bids = get_bids(
+        bids_dir,
+        database_path=tmp_path / "bids_index",
+        fmriprep_dir=clpipe_fmriprep_dir / "data_fmriprep",
+    )
+
+    manifest = build_roi_manifest(
+        "1", "gonogo", config, get_logger(STEP_NAME), bids=bids
+    )
+
+    assert [Path(target["mask_file"]).name for target in manifest] == [
+        "sub-1_task-gonogo_space-MNI152NLin2009cAsym_desc-brain_mask.nii.gz"
+    ]
+
+
+def test_fmri_roi_extraction_consolidate(clpipe_postproc_dir, tmp_path):
+    """Save timeseries as NPZ and gather them into each atlas's store."""
+    config_file_path = clpipe_postproc_dir / "clpipe_config.json"
+    config: ProjectOptions = ProjectOptions.load(config_file_path)
+    config.roi_extraction.atlases = ["power"]
+    config.roi_extraction.target_directory = str(
+        clpipe_postproc_dir / "data_postproc" / "default"
+    )
+    config.roi_extraction.output_directory = str(tmp_path / "roi")
+    config.roi_extraction.output_format = "npz"
+    config_file_path = tmp_path / "clpipe_config.json"
+    config.dump(config_file_path)
+
+    fmri_roi_extraction(
+        subjects=["1"], single=True, config_file=config_file_path, task="gonogo"
+    )
+    consolidate_roi_timeseries(subjects=["1"], config_file=config_file_path)
+
+    store = read_store(tmp_path / "roi" / "power" / "atlas-power_timeseries.npz")
+    assert set(store["sub"]) == {"1"}
+    assert set(store["task"]) == {"gonogo"}
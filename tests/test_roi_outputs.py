@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from clpipe.roi_outputs import *
+
+IMAGE_NAME = "sub-{subject}_task-rest_run-{run}_desc-postproc_bold"
+
+
+def write_image_timeseries(directory, subject, run, output_format, value=0.0):
+    image_name = IMAGE_NAME.format(subject=subject, run=run)
+    path = directory / (
+        f"{image_name}_atlas-test{OUTPUT_EXTENSIONS[output_format]}"
+    )
+    write_timeseries(
+        path,
+        np.full((4, 3), value),
+        output_format,
+        rois=[2, 5, 7],
+        metadata={"atlas": "test", "entities": get_image_entities(image_name)},
+    )
+    return path
+
+
+def test_get_image_entities():
+    assert get_image_entities(IMAGE_NAME.format(subject="01", run=2)) == {
+        "sub": "01",
+        "task": "rest",
+        "run": "2",
+        "desc": "postproc",
+    }
+
+
+@pytest.mark.parametrize("output_format", ["npz", "parquet", "feather"])
+def test_timeseries_metadata(tmp_path, output_format):
+    """Formats other than CSV keep the ROIs and the image's entities."""
+    if output_format in ARROW_FORMATS:
+        pytest.importorskip("pyarrow")
+    path = write_image_timeseries(tmp_path, "01", 1, output_format, value=1.5)
+
+    frame, metadata = read_timeseries(path)
+
+    assert list(frame.columns) == ["2", "5", "7"]
+    assert np.allclose(frame.to_numpy(), 1.5)
+    assert metadata["entities"]["sub"] == "01"
+
+
+def test_timeseries_csv_unchanged(tmp_path):
+    """CSV timeseries have no header, as before."""
+    path = write_image_timeseries(tmp_path, "01", 1, "csv")
+
+    assert np.loadtxt(path, delimiter=",").shape == (4, 3)
+
+
+@pytest.mark.parametrize("output_format", ["csv", "npz", "parquet"])
+def test_consolidate_timeseries(tmp_path, output_format):
+    """Stores gather images with their entities, and re-added subjects replace
+    their rows."""
+    if output_format in ARROW_FORMATS:
+        pytest.importorskip("pyarrow")
+    store_path = get_store_path(tmp_path, "test", output_format)
+    consolidate_timeseries(
+        [
+            write_image_timeseries(tmp_path, "01", 1, output_format),
+            write_image_timeseries(tmp_path, "01", 2, output_format),
+        ],
+        store_path,
+    )
+    consolidate_timeseries(
+        [write_image_timeseries(tmp_path, "02", 1, output_format)], store_path
+    )
+    consolidate_timeseries(
+        [write_image_timeseries(tmp_path, "01", 1, output_format, value=3.0)],
+        store_path,
+    )
+
+    store = read_store(store_path)
+
+    assert len(store) == 8
+    assert list(store.columns[:4]) == ["sub", "task", "run", "desc"]
+    assert store["timepoint"].tolist() == [0, 1, 2, 3] * 2
+    assert np.allclose(store.loc[store["sub"] == "01"].iloc[:, -3:], 3.0)
@@ -0,0 +1,93 @@
+import warnings
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+with warnings.catch_warnings():
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    from nilearn.input_data import NiftiLabelsMasker, NiftiSpheresMasker
+
+from clpipe.roi_weights import *
+
+AFFINE = np.diag([2.0, 2.0, 2.0, 1.0])
+
+
+@pytest.fixture()
+def image(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.normal(100, 10, size=(10, 10, 8, 6))
+    return nib.Nifti1Image(data, AFFINE)
+
+
+@pytest.fixture()
+def label_atlas(tmp_path):
+    labels = np.zeros((10, 10, 8), dtype=np.int16)
+    labels[:5, :, :4] = 1
+    labels[5:, :, :4] = 2
+    labels[:, :5, 4:] = 3
+    path = tmp_path / "labels.nii.gz"
+    nib.save(nib.Nifti1Image(labels, AFFINE), path)
+    return path
+
+
+@pytest.fixture()
+def mask(image):
+    mask = np.zeros(image.shape[:3], dtype=np.uint8)
+    mask[2:8, 2:8, 2:6] = 1
+    return nib.Nifti1Image(mask, AFFINE)
+
+
+def test_label_weights_match_masker(image, label_atlas, mask):
+    """Weighted extraction of a label atlas matches nilearn's labels masker."""
+    expected = NiftiLabelsMasker(str(label_atlas), mask_img=mask).fit_transform(image)
+
+    weights, rois = load_atlas_weights(label_atlas, "label", image, mask_img=mask)
+
+    assert np.allclose(extract_timeseries(image, weights), expected)
+    assert list(rois) == [1, 2, 3]
+
+
+def test_sphere_weights_match_masker(image, tmp_path):
+    """Weighted extraction of spheres matches nilearn's spheres masker, including
+    its error for empty spheres."""
+    seeds = tmp_path / "seeds.txt"
+    np.savetxt(seeds, [[4, 4, 4], [12, 12, 8]])
+    expected = NiftiSpheresMasker(np.loadtxt(seeds), 3).fit_transform(image)
+
+    weights, _ = load_atlas_weights(seeds, "sphere", image, sphere_radius=3)
+
+    assert np.allclose(extract_timeseries(image, weights), expected)
+
+    np.savetxt(seeds, [[4, 4, 4], [100, 100, 100]])
+    with pytest.raises(ValueError):
+        load_atlas_weights(seeds, "sphere", image, sphere_radius=3)
+
+
+def test_atlas_weights_cache(image, label_atlas, mask, tmp_path):
+    """Weights are cached once per grid and mask, and reused."""
+    cache_dir = tmp_path / "cache"
+
+    weights, rois = load_atlas_weights(
+        label_atlas, "label", image, cache_dir, mask_img=mask
+    )
+    cached, cached_rois = load_atlas_weights(
+        label_atlas, "label", image, cache_dir, mask_img=mask
+    )
+    load_atlas_weights(label_atlas, "label", image, cache_dir)
+
+    assert len(list(cache_dir.glob(f"*{WEIGHTS_SUFFIX}"))) == 2
+    assert (weights != cached).nnz == 0
+    assert list(cached_rois) == list(rois)
+
+
+def test_roi_coverage(image, label_atlas, mask):
+    """Coverage is the proportion of each label's voxels within the mask."""
+    weights, _ = load_atlas_weights(label_atlas, "label", image)
+
+    coverage = get_roi_coverage(weights, mask, image)
+
+    labels = np.asanyarray(nib.load(label_atlas).dataobj)
+    mask_data = np.asanyarray(mask.dataobj) > 0
+    expected = [mask_data[labels == label].mean() for label in (1, 2, 3)]
+    assert np.allclose(coverage, expected)